@@ -4,15 +4,30 @@ Initialization module for the Le Stats Sportif application.
 This module creates and configures the Flask webserver, initializes the data ingestor,
 and sets up the task runner thread pool.
 """
+import os
+
+# Standalone workers (worker.py) and the benchmarks only use the data ingestor and
+# the broker, they must not start a webserver of their own
+STANDALONE = os.environ.get('LESTATS_ROLE', 'server') != 'server'
+
+# The dataset served by default, not shipped with the sources
+DATASET = os.environ.get('LESTATS_DATASET', './nutrition_activity_obesity_usa_subset.csv')
+
 # for the webserver
-if __name__ != "unittests.TestWebserver":
-    import os
+if __name__ != "unittests.TestWebserver" and not STANDALONE:
     import logging
-    from logging.handlers import RotatingFileHandler
-    import time
     from flask import Flask
     from app.data_ingestor import DataIngestor
     from app.task_runner import ThreadPool
+    from app.fair_share import create_rate_limiter
+    from app.profiler import ProfileSession
+    from app.memory import AllocationTracker
+    from app.log_pipeline import setup_logging
+    from app.warmup import create_materializer
+    from app.datasets import create_registry
+    if not os.path.exists(DATASET):
+        raise FileNotFoundError(f"Dataset {DATASET} not found: download it there, or set "
+                                f"LESTATS_DATASET to the path of the CSV file to serve")
     if not os.path.exists('results'):
         os.mkdir('results')
 
@@ -21,27 +36,32 @@ if __name__ != "unittests.TestWebserver":
     webserver.logger = logging.getLogger(__name__)
     # Set the logging level to INFO
     webserver.logger.setLevel(logging.INFO)
-    # Check if the logs directory exists, if not create it
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    # Create a rotating file handler for logging
-    handler = RotatingFileHandler('logs/webserver.log', maxBytes = 10000, backupCount = 10)
-    # Set the timezone to UTC
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    formatter.converter = time.gmtime
-    # Add the formatter to the handler
-    handler.setFormatter(formatter)
-    # Add the handler to the logger
-    webserver.logger.addHandler(handler)
-    webserver.logger.info("Webserver started")
-
     webserver.tasks_runner = ThreadPool()
-    webserver.tasks_runner.start()
+    webserver.rate_limiter = create_rate_limiter()
+    webserver.profiler = ProfileSession()
+    webserver.memory_tracker = AllocationTracker()
+    # Forwards a graceful shutdown to the other processes of a multi-process server
+    webserver.broadcast_shutdown = None
+    # In multi-process mode every forked process starts its own logging and workers,
+    # see app/multiprocess.py
+    if int(os.environ.get('LESTATS_PROCESSES', 1)) <= 1:
+        # Log through a queue, a background thread writes the records to the rotating file
+        webserver.log_listener = setup_logging(webserver.logger, 'logs/webserver.log')
+        webserver.logger.info("Webserver started")
+        webserver.tasks_runner.start()
 
-    webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
-    webserver.job_counter = 1
+    webserver.data_ingestor = DataIngestor(DATASET)
+    # Other datasets are loaded when a request names them, see app/datasets.py
+    webserver.datasets = create_registry(webserver.data_ingestor, DATASET)
+    # Optionally precompute the results of every question, reported by /api/ready
+    webserver.warmup = create_materializer(webserver.data_ingestor)
+    if webserver.warmup is not None:
+        if int(os.environ.get('LESTATS_PROCESSES', 1)) <= 1:
+            webserver.warmup.start()
+        else:
+            # Warm up before forking, so every process inherits all the results
+            webserver.warmup.run()
     from app import routes
 # for the unittests
-else:
+elif not STANDALONE:
     data_ingestor = DataIngestor("./test.csv")
-
@@ -0,0 +1,332 @@
+"""
+This module implements the job broker used by out-of-process workers.
+The broker is a local SQLite database in WAL mode: the API server submits the
+statistic jobs to it, standalone workers (worker.py) register, lease jobs, send
+heartbeats and push the results back, and the server collects the results.
+Jobs leased by a worker that stopped sending heartbeats are delivered again.
+As WAL mode needs the shared memory of a single host, the workers run on the same
+host as the server; the database can not be shared over a network filesystem.
+"""
+from threading import Event, Thread
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from app.shared_store import SqliteDatabase
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks for dead workers
+REAP_INTERVAL = 1.0
+
+
+class SqliteBroker(SqliteDatabase):
+    """
+    Job queue shared by the API server and the workers through SQLite.
+
+    A job is 'queued' until a worker leases it, then 'leased' until the worker
+    completes it as 'done' or 'error'. The server collects completed jobs, which
+    removes them from the broker. Only one API server process may use a broker.
+    """
+    def __init__(self, path, worker_timeout=5.0, max_deliveries=3):
+        super().__init__(path)
+        self.worker_timeout = worker_timeout
+        self.max_deliveries = max_deliveries
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'job_id INTEGER PRIMARY KEY, endpoint TEXT NOT NULL, '
+                           'args TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, '
+                           'deliveries INTEGER NOT NULL DEFAULT 0, payload TEXT, reason TEXT)')
+        connection.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, job_id)')
+        connection.execute('CREATE TABLE IF NOT EXISTS workers ('
+                           'worker_id TEXT PRIMARY KEY, pid INTEGER, host TEXT, '
+                           'registered_at REAL, heartbeat REAL, completed INTEGER DEFAULT 0)')
+
+    def submit(self, job_id, endpoint, args):
+        """
+        Queue a job for the workers.
+
+        Args:
+            job_id (int): ID of the job
+            endpoint (str): Name of the statistic, a DataIngestor method
+            args (list): Arguments of the statistic
+        """
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, endpoint, args, state) VALUES (?, ?, ?, 'queued')",
+            (job_id, endpoint, json.dumps(args)))
+
+    def purge(self):
+        """
+        Drop the jobs left by a previous run of the server, whose IDs will be reused.
+        """
+        self._connection().execute('DELETE FROM jobs')
+
+    def cancel(self, job_id):
+        """
+        Remove a job that no worker leased yet.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            bool: True if the job was removed, False if it was already leased
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE job_id = ? AND state = 'queued'", (job_id,))
+        return cursor.rowcount == 1
+
+    def register(self, worker_id):
+        """
+        Register a worker, or refresh its registration.
+
+        Args:
+            worker_id (str): Unique name of the worker
+        """
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO workers (worker_id, pid, host, registered_at, heartbeat) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (worker_id, os.getpid(), socket.gethostname(), now, now))
+
+    def heartbeat(self, worker_id):
+        """
+        Tell the broker a worker is still alive.
+
+        Args:
+            worker_id (str): Unique name of the worker
+
+        Returns:
+            bool: False if the worker was declared dead and must register again
+        """
+        cursor = self._connection().execute(
+            'UPDATE workers SET heartbeat = ? WHERE worker_id = ?', (time.time(), worker_id))
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id):
+        """
+        Take the oldest queued job.
+
+        Args:
+            worker_id (str): Unique name of the worker taking the job
+
+        Returns:
+            tuple: The job ID, endpoint and arguments, or None if no job is queued
+        """
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock, so two workers never lease the same job
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                "SELECT job_id, endpoint, args FROM jobs WHERE state = 'queued' "
+                "ORDER BY job_id LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = 'leased', worker = ?, deliveries = deliveries + 1 "
+                    "WHERE job_id = ?", (worker_id, row[0]))
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, job_id, worker_id, status, payload=None, reason=None):
+        """
+        Push back the outcome of a leased job.
+
+        Args:
+            job_id (int): ID of the job
+            worker_id (str): Unique name of the worker that leased the job
+            status (str): 'done' or 'error'
+            payload (str): The result serialized as JSON, if done
+            reason (str): Why the job failed, if error
+
+        Returns:
+            bool: False if the job was taken away from the worker in the meantime
+        """
+        connection = self._connection()
+        cursor = connection.execute(
+            "UPDATE jobs SET state = ?, payload = ?, reason = ? "
+            "WHERE job_id = ? AND worker = ? AND state = 'leased'",
+            (status, payload, reason, job_id, worker_id))
+        if cursor.rowcount != 1:
+            return False
+        connection.execute('UPDATE workers SET completed = completed + 1 WHERE worker_id = ?',
+                           (worker_id,))
+        return True
+
+    def leased(self):
+        """
+        List the jobs being executed by a worker.
+
+        Returns:
+            list: IDs of the leased jobs, at most one per worker
+        """
+        return [row[0] for row in self._connection().execute(
+            "SELECT job_id FROM jobs WHERE state = 'leased'")]
+
+    def collect(self, limit=100):
+        """
+        Take the completed jobs out of the broker.
+
+        Args:
+            limit (int): Maximum number of jobs to collect
+
+        Returns:
+            list: (job_id, status, payload, reason) tuples
+        """
+        connection = self._connection()
+        # Completed jobs only change when collected, and only the server collects them,
+        # so an idle poll is a plain read that does not take the write lock
+        rows = connection.execute(
+            "SELECT job_id, state, payload, reason FROM jobs "
+            "WHERE state IN ('done', 'error') LIMIT ?", (limit,)).fetchall()
+        if not rows:
+            return rows
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('DELETE FROM jobs WHERE job_id = ?',
+                                   [(row[0],) for row in rows])
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        return rows
+
+    def reap(self):
+        """
+        Forget the workers whose last heartbeat is older than worker_timeout.
+
+        Their leased jobs are queued again, unless they were already delivered
+        max_deliveries times, in which case they fail.
+
+        Returns:
+            list: Names of the dead workers
+        """
+        connection = self._connection()
+        deadline = time.time() - self.worker_timeout
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            dead = [row[0] for row in connection.execute(
+                'SELECT worker_id FROM workers WHERE heartbeat < ?', (deadline,))]
+            for worker_id in dead:
+                connection.execute(
+                    "UPDATE jobs SET state = 'error', reason = 'Job lost by its workers' "
+                    "WHERE worker = ? AND state = 'leased' AND deliveries >= ?",
+                    (worker_id, self.max_deliveries))
+                connection.execute(
+                    "UPDATE jobs SET state = 'queued', worker = NULL "
+                    "WHERE worker = ? AND state = 'leased'", (worker_id,))
+                connection.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        return dead
+
+    def workers(self):
+        """
+        List the registered workers.
+
+        Returns:
+            list: Name, pid, host, seconds since the last heartbeat and completed
+                  jobs of every worker
+        """
+        now = time.time()
+        rows = self._connection().execute(
+            'SELECT worker_id, pid, host, heartbeat, completed FROM workers ORDER BY worker_id')
+        return [{'worker_id': worker_id, 'pid': pid, 'host': host,
+                 'last_heartbeat': round(now - heartbeat, 3), 'completed': completed}
+                for worker_id, pid, host, heartbeat, completed in rows]
+
+
+def create_broker():
+    """
+    Create the broker selected by the environment.
+
+    LESTATS_BROKER is the path of the broker database; when it is not set, jobs
+    run in the thread pool of the server. LESTATS_WORKER_TIMEOUT is the number of
+    seconds without heartbeat after which a worker is declared dead, and
+    LESTATS_MAX_DELIVERIES the number of times a job is delivered before it fails.
+
+    Returns:
+        SqliteBroker: The configured broker, or None
+    """
+    path = os.environ.get('LESTATS_BROKER')
+    if not path:
+        return None
+    return SqliteBroker(path, float(os.environ.get('LESTATS_WORKER_TIMEOUT', 5.0)),
+                        int(os.environ.get('LESTATS_MAX_DELIVERIES', 3)))
+
+
+class ResultCollector(Thread):
+    """
+    Server thread that brings the results of the remote workers into the thread pool.
+
+    It polls the broker for leased and completed jobs and, about once a second,
+    re-delivers the jobs of the workers that died. Polls start LESTATS_BROKER_POLL
+    seconds apart and back off up to LESTATS_BROKER_POLL_MAX seconds while no job
+    completes; with no job in flight, the collector sleeps until one is submitted.
+    The supervisor of the thread pool replaces the collector if it dies.
+    """
+    def __init__(self, threadpool):
+        Thread.__init__(self, daemon = True)
+        self.threadpool = threadpool
+        self.interval = float(os.environ.get('LESTATS_BROKER_POLL', 0.01))
+        self.max_interval = float(os.environ.get('LESTATS_BROKER_POLL_MAX', 0.5))
+        self.wake = Event()
+        self.last_reap = 0.0
+
+    def poll(self):
+        """
+        Mark the leased jobs as running, collect the completed jobs once, and reap
+        the dead workers if it is time to.
+
+        Returns:
+            int: Number of jobs collected
+        """
+        broker = self.threadpool.broker
+        now = time.monotonic()
+        if now - self.last_reap >= REAP_INTERVAL:
+            self.last_reap = now
+            for worker_id in broker.reap():
+                logger.error("Worker %s stopped sending heartbeats, re-delivering its jobs",
+                             worker_id)
+
+        for job_id in broker.leased():
+            self.threadpool.start_remote(job_id)
+        completed = broker.collect()
+        for job_id, status, payload, reason in completed:
+            self.threadpool.complete_remote(job_id, status, payload, reason)
+        return len(completed)
+
+    def run(self):
+        """
+        Main execution method for the collector.
+
+        Polls the broker until graceful shutdown is requested.
+        """
+        delay = self.interval
+        while not self.threadpool.graceful_shutdown.is_set():
+            try:
+                if self.poll() > 0:
+                    delay = self.interval
+                    continue
+            # A locked or broken database must not stop the collection
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.error("Broker poll failed: %r", e)
+                self.threadpool.graceful_shutdown.wait(1.0)
+                continue
+
+            # Without jobs in flight only the dead workers need a look, once in a while
+            timeout = delay if self.threadpool.remaining_jobs else REAP_INTERVAL
+            if self.wake.wait(timeout):
+                self.wake.clear()
+                delay = self.interval
+            else:
+                delay = min(delay * 2, self.max_interval)
@@ -0,0 +1,123 @@
+"""
+This module correlates the questions, or the states, of a dataset.
+
+The mean of every (state, question) pair, the same as states_mean, is pivoted
+into a dense state x question matrix, NaN where a state has no value for a
+question. Correlations are computed on the pairs of rows where both values are
+present, for all the pairs at once with a few matrix products. The pivot and the
+correlation matrices are computed on first use and kept: a DataIngestor never
+changes its dataset, so they stay valid for its whole life.
+"""
+from threading import Lock
+import math
+import numpy as np
+from app.tracing import span
+
+# What can be correlated, and the axis of the pivot holding its labels
+CORRELATIONS = {'question': 1, 'state': 0}
+
+
+def pairwise_correlation(matrix):
+    """
+    Compute the Pearson correlation of every pair of columns of a matrix.
+
+    Every pair is correlated on the rows where both columns have a value, like
+    pandas.DataFrame.corr(). Pairs with less than 2 such rows, or without any
+    variance on them, have no correlation.
+
+    Args:
+        matrix (numpy.ndarray): Observations as rows, variables as columns, NaN if missing
+
+    Returns:
+        tuple: Matrix of the correlations, NaN when undefined, and matrix of the
+               number of rows used for every pair
+    """
+    present = (~np.isnan(matrix)).astype(float)
+    values = np.where(present > 0, matrix, 0.0)
+
+    # For the pair (i, j), sums over the rows where both i and j have a value
+    count = present.T @ present
+    sum_i = values.T @ present
+    sum_ii = (values * values).T @ present
+    sum_ij = values.T @ values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sum_ij - sum_i * sum_i.T / count
+        variance_i = sum_ii - sum_i * sum_i / count
+        correlation = covariance / np.sqrt(variance_i * variance_i.T)
+    # Rounding errors can leave constant columns with a tiny variance
+    correlation[(count < 2) | (variance_i <= 1e-12) | (variance_i.T <= 1e-12)] = np.nan
+    return np.clip(correlation, -1.0, 1.0), count.astype(int)
+
+
+class StatePivot:
+    """
+    The per-state means of all the questions of a dataset, and their correlations.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.states = None
+        self.questions = None
+        self.matrix = None
+        self.results = {}
+        self.lock = Lock()
+
+    def prepare(self):
+        """
+        Pivot the per-state means of all the questions, once.
+        """
+        if self.matrix is not None:
+            return
+        with self.lock:
+            if self.matrix is not None:
+                return
+            means = self.df.groupby(['LocationDesc', 'Question'])['Data_Value'].mean() \
+                .unstack('Question')
+            self.states = [str(state) for state in means.index]
+            self.questions = [str(question) for question in means.columns]
+            self.matrix = means.to_numpy(dtype=float)
+
+    def correlation(self, by):
+        """
+        Correlate the questions, or the states, of the dataset.
+
+        Questions are correlated across the states. States are correlated across
+        the questions, after every question is standardized, so that questions
+        with bigger values do not weigh more in the similarity of two states.
+
+        Args:
+            by (str): 'question' or 'state'
+
+        Returns:
+            dict: The labels, the matrix of their correlations (None when undefined)
+                  and the number of values every correlation was computed on
+
+        Raises:
+            ValueError: If by is not 'question' or 'state'
+        """
+        if by not in CORRELATIONS:
+            raise ValueError(f"Can not correlate by '{by}', use 'question' or 'state'.")
+        if by in self.results:
+            return self.results[by]
+
+        with span('pivot'):
+            self.prepare()
+        with span('correlate', by=by):
+            matrix = self.matrix
+            if by == 'state':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    matrix = (matrix - np.nanmean(matrix, axis=0)) / np.nanstd(matrix, axis=0)
+                matrix = matrix.T
+            correlation, count = pairwise_correlation(matrix)
+
+        with span('to_dict'):
+            result = {
+                'by': by,
+                'labels': self.questions if by == 'question' else self.states,
+                'matrix': [[None if math.isnan(value) else value for value in row]
+                           for row in correlation.tolist()],
+                'observations': count.tolist(),
+            }
+        with self.lock:
+            self.results[by] = result
+        return result
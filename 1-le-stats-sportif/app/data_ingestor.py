@@ -2,8 +2,16 @@
 This module handles the ingestion and processing of nutritional and health data from CSV files.
 It provides various statistical calculations on the data, such as mean values by state,
 best and worst performers, and comparisons to global means.
+Every method records its sub-steps (validation, filter, groupby, conversion to a
+dict) as spans of the trace of the job that calls it, see app/tracing.py.
+The statistics can also be estimated from a stratified sample, see app/sampling.py.
 """
 import pandas as pd
+from app.correlation import StatePivot
+from app.query import QueryEngine, parse_query
+from app.sampling import StratifiedSample
+from app.trend import TrendEngine
+from app.tracing import span
 
 class DataIngestor:
     """
@@ -21,6 +29,8 @@ class DataIngestor:
             if col not in self.df.columns:
                 raise ValueError(f"Missing required column: {col} in CSV file.")
 
+        self.query_engine = QueryEngine(self.df)
+        self.pivot = StatePivot(self.df)
 
         self.questions_best_is_min = [
             'Percent of adults aged 18 years and older who have an overweight classification',
@@ -48,12 +58,17 @@ class DataIngestor:
             'days a week',
         ]
 
-    def states_mean(self, question):
+        self.sample = StratifiedSample(self.df, self.questions_best_is_max)
+        self.trends = TrendEngine(self.df, self.questions_best_is_max)
+
+    def states_mean(self, question, approx=None):
         """
         Calculate the mean value for each state for a specific question.
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary mapping state names to their mean values, sorted by value
@@ -61,27 +76,35 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('states_mean', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
         # Filter the DataFrame for the specific question
-        filtered_data = self.df[self.df['Question'] == question]
+        with span('filter'):
+            filtered_data = self.df[self.df['Question'] == question]
         # Group by 'LocationDesc' and calculate the mean of 'Data_Value'
-        states_mean = filtered_data.groupby('LocationDesc')['Data_Value'].mean()
-        # Sort the results
-        states_mean = states_mean.sort_values()
+        with span('groupby'):
+            states_mean = filtered_data.groupby('LocationDesc')['Data_Value'].mean()
+            # Sort the results
+            states_mean = states_mean.sort_values()
 
         # Convert to a dictionary and return
-        states_mean_dict = states_mean.to_dict()
+        with span('to_dict'):
+            states_mean_dict = states_mean.to_dict()
         return states_mean_dict
 
-    def state_mean(self, question, state):
+    def state_mean(self, question, state, approx=None):
         """
         Calculate the mean value for a specific state and question.
         
         Args:
             question (str): The health metric question to analyze
             state (str): The state name to calculate the mean for
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary with the state name as key and its mean value
@@ -89,30 +112,37 @@ class DataIngestor:
         Raises:
             ValueError: If the question or state is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('state_mean', [question, state], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
-        if state not in self.df['LocationDesc'].unique():
-            raise ValueError(f"State '{state}' not found in the dataset.")
+            if state not in self.df['LocationDesc'].unique():
+                raise ValueError(f"State '{state}' not found in the dataset.")
 
         # Filter the DataFrame for the specific question and state
-        filtered_data = self.df[(self.df['Question'] == question) &
-                                (self.df['LocationDesc'] == state)]
+        with span('filter'):
+            filtered_data = self.df[(self.df['Question'] == question) &
+                                    (self.df['LocationDesc'] == state)]
         if filtered_data.empty:
             raise ValueError(f"No data found for question '{question}' in state '{state}'.")
 
         # Calculate the mean of 'Data_Value'
-        mean_value = filtered_data['Data_Value'].mean()
+        with span('mean'):
+            mean_value = filtered_data['Data_Value'].mean()
         return {
             state: mean_value
         }
 
-    def global_mean(self, question):
+    def global_mean(self, question, approx=None):
         """
         Calculate the global mean value for a specific question across all states.
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary with 'global_mean' as key and the mean value
@@ -120,22 +150,29 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('global_mean', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
         # Filter the DataFrame for the specific question
-        filtered_data = self.df[self.df['Question'] == question]
-        global_mean = filtered_data['Data_Value'].mean()
+        with span('filter'):
+            filtered_data = self.df[self.df['Question'] == question]
+        with span('mean'):
+            global_mean = filtered_data['Data_Value'].mean()
         return {
             "global_mean": global_mean
         }
 
-    def diff_from_mean(self, question):
+    def diff_from_mean(self, question, approx=None):
         """
         Calculate the difference between the global mean and each state's mean for a question.
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary mapping state names to their difference from the global mean
@@ -143,8 +180,11 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('diff_from_mean', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
         global_mean = self.global_mean(question)['global_mean']
         states_mean = self.states_mean(question)
@@ -152,13 +192,15 @@ class DataIngestor:
         differences = {state: global_mean - state_mean for state, state_mean in states_mean.items()}
         return differences
 
-    def state_diff_from_mean(self, question, state):
+    def state_diff_from_mean(self, question, state, approx=None):
         """
         Calculate the difference between the global mean and a specific state's mean.
         
         Args:
             question (str): The health metric question to analyze
             state (str): The state name to calculate the difference for
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary with the state name as key and its difference from the global mean
@@ -166,11 +208,14 @@ class DataIngestor:
         Raises:
             ValueError: If the question or state is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
-
-        if state not in self.df['LocationDesc'].unique():
-            raise ValueError(f"State '{state}' not found in the dataset.")
+        if approx:
+            return self.approximate('state_diff_from_mean', [question, state], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
+
+            if state not in self.df['LocationDesc'].unique():
+                raise ValueError(f"State '{state}' not found in the dataset.")
         # Calculate the difference from the global mean for a specific state
         global_mean = self.global_mean(question)['global_mean']
         state_mean = self.state_mean(question, state)[state]
@@ -178,12 +223,14 @@ class DataIngestor:
             state: global_mean - state_mean
         }
 
-    def mean_by_category(self, question):
+    def mean_by_category(self, question, approx=None):
         """
         Calculate mean values grouped by stratification categories for all states.
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary mapping tuples of (location, category, stratification) to mean values
@@ -191,30 +238,38 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('mean_by_category', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
         # Filter the DataFrame for the specific question
-        filtered_data = self.df[self.df['Question'] == question]
-        grouped = filtered_data.groupby(['LocationDesc',
-                                         'StratificationCategory1', 'Stratification1'])
-        means = grouped['Data_Value'].mean()
+        with span('filter'):
+            filtered_data = self.df[self.df['Question'] == question]
+        with span('groupby'):
+            grouped = filtered_data.groupby(['LocationDesc',
+                                             'StratificationCategory1', 'Stratification1'])
+            means = grouped['Data_Value'].mean()
 
         # Convert the result to a dictionary with the desired structure
-        result_dict = {
-            str((location, cat1, cat2)): value
-            for (location, cat1, cat2), value in means.items()
-        }
+        with span('to_dict'):
+            result_dict = {
+                str((location, cat1, cat2)): value
+                for (location, cat1, cat2), value in means.items()
+            }
 
         return result_dict
 
-    def state_mean_by_category(self, question, state):
+    def state_mean_by_category(self, question, state, approx=None):
         """
         Calculate mean values grouped by stratification categories for a specific state.
         
         Args:
             question (str): The health metric question to analyze
             state (str): The state name to calculate the means for
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Nested dictionary with state as outer key and (category, stratification) 
@@ -223,30 +278,36 @@ class DataIngestor:
         Raises:
             ValueError: If the question or state is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('state_mean_by_category', [question, state], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
 
-        if state not in self.df['LocationDesc'].unique():
-            raise ValueError(f"State '{state}' not found in the dataset.")
+            if state not in self.df['LocationDesc'].unique():
+                raise ValueError(f"State '{state}' not found in the dataset.")
 
         # Filter the DataFrame for the specific question and state
-        filtered_data = self.df[(self.df['Question'] == question) &
-                                (self.df['LocationDesc'] == state)]
-        grouped = filtered_data.groupby(['StratificationCategory1', 'Stratification1'])
-        means = grouped['Data_Value'].mean()
+        with span('filter'):
+            filtered_data = self.df[(self.df['Question'] == question) &
+                                    (self.df['LocationDesc'] == state)]
+        with span('groupby'):
+            grouped = filtered_data.groupby(['StratificationCategory1', 'Stratification1'])
+            means = grouped['Data_Value'].mean()
 
         # Convert the result to a dictionary with the desired structure
-        result_dict = {
-            state: {
-                str((cat1, cat2)): value
-                for (cat1, cat2), value in means.items()
+        with span('to_dict'):
+            result_dict = {
+                state: {
+                    str((cat1, cat2)): value
+                    for (cat1, cat2), value in means.items()
+                }
             }
-        }
 
         return result_dict
 
 
-    def best5(self, question):
+    def best5(self, question, approx=None):
         """
         Get the top 5 performing states for a specific question.
         
@@ -255,6 +316,8 @@ class DataIngestor:
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary of the top 5 states and their values
@@ -262,8 +325,11 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('best5', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
         # Calculate the mean for each state and return the top 5
         states_mean = self.states_mean(question)
         if question in self.questions_best_is_max:
@@ -271,7 +337,7 @@ class DataIngestor:
 
         return dict(sorted(states_mean.items(), key=lambda item: item[1])[:5])
 
-    def worst5(self, question):
+    def worst5(self, question, approx=None):
         """
         Get the 5 worst performing states for a specific question.
         
@@ -280,6 +346,8 @@ class DataIngestor:
         
         Args:
             question (str): The health metric question to analyze
+            approx: Estimate the result from the stratified sample, with a target
+                    'error' or a 'time_ms' budget (see app/sampling.py)
             
         Returns:
             dict: Dictionary of the 5 worst states and their values
@@ -287,11 +355,88 @@ class DataIngestor:
         Raises:
             ValueError: If the question is not found in the dataset
         """
-        if question not in self.df['Question'].unique():
-            raise ValueError(f"Question '{question}' not found in the dataset.")
+        if approx:
+            return self.approximate('worst5', [question], approx)
+        with span('validate'):
+            if question not in self.df['Question'].unique():
+                raise ValueError(f"Question '{question}' not found in the dataset.")
         # Calculate the mean for each state and return the bottom 5
         states_mean = self.states_mean(question)
         if question in self.questions_best_is_max:
             return dict(sorted(states_mean.items(), key=lambda item: item[1])[:5])
 
         return dict(sorted(states_mean.items(), key=lambda item: item[1], reverse=True)[:5])
+
+    def query(self, spec):
+        """
+        Answer a declarative query on the dataset, see app/query.py.
+
+        Args:
+            spec (dict): Filters, group-by dimensions and aggregates of the query
+
+        Returns:
+            dict: One record per group, or the plan of the query if it asked to explain it
+
+        Raises:
+            ValueError: If the spec is malformed
+        """
+        with span('validate'):
+            query = parse_query(spec)
+        return self.query_engine.execute(query)
+
+    def correlation(self, by='question'):
+        """
+        Correlate the per-state means of all the questions, see app/correlation.py.
+
+        Args:
+            by (str): 'question' for the question x question correlations across the
+                      states, 'state' for the state x state similarities across the
+                      questions
+
+        Returns:
+            dict: The labels, the matrix of their correlations and the number of
+                  values every correlation was computed on
+
+        Raises:
+            ValueError: If by is not 'question' or 'state'
+        """
+        return self.pivot.correlation(by)
+
+    def trend(self, question, state=None, stratification=None):
+        """
+        Calculate the yearly means and the least-squares trend of the states for a
+        question, see app/trend.py.
+
+        Args:
+            question (str): The health metric question to analyze
+            state (str): Only this state, None for all of them
+            stratification (str): Only use the rows of this Stratification1
+
+        Returns:
+            dict: The years, and the yearly means, slope per year, intercept and
+                  direction (improving or worsening) of every state
+
+        Raises:
+            ValueError: If the question, the state or the stratification is not found
+        """
+        return self.trends.trend(question, state, stratification)
+
+    def approximate(self, endpoint, args, approx):
+        """
+        Estimate a statistic from the stratified sample of the dataset.
+
+        Args:
+            endpoint (str): Name of the statistic method
+            args (list): Arguments of the statistic
+            approx: True for the whole sample, or a target 'error' or a 'time_ms' budget
+
+        Returns:
+            dict: The estimates and their 95% confidence intervals, or the exact result
+                  when the sample can not reach the target error
+
+        Raises:
+            ValueError: If approx is malformed, or the question or state is not found
+        """
+        with span('sample', approx=str(approx)):
+            return self.sample.estimate(endpoint, args, approx,
+                                        lambda: getattr(self, endpoint)(*args))
@@ -0,0 +1,290 @@
+"""
+This module implements the registry of the datasets served by one server.
+
+Datasets are registered by name with the path of their CSV file, and loaded by the
+first job that asks for them. The loaded datasets are kept in least recently used
+order; when their memory goes over the budget, the least recently used ones are
+evicted, and loaded again by the next job asking for them. Every DataIngestor
+keeps its caches (cube, sample, pivot, trends), so they go away with it. They are
+charged to the budget too: the jobs re-measure their dataset when they built a
+cache, see refresh().
+
+The default dataset is loaded at startup and never evicted: it answers the
+requests without a 'dataset' parameter, it is the one warmed up and the only one
+the remote workers know.
+"""
+from collections import OrderedDict
+from threading import Lock
+import logging
+import os
+import time
+from app.data_ingestor import DataIngestor
+from app.memory import cache_memory
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Name of the dataset of the requests that do not name one
+DEFAULT_DATASET = 'default'
+
+
+def frame_bytes(data_ingestor):
+    """
+    Measure the DataFrame of a loaded dataset.
+
+    Args:
+        data_ingestor (DataIngestor): The dataset
+
+    Returns:
+        int: Bytes of the DataFrame, strings included
+    """
+    return int(data_ingestor.df.memory_usage(index=True, deep=True).sum())
+
+
+def cache_state(data_ingestor):
+    """
+    Summarize which caches of a dataset are built, cheaply.
+
+    Args:
+        data_ingestor (DataIngestor): The dataset
+
+    Returns:
+        tuple: Changes whenever a cache is built or grows
+    """
+    return (data_ingestor.query_engine.cube is not None,
+            data_ingestor.sample.sample is not None,
+            len(data_ingestor.pivot.results), len(data_ingestor.trends.results))
+
+
+def measure(data_ingestor):
+    """
+    Measure a loaded dataset and its caches.
+
+    Args:
+        data_ingestor (DataIngestor): The dataset
+
+    Returns:
+        dict: The dataset, the bytes of its DataFrame and of its caches, and the
+              state of the caches measured
+    """
+    return {'data_ingestor': data_ingestor, 'frame_bytes': frame_bytes(data_ingestor),
+            'cache_bytes': cache_memory(data_ingestor)['total'],
+            'state': cache_state(data_ingestor)}
+
+
+def entry_bytes(entry):
+    """
+    Get the bytes charged to the budget for a loaded dataset.
+
+    Args:
+        entry (dict): The dataset, as measured by measure()
+
+    Returns:
+        int: Bytes of its DataFrame and caches
+    """
+    return entry['frame_bytes'] + entry['cache_bytes']
+
+
+class DatasetRegistry:
+    """
+    Loads the registered datasets on demand, within a memory budget.
+    """
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.paths = {}
+        self.loaded = OrderedDict()
+        self.pinned = set()
+        self.loading = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def register(self, name, path, data_ingestor=None):
+        """
+        Register a dataset.
+
+        Args:
+            name (str): Name of the dataset in the requests
+            path (str): Path of its CSV file
+            data_ingestor (DataIngestor): The dataset, already loaded; it is then
+                                          never evicted
+        """
+        with self.lock:
+            self.paths[name] = path
+            self.loading.setdefault(name, Lock())
+            self.counters.setdefault(name, {'loads': 0, 'hits': 0, 'evictions': 0})
+            if data_ingestor is not None:
+                self.loaded[name] = measure(data_ingestor)
+                self.pinned.add(name)
+
+    def is_loaded(self, name):
+        """
+        Check if a dataset can be used without loading it.
+
+        Args:
+            name (str): Name of the dataset
+
+        Returns:
+            bool: True if the dataset is loaded
+        """
+        with self.lock:
+            return name in self.loaded
+
+    def lookup(self, name):
+        """
+        Get a loaded dataset and mark it as the most recently used.
+
+        Must be called with the lock held.
+
+        Args:
+            name (str): Name of the dataset
+
+        Returns:
+            DataIngestor: The dataset, or None if it is not loaded
+        """
+        entry = self.loaded.get(name)
+        if entry is None:
+            return None
+        self.loaded.move_to_end(name)
+        self.counters[name]['hits'] += 1
+        return entry['data_ingestor']
+
+    def get(self, name):
+        """
+        Get a dataset, loading it if needed.
+
+        Jobs asking for a dataset that is being loaded wait for it, the other
+        datasets stay available meanwhile.
+
+        Args:
+            name (str): Name of the dataset
+
+        Returns:
+            DataIngestor: The dataset
+
+        Raises:
+            ValueError: If the dataset is not registered, or its file is invalid
+        """
+        with self.lock:
+            if name not in self.paths:
+                raise ValueError(f"Dataset '{name}' not found.")
+            data_ingestor = self.lookup(name)
+            if data_ingestor is not None:
+                return data_ingestor
+
+        with self.loading[name]:
+            with self.lock:
+                data_ingestor = self.lookup(name)
+                if data_ingestor is not None:
+                    return data_ingestor
+
+            started = time.monotonic()
+            with span('load', dataset=name):
+                data_ingestor = DataIngestor(self.paths[name])
+                entry = measure(data_ingestor)
+            logger.info("Loaded dataset %s (%s bytes) in %.2fs", name, entry_bytes(entry),
+                        time.monotonic() - started)
+
+            with self.lock:
+                self.loaded[name] = entry
+                self.counters[name]['loads'] += 1
+                self.evict(keep=name)
+        return data_ingestor
+
+    def refresh(self, name):
+        """
+        Re-measure a loaded dataset whose caches changed, and evict the least
+        recently used datasets if it no longer fits the budget.
+
+        Called after every job on the dataset; measuring only happens when the job
+        built or extended a cache, which is rare.
+
+        Args:
+            name (str): Name of the dataset
+        """
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry is None or cache_state(entry['data_ingestor']) == entry['state']:
+                return
+        # The DataFrame never changes, only the caches are measured again
+        state = cache_state(entry['data_ingestor'])
+        cache_bytes = cache_memory(entry['data_ingestor'])['total']
+        with self.lock:
+            if self.loaded.get(name) is entry:
+                entry.update(cache_bytes=cache_bytes, state=state)
+                self.evict(keep=name)
+
+    def evict(self, keep):
+        """
+        Evict the least recently used datasets until the loaded ones fit the budget.
+
+        Must be called with the lock held. Pinned datasets are never evicted.
+
+        Args:
+            keep (str): Name of the dataset just used, not evicted either
+        """
+        if not self.budget:
+            return
+        total = sum(entry_bytes(entry) for entry in self.loaded.values())
+        for name in list(self.loaded):
+            if total <= self.budget:
+                break
+            if name == keep or name in self.pinned:
+                continue
+            size = entry_bytes(self.loaded.pop(name))
+            total -= size
+            self.counters[name]['evictions'] += 1
+            logger.info("Evicted dataset %s (%s bytes)", name, size)
+
+    def stats(self):
+        """
+        Get the state of the registered datasets.
+
+        Returns:
+            dict: Memory budget and loaded bytes, and the name, path, state, bytes
+                  (of the DataFrame, the caches and both) and counters of every
+                  dataset, the loaded ones first from the least recently used
+        """
+        with self.lock:
+            datasets = []
+            for name in list(self.loaded) + [name for name in self.paths
+                                             if name not in self.loaded]:
+                entry = self.loaded.get(name)
+                datasets.append({
+                    'name': name, 'path': self.paths[name], 'loaded': entry is not None,
+                    'pinned': name in self.pinned,
+                    'bytes': entry_bytes(entry) if entry else None,
+                    'frame_bytes': entry['frame_bytes'] if entry else None,
+                    'cache_bytes': entry['cache_bytes'] if entry else None,
+                    **self.counters[name]})
+            return {
+                'budget_bytes': self.budget,
+                'loaded_bytes': sum(entry_bytes(entry) for entry in self.loaded.values()),
+                'datasets': datasets,
+            }
+
+
+def create_registry(data_ingestor, path):
+    """
+    Create the registry of the datasets configured by the environment.
+
+    DATASETS lists the datasets served besides the default one, e.g.
+    'y2019=./data/2019.csv,west=./data/west.csv', and DATASETS_MEMORY_MB is the
+    memory budget of the loaded datasets (0, the default, for no limit).
+
+    Args:
+        data_ingestor (DataIngestor): The default dataset, already loaded
+        path (str): Path of the default dataset
+
+    Returns:
+        DatasetRegistry: The registry
+    """
+    registry = DatasetRegistry(int(float(os.environ.get('DATASETS_MEMORY_MB', 0)) * 2 ** 20))
+    registry.register(DEFAULT_DATASET, path, data_ingestor)
+    for item in os.environ.get('DATASETS', '').split(','):
+        if '=' in item:
+            name, dataset_path = item.split('=', 1)
+            registry.register(name.strip(), dataset_path.strip())
+    return registry
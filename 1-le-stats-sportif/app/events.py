@@ -0,0 +1,219 @@
+"""
+This module implements the job completion notifications used by the /api/events
+Server-Sent Events stream. Workers publish an event when a job is done, failed or
+was cancelled; every subscriber gets it in its own bounded queue.
+
+Every subscriber of the stream holds a request thread for as long as it stays
+connected, so their number is capped by max_subscribers. An idle subscriber only
+costs a blocked thread and its stack, so the default cap allows a couple thousand.
+"""
+from queue import Queue, Full, Empty
+from threading import Lock
+import json
+
+# Subscribers of the event stream at most, by default
+MAX_SUBSCRIBERS = 2000
+
+
+class Subscription:
+    """
+    A single client of the event stream.
+
+    Holds the pending events of the client and, optionally, the set of job IDs
+    the client is interested in. A subscription whose queue overflows is closed,
+    so a slow client can never block the workers.
+    """
+    def __init__(self, job_ids=None, max_pending=1000):
+        self.job_ids = job_ids
+        self.queue = Queue(max_pending)
+        self.closed = False
+
+    def push(self, event):
+        """
+        Queue an event for the client without blocking.
+
+        Args:
+            event (dict): The event to deliver
+
+        Returns:
+            bool: False if the client is too slow and was closed
+        """
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except Full:
+            self.closed = True
+            return False
+
+    def next_event(self, timeout):
+        """
+        Wait for the next event of the client.
+
+        Args:
+            timeout (float): Seconds to wait before giving up
+
+        Returns:
+            dict: The next event, or None if the timeout expired
+        """
+        try:
+            return self.queue.get(timeout = timeout)
+        except Empty:
+            return None
+
+    def drain(self):
+        """
+        Take the events already queued for the client, without waiting.
+
+        Returns:
+            list: The pending events, oldest first
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except Empty:
+                return events
+
+
+class EventBus:
+    """
+    Fans job events out to the subscribers of the event stream.
+
+    Subscribers filtered by job ID are indexed by those IDs, so publishing an event
+    only touches the clients that asked for it plus the unfiltered ones. Idle
+    subscribers cost nothing besides their entry in the index.
+    """
+    def __init__(self, max_pending=1000, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self.subscriptions = set()
+        self.by_job = {}
+        self.unfiltered = set()
+        self.lock = Lock()
+
+    def subscribe(self, job_ids=None):
+        """
+        Register a new subscriber.
+
+        Args:
+            job_ids (set): IDs of the jobs to be notified about, None for all jobs
+
+        Returns:
+            Subscription: The new subscription, or None if max_subscribers are
+                          already subscribed
+        """
+        subscription = Subscription(job_ids, self.max_pending)
+        with self.lock:
+            if len(self.subscriptions) >= self.max_subscribers:
+                return None
+            self.subscriptions.add(subscription)
+            if job_ids is None:
+                self.unfiltered.add(subscription)
+            else:
+                for job_id in job_ids:
+                    self.by_job.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscriber.
+
+        Args:
+            subscription (Subscription): The subscription to remove
+        """
+        with self.lock:
+            self.subscriptions.discard(subscription)
+            self.unfiltered.discard(subscription)
+            for job_id in subscription.job_ids or ():
+                subscribers = self.by_job.get(job_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_job[job_id]
+
+    def publish(self, event):
+        """
+        Deliver an event to every interested subscriber.
+
+        Args:
+            event (dict): The event, with at least 'job_id' and 'status'
+        """
+        with self.lock:
+            subscribers = list(self.unfiltered) + list(self.by_job.get(event['job_id'], ()))
+
+        for subscription in subscribers:
+            if not subscription.push(event):
+                self.unsubscribe(subscription)
+
+    def num_subscribers(self):
+        """
+        Count the subscribers of the event stream.
+
+        Returns:
+            int: Number of distinct subscriptions
+        """
+        with self.lock:
+            return len(self.subscriptions)
+
+
+def job_event(job_info, payload=None):
+    """
+    Build the event published when a job leaves the 'running' state.
+
+    Args:
+        job_info (dict): The job, as kept by the thread pool
+        payload (str): The serialized result of the job, if it is done
+
+    Returns:
+        dict: The event
+    """
+    event = {
+        'job_id': job_info['job_id'],
+        'status': job_info['status'],
+        'endpoint': job_info.get('endpoint'),
+    }
+    if 'reason' in job_info:
+        event['reason'] = job_info['reason']
+    if payload is not None and job_info['status'] == 'done':
+        event['payload'] = payload
+    return event
+
+
+def format_event(event, inline_bytes):
+    """
+    Format an event as a Server-Sent Events message.
+
+    The result of a done job is embedded in the message as 'data' when its
+    serialized size is at most inline_bytes.
+
+    Args:
+        event (dict): The event to format
+        inline_bytes (int): Largest result that is embedded in the message
+
+    Returns:
+        str: The SSE message, terminated by an empty line
+    """
+    fields = {key: value for key, value in event.items() if key != 'payload'}
+    data = json.dumps(fields)
+    payload = event.get('payload')
+    if payload is not None and len(payload) <= inline_bytes:
+        data = f'{data[:-1]}, "data": {payload}}}'
+
+    return f"id: {event['job_id']}\nevent: {event['status']}\ndata: {data}\n\n"
+
+
+def format_closed(pending):
+    """
+    Format the last message of a stream whose subscription overflowed.
+
+    Args:
+        pending (set): IDs of the requested jobs not notified yet, None for all jobs
+
+    Returns:
+        str: The SSE message, terminated by an empty line
+    """
+    data = json.dumps({
+        'reason': 'Too many pending events, get the results and subscribe again',
+        'pending': sorted(pending) if pending is not None else None,
+    })
+    return f"event: overflow\ndata: {data}\n\n"
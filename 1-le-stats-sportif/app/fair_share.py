@@ -0,0 +1,341 @@
+"""
+This module shares the server between its clients.
+Requests are rate limited with token buckets per client and per (client, endpoint),
+and the worker pool serves the queued jobs of the clients with start-time fair
+queuing, so a client flooding the queue can not starve the others.
+
+Both track a bounded number of clients: the ones idle for IDLE_SECONDS are
+forgotten by a sweep every SWEEP_SECONDS, and while max_clients are tracked, the
+new clients share the OTHER bucket and queue slot.
+"""
+from threading import Condition, Lock
+from queue import Empty
+import heapq
+import os
+import time
+
+# Clients tracked at most, by default
+MAX_CLIENTS = 10000
+
+# Seconds without requests after which a client is forgotten
+IDLE_SECONDS = 300.0
+
+# Seconds between two sweeps of the idle clients
+SWEEP_SECONDS = 10.0
+
+# The client the new ones are counted as once max_clients are tracked
+OTHER = '(other)'
+
+
+def parse_weights(spec):
+    """
+    Parse 'name=value' pairs.
+
+    Args:
+        spec (str): Comma separated pairs, e.g. 'mean_by_category=5,best5=20'
+
+    Returns:
+        dict: Value of every name
+    """
+    values = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            values[name.strip()] = float(value)
+    return values
+
+
+class TokenBucket: # pylint: disable=too-few-public-methods
+    """
+    Lets 'rate' requests per second through, with bursts of up to 'burst' requests.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        """
+        Add the tokens earned since the last update.
+
+        Args:
+            now (float): Monotonic time
+
+        Returns:
+            float: Seconds to wait for the next token, 0.0 if one is available
+        """
+        # A bucket created after now was taken has not earned anything yet
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(now, self.updated)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+def is_full(bucket, now):
+    """
+    Check if a token bucket refilled completely, so dropping it loses nothing.
+
+    Args:
+        bucket (TokenBucket): The bucket
+        now (float): Monotonic time
+
+    Returns:
+        bool: True if the bucket would be back to its burst
+    """
+    return bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst
+
+
+class RateLimiter: # pylint: disable=too-many-instance-attributes
+    """
+    Token bucket rate limits per client and per (client, endpoint), with usage counters.
+
+    A rate of 0 disables the matching limit. Full buckets are dropped by the
+    periodic sweep, and so are the usage counters of the clients idle for
+    idle_seconds once their buckets are full.
+    """
+    def __init__(self, client_rate=0.0, endpoint_rates=None, burst_seconds=1.0,
+                 max_clients=MAX_CLIENTS):
+        self.client_rate = client_rate
+        self.endpoint_rates = endpoint_rates or {}
+        self.burst_seconds = burst_seconds
+        self.max_clients = max_clients
+        self.idle_seconds = IDLE_SECONDS
+        self.buckets = {}
+        self.usage = {}
+        self.seen = {}
+        self.swept = time.monotonic()
+        self.lock = Lock()
+
+    def _bucket(self, key, rate):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+        return bucket
+
+    def _client(self, client):
+        if client in self.usage or len(self.usage) < self.max_clients:
+            return client
+        return OTHER
+
+    def _sweep(self, now):
+        if now - self.swept < SWEEP_SECONDS:
+            return
+        self.swept = now
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if not is_full(bucket, now)}
+        limited = {key[0] if isinstance(key, tuple) else key for key in self.buckets}
+        for client, seen in list(self.seen.items()):
+            if client not in limited and now - seen >= self.idle_seconds:
+                del self.seen[client]
+                del self.usage[client]
+
+    def acquire(self, client, endpoint):
+        """
+        Count a request and check it against the limits of its client.
+
+        Args:
+            client (str): Identifier of the client
+            endpoint (str): Name of the endpoint requested
+
+        Returns:
+            float: 0.0 if the request is allowed, else the seconds to wait before retrying
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._sweep(now)
+            client = self._client(client)
+            self.seen[client] = now
+            buckets = []
+            if self.client_rate > 0:
+                buckets.append(self._bucket(client, self.client_rate))
+            if self.endpoint_rates.get(endpoint, 0) > 0:
+                buckets.append(self._bucket((client, endpoint), self.endpoint_rates[endpoint]))
+
+            # Take a token only if every bucket has one
+            retry_after = max((bucket.refill(now) for bucket in buckets), default=0.0)
+            if retry_after == 0.0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+
+            usage = self.usage.setdefault(client, {'requests': 0, 'throttled': 0,
+                                                   'endpoints': {}})
+            usage['requests'] += 1
+            usage['endpoints'][endpoint] = usage['endpoints'].get(endpoint, 0) + 1
+            if retry_after > 0:
+                usage['throttled'] += 1
+        return retry_after
+
+    def stats(self):
+        """
+        Get the usage counters of every client.
+
+        Returns:
+            dict: Requests, throttled requests and requests per endpoint of every client
+        """
+        with self.lock:
+            return {client: dict(usage, endpoints=dict(usage['endpoints']))
+                    for client, usage in self.usage.items()}
+
+
+def create_rate_limiter():
+    """
+    Create the rate limiter configured by the environment.
+
+    RATE_LIMIT_RPS is the number of requests per second allowed to every client
+    (0, the default, for no limit), RATE_LIMIT_ENDPOINTS the per-client limits of
+    single endpoints, e.g. 'mean_by_category=5', and RATE_LIMIT_BURST the number of
+    seconds of traffic a client can send at once. MAX_CLIENTS is the number of
+    clients tracked, the others share the limits of OTHER.
+
+    Returns:
+        RateLimiter: The configured rate limiter
+    """
+    return RateLimiter(float(os.environ.get('RATE_LIMIT_RPS', 0)),
+                       parse_weights(os.environ.get('RATE_LIMIT_ENDPOINTS', '')),
+                       float(os.environ.get('RATE_LIMIT_BURST', 1.0)),
+                       int(os.environ.get('MAX_CLIENTS', MAX_CLIENTS)))
+
+
+class FairQueue: # pylint: disable=too-many-instance-attributes
+    """
+    Job queue shared fairly between clients, with the interface of queue.Queue.
+
+    Every job gets a start tag, the later of the current virtual time and the
+    finish tag of the previous job of its client; jobs are served by increasing
+    start tag. A client's finish tag advances by the cost of its jobs divided by
+    its weight, so busy clients get served in proportion to their weights while a
+    client with a single job waits for at most one job of every other client.
+
+    The periodic sweep forgets the clients without queued jobs idle for
+    idle_seconds, and the finish tags already behind the virtual time.
+
+    Raises:
+        ValueError: If a weight is not positive
+    """
+    def __init__(self, weights=None, max_clients=MAX_CLIENTS):
+        for client, weight in (weights or {}).items():
+            if not weight > 0:
+                raise ValueError(f"Weight of client {client} must be positive, got {weight}")
+        self.weights = weights or {}
+        self.max_clients = max_clients
+        self.idle_seconds = IDLE_SECONDS
+        self.heap = []
+        self.sequence = 0
+        self.virtual_time = 0.0
+        self.finish_tags = {}
+        self.clients = {}
+        self.seen = {}
+        self.swept = time.monotonic()
+        self.unfinished = 0
+        self.condition = Condition()
+
+    def _client(self, client):
+        if client in self.clients or len(self.clients) < self.max_clients:
+            return client
+        return OTHER
+
+    def _sweep(self, now):
+        if now - self.swept < SWEEP_SECONDS:
+            return
+        self.swept = now
+        # A finish tag behind the virtual time starts the next job like no tag
+        self.finish_tags = {client: tag for client, tag in self.finish_tags.items()
+                            if tag > self.virtual_time}
+        for client, seen in list(self.seen.items()):
+            if self.clients[client]['queued'] == 0 and now - seen >= self.idle_seconds:
+                del self.seen[client]
+                del self.clients[client]
+
+    def put(self, job_info, cost=1.0):
+        """
+        Queue a job for its client, found in job_info['client'].
+
+        Args:
+            job_info (dict): The job to queue
+            cost (float): Expected cost of the job
+        """
+        now = time.monotonic()
+        with self.condition:
+            self._sweep(now)
+            client = self._client(job_info.get('client'))
+            self.seen[client] = now
+            start = max(self.virtual_time, self.finish_tags.get(client, 0.0))
+            self.finish_tags[client] = start + cost / self.weights.get(client, 1.0)
+            heapq.heappush(self.heap, (start, self.sequence, client, job_info))
+            self.sequence += 1
+
+            stats = self.clients.setdefault(client, {'queued': 0, 'served': 0})
+            stats['queued'] += 1
+            self.unfinished += 1
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the next job to serve.
+
+        Args:
+            timeout (float): Seconds to wait for a job, None to wait forever
+
+        Returns:
+            dict: The job info
+
+        Raises:
+            queue.Empty: If no job was queued within the timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.heap, timeout):
+                raise Empty
+            start, _, client, job_info = heapq.heappop(self.heap)
+            self.virtual_time = start
+            self.seen[client] = time.monotonic()
+
+            stats = self.clients[client]
+            stats['queued'] -= 1
+            stats['served'] += 1
+            if not self.heap:
+                # Idle queue, the clients start over on an equal footing
+                self.finish_tags.clear()
+            return job_info
+
+    def task_done(self):
+        """
+        Mark a job taken with get as processed.
+        """
+        with self.condition:
+            self.unfinished -= 1
+            if self.unfinished == 0:
+                self.condition.notify_all()
+
+    def join(self):
+        """
+        Wait until every queued job was processed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.unfinished == 0)
+
+    def qsize(self):
+        """
+        Number of jobs waiting in the queue.
+        """
+        return len(self.heap)
+
+    def jobs(self):
+        """
+        List the jobs waiting in the queue, in no particular order.
+
+        Returns:
+            list: The job infos
+        """
+        with self.condition:
+            return [job_info for _, _, _, job_info in self.heap]
+
+    def stats(self):
+        """
+        Get the queue usage of every client.
+
+        Returns:
+            dict: Queued and served jobs of every client, with its weight
+        """
+        with self.condition:
+            return {client: dict(stats, weight=self.weights.get(client, 1.0))
+                    for client, stats in self.clients.items()}
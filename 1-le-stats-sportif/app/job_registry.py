@@ -0,0 +1,226 @@
+"""
+This module implements the registry of the jobs known by the server.
+Job IDs are allocated atomically and the job table is split into stripes, each
+with its own lock, so request threads and workers rarely contend on the same lock.
+Every stripe keeps incremental counters of its jobs per state.
+"""
+from threading import Lock
+import os
+
+# States counted by the registry. A 'running' job is 'queued' until a worker starts it.
+STATES = ('queued', 'running', 'done', 'error', 'cancelled')
+
+
+class Stripe: # pylint: disable=too-few-public-methods
+    """
+    One shard of the job table, with its lock and its per-state counters.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.jobs = {}
+        self.counts = dict.fromkeys(STATES, 0)
+
+
+class JobRegistry:
+    """
+    Lock-striped table of jobs with atomic ID allocation.
+
+    A job is stored in the stripe selected by its ID. Every state change goes
+    through the registry, which keeps the per-state counters up to date, so
+    counting jobs never walks the table or takes more than one lock at a time.
+    The number of stripes can be set with the JOB_REGISTRY_STRIPES environment variable.
+    """
+    def __init__(self, num_stripes=None):
+        if num_stripes is None:
+            num_stripes = int(os.environ.get('JOB_REGISTRY_STRIPES', 16))
+        self.stripes = [Stripe() for _ in range(num_stripes)]
+        self.first_id = 1
+        self.step = 1
+        self.next_id = 1
+        self.id_lock = Lock()
+
+    def interleave(self, index, count, last_id=None):
+        """
+        Allocate only the IDs of one process out of several.
+
+        Process 'index' gets the IDs index + 1, index + 1 + count, ..., so the
+        processes of a multi-process server never allocate the same ID.
+        Must be called before any ID is allocated.
+
+        Args:
+            index (int): Index of the process, from 0 to count - 1
+            count (int): Number of processes
+            last_id (int): Last ID allocated by a previous instance of the process
+        """
+        self.first_id = self.next_id = index + 1
+        self.step = count
+        if last_id is not None:
+            self.next_id = last_id + count
+
+    def allocate_id(self):
+        """
+        Allocate a new, unique job ID.
+
+        Returns:
+            int: The job ID
+        """
+        with self.id_lock:
+            job_id = self.next_id
+            self.next_id += self.step
+        return job_id
+
+    def _stripe(self, job_id):
+        # The IDs of an interleaved process are step apart, count them one by one so
+        # that they reach every stripe whatever the number of processes
+        index = job_id // self.step if isinstance(job_id, int) else hash(job_id)
+        return self.stripes[index % len(self.stripes)]
+
+    def add(self, job_info):
+        """
+        Register a new job, in the 'queued' state.
+
+        Args:
+            job_info (dict): The job, with its 'job_id'
+        """
+        stripe = self._stripe(job_info['job_id'])
+        with stripe.lock:
+            stripe.jobs[job_info['job_id']] = job_info
+            stripe.counts['queued'] += 1
+
+    def get(self, job_id, default=None):
+        """
+        Look up a job by ID.
+
+        Args:
+            job_id (int): The job ID
+            default: Value returned if the job does not exist
+
+        Returns:
+            dict: The job info, or default
+        """
+        return self._stripe(job_id).jobs.get(job_id, default)
+
+    def __getitem__(self, job_id):
+        return self._stripe(job_id).jobs[job_id]
+
+    def __contains__(self, job_id):
+        return job_id in self._stripe(job_id).jobs
+
+    def __len__(self):
+        return sum(len(stripe.jobs) for stripe in self.stripes)
+
+    def items(self):
+        """
+        Iterate over all the jobs, sorted by ID.
+
+        Every stripe is copied under its own lock, never the whole table at once.
+
+        Returns:
+            list: (job_id, job_info) pairs
+        """
+        snapshot = []
+        for stripe in self.stripes:
+            with stripe.lock:
+                snapshot.extend(stripe.jobs.items())
+        snapshot.sort(key=lambda item: item[0])
+        return snapshot
+
+    def scan(self, after_id, limit, predicate=None, max_scan=10000):
+        """
+        Page through the jobs in ID order, starting after a cursor.
+
+        Job IDs are allocated sequentially, so a page is found by looking up the
+        next IDs one by one instead of walking or sorting the whole table.
+        At most max_scan IDs are looked at, which bounds the cost of a filtered page.
+
+        Args:
+            after_id (int): Cursor, only jobs with a bigger ID are returned
+            limit (int): Maximum number of jobs to return
+            predicate (callable): Filter applied to every job info, None to keep all
+            max_scan (int): Maximum number of IDs to look at
+
+        Returns:
+            tuple: The matching job infos, and the cursor of the next page or None
+        """
+        last_id = self.next_id - self.step
+        # Align the cursor on the IDs allocated by this registry
+        job_id = self.first_id - self.step
+        if after_id > job_id:
+            job_id += (after_id - job_id) // self.step * self.step
+        found = []
+        while job_id < last_id and len(found) < limit and max_scan > 0:
+            job_id += self.step
+            max_scan -= 1
+            job_info = self.get(job_id)
+            if job_info is not None and (predicate is None or predicate(job_info)):
+                found.append(job_info)
+
+        return found, (job_id if job_id < last_id else None)
+
+    def start(self, job_info):
+        """
+        Move a queued job to the running state.
+
+        Args:
+            job_info (dict): The job picked up by a worker
+
+        Returns:
+            bool: False if the job was cancelled and must be skipped
+        """
+        stripe = self._stripe(job_info['job_id'])
+        with stripe.lock:
+            if job_info['status'] == 'cancelled':
+                return False
+            job_info['started'] = True
+            stripe.counts['queued'] -= 1
+            stripe.counts['running'] += 1
+        return True
+
+    def finish(self, job_info, status):
+        """
+        Move a running job to its final state.
+
+        Args:
+            job_info (dict): The job that completed
+            status (str): 'done' or 'error'
+        """
+        stripe = self._stripe(job_info['job_id'])
+        with stripe.lock:
+            job_info['status'] = status
+            stripe.counts['running'] -= 1
+            stripe.counts[status] += 1
+
+    def cancel(self, job_info):
+        """
+        Cancel a job that was not started yet.
+
+        Args:
+            job_info (dict): The job to cancel
+
+        Returns:
+            bool: True if the job was cancelled, False if it already started
+        """
+        stripe = self._stripe(job_info['job_id'])
+        with stripe.lock:
+            if job_info['status'] != 'running' or job_info.get('started'):
+                return False
+            job_info['status'] = 'cancelled'
+            stripe.counts['queued'] -= 1
+            stripe.counts['cancelled'] += 1
+        return True
+
+    def counts(self):
+        """
+        Count the jobs in every state.
+
+        The stripes are read without locking, so the counters may be off by the
+        jobs changing state during the call, but never drift over time.
+
+        Returns:
+            dict: Number of jobs per state
+        """
+        totals = dict.fromkeys(STATES, 0)
+        for stripe in self.stripes:
+            for state, count in stripe.counts.items():
+                totals[state] += count
+        return totals
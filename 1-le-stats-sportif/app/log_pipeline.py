@@ -0,0 +1,177 @@
+"""
+This module sets up the non-blocking logging pipeline of the webserver.
+Request threads and workers only filter their records and put them in a queue;
+a background listener thread formats them and writes them to the rotating log file.
+Records can be sampled per route and repetitive lines can be rate limited.
+"""
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue
+from threading import Lock
+import atexit
+import copy
+import json
+import logging
+import os
+import random
+import time
+from flask import has_request_context, request
+
+
+def parse_sample_rates(spec):
+    """
+    Parse the per-route sampling rates.
+
+    Args:
+        spec (str): Comma separated 'route=rate' pairs, e.g. '/api/get_results=0.1'
+
+    Returns:
+        dict: Sampling rate (between 0 and 1) of every route prefix
+    """
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            route, rate = item.split('=', 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter): # pylint: disable=too-few-public-methods
+    """
+    Keeps only a fraction of the records logged while serving some routes.
+
+    The route of the current request is attached to every record as 'route'.
+    Warnings and errors are never sampled out.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        record.route = request.path if has_request_context() else None
+        if record.levelno >= logging.WARNING or record.route is None:
+            return True
+        for prefix, rate in self.rates.items():
+            if record.route.startswith(prefix):
+                return random.random() < rate
+        return True
+
+
+class RateLimitFilter(logging.Filter): # pylint: disable=too-few-public-methods
+    """
+    Limits how often the same line can be logged.
+
+    Records are grouped by logger, level and message template. At most 'burst'
+    records of a group are let through every 'interval' seconds; the first record
+    of the next interval carries the number of records dropped in the meantime.
+    """
+    def __init__(self, burst, interval=1.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self.lock = Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            start, count, suppressed = self.windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                record.suppressed = suppressed
+                start, count, suppressed = now, 0, 0
+            if count >= self.burst:
+                self.windows[key] = (start, count, suppressed + 1)
+                return False
+            self.windows[key] = (start, count + 1, suppressed)
+        return True
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Queues records with their message merged, keeping the traceback apart.
+
+    QueueHandler.prepare appends the traceback to the message and drops the
+    exception; here it is kept in exc_text instead, for the 'exc' field of
+    JsonFormatter.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as a single line JSON object.
+
+    Messages longer than max_length are truncated, so logging a large request
+    body can not produce huge lines. Warnings and errors are kept whole.
+    """
+    def __init__(self, max_length=512):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record):
+        message = record.getMessage()
+        if len(message) > self.max_length and record.levelno < logging.WARNING:
+            message = message[:self.max_length] + '...'
+        line = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) +
+                  f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'route': getattr(record, 'route', None),
+            'msg': message,
+        }
+        if getattr(record, 'suppressed', 0):
+            line['suppressed'] = record.suppressed
+        exc = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exc:
+            line['exc'] = exc
+        return json.dumps(line)
+
+
+def setup_logging(logger, path='logs/webserver.log'):
+    """
+    Attach the queue-based logging pipeline to a logger.
+
+    The pipeline is tuned with environment variables: LOG_MAX_BYTES and
+    LOG_BACKUP_COUNT for the file rotation, LOG_SAMPLE_RATES for the per-route
+    sampling, LOG_RATE_LIMIT for the number of identical lines per second (0, the
+    default, for no limit) and LOG_MAX_LENGTH for the longest message kept.
+
+    Args:
+        logger (logging.Logger): The logger to attach the pipeline to
+        path (str): Path of the log file
+
+    Returns:
+        QueueListener: The started background writer
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.mkdir(directory)
+
+    file_handler = RotatingFileHandler(path,
+                                       maxBytes=int(os.environ.get('LOG_MAX_BYTES', 10 << 20)),
+                                       backupCount=int(os.environ.get('LOG_BACKUP_COUNT', 10)))
+    file_handler.setFormatter(JsonFormatter(int(os.environ.get('LOG_MAX_LENGTH', 512))))
+
+    log_queue = Queue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(
+        os.environ.get('LOG_SAMPLE_RATES', ''))))
+    rate_limit = int(os.environ.get('LOG_RATE_LIMIT', 0))
+    if rate_limit > 0:
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    # Flush the pending records when the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,255 @@
+"""
+This module measures where the memory of a server process goes: the dataset
+columns and the caches built on it, the job table with the closures its jobs
+retain, the queued jobs, the result store and the trace buffer, and the resident
+size of the process. An
+optional tracemalloc snapshot lists the lines of code holding the most memory,
+and how much each one grew since the previous snapshot, to catch leaks.
+"""
+from collections import deque
+from threading import Lock
+import os
+import resource
+import sys
+import tracemalloc
+import types
+
+# Objects measured to estimate the size of a big collection of jobs or traces
+SAMPLE_SIZE = 1000
+
+CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+# Caches of a DataIngestor, built on first use: the query cube and partitions, the
+# stratified sample, the correlation pivot and the trend fits
+CACHES = ('query_engine', 'sample', 'pivot', 'trends')
+
+
+def deep_size(obj, seen, exclude=()):
+    """
+    Measure an object and everything it references, each object once.
+
+    Containers, function closures and default values, and the attributes of the
+    instances of this application are followed. Modules, classes, code and globals
+    are shared by the whole process and are not.
+
+    Args:
+        obj: The object to measure
+        seen (set): IDs of the objects already measured, updated
+        exclude (tuple): Objects not to measure, like the dataset shared by all jobs
+
+    Returns:
+        int: Size in bytes of the objects not seen yet
+    """
+    excluded = {id(item) for item in exclude}
+    total = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or id(obj) in excluded or \
+                isinstance(obj, (type, types.ModuleType, types.CodeType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, CONTAINERS):
+            pending.extend(obj)
+        elif isinstance(obj, types.FunctionType):
+            pending.extend(cell.cell_contents for cell in obj.__closure__ or ()
+                           if cell.cell_contents is not None)
+            pending.extend((obj.__defaults__ or ()) + (obj.__kwdefaults__ or {},))
+        elif type(obj).__module__.startswith('app.') and hasattr(obj, '__dict__'):
+            pending.append(vars(obj))
+    return total
+
+
+def estimate_size(objects, exclude=()):
+    """
+    Estimate the size of a collection from an evenly spread sample of its items.
+
+    Args:
+        objects (list): The items
+        exclude (tuple): Objects not to measure
+
+    Returns:
+        tuple: Estimated bytes of all the items, and number of items measured
+    """
+    if not objects:
+        return 0, 0
+    step = max(1, len(objects) // SAMPLE_SIZE)
+    sample = objects[::step]
+    measured = deep_size(sample, set(), exclude) - sys.getsizeof(sample)
+    return measured * len(objects) // len(sample), len(sample)
+
+
+def dataframe_memory(df, deep=True):
+    """
+    Measure a DataFrame column by column.
+
+    Args:
+        df (pandas.DataFrame): The dataset
+        deep (bool): Also measure the strings of object columns, which walks them
+
+    Returns:
+        dict: Rows, total bytes and dtype and bytes of every column, biggest first
+    """
+    usage = df.memory_usage(index=True, deep=deep)
+    dtypes = df.dtypes
+    columns = [{'column': str(column), 'bytes': int(size),
+                'dtype': str(dtypes[column]) if column in dtypes else 'index'}
+               for column, size in sorted(usage.items(), key=lambda item: -item[1])]
+    return {'rows': len(df), 'bytes': int(usage.sum()), 'deep': deep, 'columns': columns}
+
+
+def cache_memory(data_ingestor):
+    """
+    Estimate the size of the caches of a dataset.
+
+    The DataFrame the caches are built from is not counted, see dataframe_memory.
+
+    Args:
+        data_ingestor (DataIngestor): The dataset
+
+    Returns:
+        dict: Estimated bytes of every cache, 'total' for all of them
+    """
+    exclude = (data_ingestor.df,)
+    caches = {name: estimate_size([getattr(data_ingestor, name)], exclude)[0]
+              for name in CACHES}
+    caches['total'] = sum(caches.values())
+    return caches
+
+
+def jobs_memory(jobs, exclude=()):
+    """
+    Estimate the size of the job table.
+
+    Args:
+        jobs (JobRegistry): The jobs of the pool
+        exclude (tuple): Objects shared by the jobs, not to measure
+
+    Returns:
+        dict: Number of jobs, estimated bytes of their infos and of the closures
+              of their tasks alone
+    """
+    job_infos = [job_info for _, job_info in jobs.items()]
+    total, sampled = estimate_size(job_infos, exclude)
+    closures, _ = estimate_size([job_info.get('task') for job_info in job_infos], exclude)
+    return {'jobs': len(job_infos), 'bytes': total, 'closure_bytes': closures,
+            'sampled': sampled}
+
+
+def process_memory():
+    """
+    Measure the whole process.
+
+    Returns:
+        dict: Current resident set size (None if unknown) and its peak, in bytes
+    """
+    rss = None
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'rss_bytes': rss, 'peak_rss_bytes': peak if sys.platform == 'darwin' else peak * 1024}
+
+
+def memory_report(threadpool, data_ingestor, deep=True):
+    """
+    Account for the memory of a server process.
+
+    Args:
+        threadpool (ThreadPool): The thread pool of the process
+        data_ingestor (DataIngestor): The dataset of the process
+        deep (bool): Also measure the strings of the object columns of the dataset
+
+    Returns:
+        dict: Memory of the dataset and its caches, jobs, queue, result store,
+              traces and process
+    """
+    exclude = (data_ingestor,)
+    queued, queue_sampled = estimate_size(threadpool.queue.jobs(), exclude)
+    traces, traces_sampled = estimate_size(threadpool.traces.values(), exclude)
+    return {
+        'process': process_memory(),
+        'dataset': dataframe_memory(data_ingestor.df, deep),
+        'caches': cache_memory(data_ingestor),
+        'jobs': jobs_memory(threadpool.jobs, exclude),
+        'queue': {'depth': threadpool.queue.qsize(), 'bytes': queued, 'sampled': queue_sampled},
+        'result_store': threadpool.result_store.stats(),
+        'traces': {'traces': len(threadpool.traces), 'capacity': threadpool.traces.capacity,
+                   'bytes': traces, 'sampled': traces_sampled},
+    }
+
+
+class AllocationTracker:
+    """
+    Lists the lines of code holding the most memory, with tracemalloc.
+
+    Tracing slows allocations down, so it is off until started, either with the
+    PYTHONTRACEMALLOC environment variable or with start(). Every report keeps its
+    snapshot, so the next one also shows what grew in between.
+    """
+    def __init__(self):
+        self.previous = None
+        self.lock = Lock()
+
+    def start(self, frames=1):
+        """
+        Start tracing the allocations.
+
+        Args:
+            frames (int): Number of frames kept per allocation
+        """
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.previous = None
+
+    def stop(self):
+        """
+        Stop tracing the allocations and free the traces.
+        """
+        with self.lock:
+            tracemalloc.stop()
+            self.previous = None
+
+    def report(self, top=10):
+        """
+        Take a snapshot of the traced allocations.
+
+        Args:
+            top (int): Number of lines of code listed
+
+        Returns:
+            dict: Traced memory, the lines holding the most of it, and the lines that
+                  grew the most since the previous report
+        """
+        if not tracemalloc.is_tracing():
+            return {'tracing': False}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            'tracing': True,
+            'traced_bytes': current,
+            'peak_traced_bytes': peak,
+            'top': [{'location': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:top]],
+        }
+        with self.lock:
+            if self.previous is not None:
+                report['growth'] = [{'location': str(stat.traceback), 'bytes': stat.size_diff,
+                                     'count': stat.count_diff}
+                                    for stat in snapshot.compare_to(self.previous, 'lineno')[:top]
+                                    if stat.size_diff > 0]
+            self.previous = snapshot
+        return report
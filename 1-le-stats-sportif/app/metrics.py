@@ -0,0 +1,203 @@
+"""
+This module collects timing metrics for the jobs executed by the thread pool.
+It aggregates per-job phase timestamps into per-endpoint latency histograms,
+throughput counters and worker utilization, and renders them in the
+Prometheus text exposition format.
+"""
+from bisect import bisect_left
+from threading import Lock
+import time
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases of a job, each one delimited by two consecutive timestamps
+PHASES = (
+    ('queue_wait', 'submitted', 'started'),
+    ('compute', 'started', 'computed'),
+    ('serialize', 'computed', 'serialized'),
+    ('write', 'serialized', 'finished'),
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations.
+
+    Observing a value costs one binary search over the bucket bounds, so it is
+    cheap enough to be updated for every job.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Add a duration to the histogram.
+
+        Args:
+            value (float): Duration in seconds
+        """
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation inside the matching bucket.
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            float: Estimated duration in seconds, 0.0 if nothing was observed
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                # The overflow bucket has no upper bound, report its lower one
+                if i == len(BUCKETS):
+                    return lower
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / count
+            seen += count
+
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """
+    Thread-safe registry of job metrics.
+
+    Workers call record_job once per finished job; the /api/metrics route calls
+    render to produce the Prometheus text format.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.phases = {}
+        self.latency = {}
+        self.jobs_total = {}
+        self.busy_seconds = 0.0
+
+    def record_job(self, endpoint, status, timestamps):
+        """
+        Aggregate the timestamps of a finished job.
+
+        Args:
+            endpoint (str): Name of the endpoint that created the job
+            status (str): Final status of the job ('done' or 'error')
+            timestamps (dict): Monotonic timestamps of the job phases
+        """
+        with self.lock:
+            key = (endpoint, status)
+            self.jobs_total[key] = self.jobs_total.get(key, 0) + 1
+
+            for phase, start, end in PHASES:
+                if start in timestamps and end in timestamps:
+                    histogram = self.phases.setdefault((endpoint, phase), Histogram())
+                    histogram.observe(timestamps[end] - timestamps[start])
+
+            if 'started' in timestamps and 'finished' in timestamps:
+                self.busy_seconds += timestamps['finished'] - timestamps['started']
+
+            if 'submitted' in timestamps and 'finished' in timestamps:
+                histogram = self.latency.setdefault(endpoint, Histogram())
+                histogram.observe(timestamps['finished'] - timestamps['submitted'])
+
+    def mean_duration(self, endpoint, phase):
+        """
+        Get the average duration of a phase for the jobs of an endpoint.
+
+        Args:
+            endpoint (str): Name of the endpoint
+            phase (str): Name of the phase, one of PHASES
+
+        Returns:
+            float: Average duration in seconds, None if no job was recorded yet
+        """
+        with self.lock:
+            histogram = self.phases.get((endpoint, phase))
+            if histogram is None or histogram.count == 0:
+                return None
+            return histogram.sum / histogram.count
+
+    def render(self, queue_depth, num_threads):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Args:
+            queue_depth (int): Number of jobs waiting in the queue
+            num_threads (int): Number of worker threads in the pool
+
+        Returns:
+            str: The metrics, one sample per line
+        """
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            lines = [
+                '# HELP lestats_jobs_total Finished jobs by endpoint and status.',
+                '# TYPE lestats_jobs_total counter',
+            ]
+            for (endpoint, status), count in sorted(self.jobs_total.items()):
+                lines.append(f'lestats_jobs_total{{endpoint="{endpoint}",status="{status}"}} '
+                             f'{count}')
+
+            lines += [
+                '# HELP lestats_job_phase_seconds Time spent by jobs in each phase.',
+                '# TYPE lestats_job_phase_seconds histogram',
+            ]
+            for (endpoint, phase), histogram in sorted(self.phases.items()):
+                labels = f'endpoint="{endpoint}",phase="{phase}"'
+                lines += _render_histogram('lestats_job_phase_seconds', labels, histogram)
+
+            lines += [
+                '# HELP lestats_job_latency_seconds End-to-end job latency.',
+                '# TYPE lestats_job_latency_seconds summary',
+            ]
+            for endpoint, histogram in sorted(self.latency.items()):
+                for q in QUANTILES:
+                    lines.append(f'lestats_job_latency_seconds{{endpoint="{endpoint}",'
+                                 f'quantile="{q}"}} {histogram.quantile(q):.6f}')
+                lines.append(f'lestats_job_latency_seconds_sum{{endpoint="{endpoint}"}} '
+                             f'{histogram.sum:.6f}')
+                lines.append(f'lestats_job_latency_seconds_count{{endpoint="{endpoint}"}} '
+                             f'{histogram.count}')
+
+            utilization = self.busy_seconds / (uptime * num_threads) if uptime > 0 else 0.0
+            lines += [
+                '# HELP lestats_worker_busy_seconds_total Time workers spent executing jobs.',
+                '# TYPE lestats_worker_busy_seconds_total counter',
+                f'lestats_worker_busy_seconds_total {self.busy_seconds:.6f}',
+                '# HELP lestats_worker_utilization Fraction of worker time spent on jobs.',
+                '# TYPE lestats_worker_utilization gauge',
+                f'lestats_worker_utilization {utilization:.6f}',
+                '# HELP lestats_queue_depth Jobs waiting in the queue.',
+                '# TYPE lestats_queue_depth gauge',
+                f'lestats_queue_depth {queue_depth}',
+                '# HELP lestats_uptime_seconds Time since the thread pool was created.',
+                '# TYPE lestats_uptime_seconds gauge',
+                f'lestats_uptime_seconds {uptime:.3f}',
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
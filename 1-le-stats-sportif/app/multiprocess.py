@@ -0,0 +1,156 @@
+"""
+This module implements the multi-process serving mode of the webserver.
+
+The parent process imports the application, which loads the dataset once, opens the
+listening socket and forks LESTATS_PROCESSES server processes. The forked processes
+share the dataset copy-on-write and all accept connections on the same socket.
+Jobs and results are kept in a SQLite database in WAL mode (LESTATS_SHARED_DB,
+results/jobs.db by default), so any process can answer /api/get_results for a job
+submitted to another one. Every process allocates its own interleaved job IDs,
+runs its own TP_NUM_OF_THREADS workers and logs to logs/webserver-<index>.log.
+The parent respawns the processes that die and fails the jobs they left behind.
+
+/api/events, /api/num_jobs and /api/graceful_shutdown span every process: events of
+requested jobs owned by another process are polled from the shared database, the
+number of jobs is counted there, and a graceful shutdown received by one process is
+forwarded by the parent to all of them (SIGUSR1). A job can only be cancelled by the
+process that owns it; the others answer that it belongs to another process.
+
+LESTATS_PROCESSES must be set before the app package is imported; the
+multiprocess_server.py entry point takes care of it.
+"""
+import gc
+import os
+import signal
+import socket
+from werkzeug.serving import make_server
+from app import webserver
+from app.log_pipeline import setup_logging
+from app.shared_store import SqliteJobStore
+
+
+def run_process(index, count, listener, db_path, draining=False):
+    """
+    Body of a forked server process. Never returns.
+
+    Args:
+        index (int): Index of the process, from 0 to count - 1
+        count (int): Number of processes
+        listener (socket.socket): The shared listening socket
+        db_path (str): Path of the shared SQLite database
+        draining (bool): Whether the server is already shutting down
+    """
+    shared = SqliteJobStore(db_path)
+    pool = webserver.tasks_runner
+    parent = os.getppid()
+    # Let the parent drain every process, this one included
+    webserver.broadcast_shutdown = lambda: os.kill(parent, signal.SIGUSR1)
+    if draining:
+        pool.graceful_shutdown.set()
+    pool.jobs.interleave(index, count, shared.last_job_id(index, count))
+    pool.shared_jobs = shared
+    pool.result_store = shared
+
+    webserver.log_listener = setup_logging(webserver.logger, f'logs/webserver-{index}.log')
+    webserver.logger.info("Webserver process %s of %s started, pid %s",
+                          index, count, os.getpid())
+    pool.start()
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, webserver, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+
+def spawn(index, count, listener, db_path, draining=False):
+    """
+    Fork a new server process.
+
+    Args:
+        index (int): Index of the process, from 0 to count - 1
+        count (int): Number of processes
+        listener (socket.socket): The shared listening socket
+        db_path (str): Path of the shared SQLite database
+        draining (bool): Whether the server is already shutting down
+
+    Returns:
+        int: PID of the new process
+    """
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1,
+                      lambda _signum, _frame: webserver.tasks_runner.graceful_shutdown.set())
+        try:
+            run_process(index, count, listener, db_path, draining)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def serve(host='127.0.0.1', port=5000, count=None, db_path=None):
+    """
+    Run the webserver as several processes behind one port.
+
+    Args:
+        host (str): Address to listen on
+        port (int): Port to listen on
+        count (int): Number of server processes, LESTATS_PROCESSES by default
+        db_path (str): Path of the shared SQLite database, LESTATS_SHARED_DB by default
+    """
+    count = count or int(os.environ.get('LESTATS_PROCESSES', 1))
+    if count <= 1:
+        # The app started its workers at import, serve it as a single process
+        webserver.run(host, port, threaded=True)
+        return
+
+    if webserver.tasks_runner.broker is not None:
+        raise ValueError("A job broker can only be used by a single server process")
+
+    db_path = db_path or os.environ.get('LESTATS_SHARED_DB', 'results/jobs.db')
+    # Start from a fresh job table, job IDs restart at 1
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    parent_store = SqliteJobStore(db_path)
+    # Never carry an open SQLite connection across a fork
+    parent_store.close()
+
+    listener = socket.create_server((host, port), backlog=1024)
+    listener.set_inheritable(True)
+
+    # Move the objects loaded so far (the dataset) out of the garbage collector's
+    # reach, so collections in the children do not un-share their memory pages
+    gc.freeze()
+
+    children = {}
+    stopping = []
+    draining = []
+
+    def stop(_signum, _frame):
+        stopping.append(True)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def drain(_signum, _frame):
+        draining.append(True)
+        for pid in children:
+            os.kill(pid, signal.SIGUSR1)
+
+    signal.signal(signal.SIGUSR1, drain)
+    for index in range(count):
+        children[spawn(index, count, listener, db_path, bool(draining))] = index
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        pid, _ = os.wait()
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+
+        failed = parent_store.fail_running(index, count, "Server process died")
+        parent_store.close()
+        webserver.logger.error("Server process %s died with %s unfinished jobs, respawning it",
+                               index, failed)
+        children[spawn(index, count, listener, db_path)] = index
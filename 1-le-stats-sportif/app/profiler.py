@@ -0,0 +1,166 @@
+"""
+This module implements the on-demand sampling profiler of the server.
+While a profile is running, the thread that asked for it periodically captures the
+stack of every other thread (request threads and TaskRunner workers) and aggregates
+the samples per stack. Nothing is installed in the profiled threads, so the server
+runs at full speed whenever no profile is being taken.
+"""
+from threading import Lock, get_ident, enumerate as enumerate_threads
+import os
+import sys
+import time
+
+# Leaf functions of a thread blocked waiting for work, left out of the samples
+IDLE_FUNCTIONS = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'readinto'),
+    ('socketserver.py', 'serve_forever'),
+    ('fair_share.py', 'get'),
+}
+
+
+def frame_label(frame):
+    """
+    Name the function of a stack frame.
+
+    Args:
+        frame (frame): The stack frame
+
+    Returns:
+        str: Function name, file and first line, e.g. 'best5 (data_ingestor.py:249)'
+    """
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of all the threads of the process.
+
+    Every 'interval' seconds the stacks of all threads are captured with
+    sys._current_frames(); the profile counts how many samples saw every stack.
+    Threads blocked waiting for work are skipped unless 'idle' is set.
+    """
+    def __init__(self, interval=0.005, idle=False):
+        self.interval = interval
+        self.idle = idle
+        self.stacks = {}
+        self.samples = 0
+        self.duration = 0.0
+
+    def sample(self):
+        """
+        Capture the stack of every thread but the calling one, once.
+        """
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        me = get_ident()
+        # pylint: disable-next=protected-access
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            code = frame.f_code
+            if not self.idle and \
+                    (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """
+        Sample the threads for some time, on the calling thread.
+
+        Args:
+            seconds (float): Duration of the profile
+
+        Returns:
+            SamplingProfiler: The profiler, with the collected samples
+        """
+        start = time.monotonic()
+        deadline = start + seconds
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        self.duration = time.monotonic() - start
+        return self
+
+    def stats(self, top=20):
+        """
+        Aggregate the samples.
+
+        Args:
+            top (int): Number of functions listed
+
+        Returns:
+            dict: Number of samples, samples per thread, and the functions seen most
+                  often at the top of the stack (self) and anywhere in it (total)
+        """
+        threads = {}
+        own = {}
+        total = {}
+        for (thread, stack), count in self.stacks.items():
+            threads[thread] = threads.get(thread, 0) + count
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for function in set(stack):
+                total[function] = total.get(function, 0) + count
+
+        def ranking(counts):
+            busy = sum(threads.values()) or 1
+            return [{'function': function, 'samples': count,
+                     'percent': round(100 * count / busy, 2)}
+                    for function, count in sorted(counts.items(), key=lambda item: -item[1])
+                    [:top]]
+
+        return {
+            'samples': self.samples,
+            'interval': self.interval,
+            'duration': round(self.duration, 3),
+            'threads': dict(sorted(threads.items(), key=lambda item: -item[1])),
+            'top_self': ranking(own),
+            'top_total': ranking(total),
+        }
+
+    def collapsed(self):
+        """
+        Export the samples as collapsed stacks, the input format of flamegraph tools.
+
+        Returns:
+            str: One 'thread;outer;...;inner count' line per stack
+        """
+        lines = [';'.join((thread.replace(';', ':'),) + stack) + f' {count}'
+                 for (thread, stack), count in sorted(self.stacks.items())]
+        return '\n'.join(lines) + '\n'
+
+
+class ProfileSession: # pylint: disable=too-few-public-methods
+    """
+    Runs the profiles requested by the admin endpoint, one at a time.
+    """
+    def __init__(self):
+        self.lock = Lock()
+
+    def profile(self, seconds, interval=0.005, idle=False):
+        """
+        Take a profile of the whole process.
+
+        Args:
+            seconds (float): Duration of the profile
+            interval (float): Seconds between two samples
+            idle (bool): Also count the threads waiting for work
+
+        Returns:
+            SamplingProfiler: The finished profile, or None if another one is running
+        """
+        if not self.lock.acquire(blocking=False): # pylint: disable=consider-using-with
+            return None
+        try:
+            return SamplingProfiler(interval, idle).run(seconds)
+        finally:
+            self.lock.release()
@@ -0,0 +1,362 @@
+"""
+This module answers the declarative queries of /api/query: filters on the
+question, state, year and stratification of the rows, a group-by on any of those
+dimensions and aggregates of Data_Value.
+
+A planner picks the cheapest way to answer every query. Decomposable aggregates
+(mean, count, sum, min, max) are combined from a cube holding the sum, count, min
+and max of every (question, state, year, stratification) cell, which is much
+smaller than the dataset. Other aggregates scan the rows, restricted to the
+partitions of the filtered questions when there is such a filter. The cube and
+the partitions are built on first use, or by prepare().
+"""
+from threading import Lock
+import math
+import numpy as np
+import pandas as pd
+from app.tracing import span
+
+# Dimensions of a query, and the column of the dataset holding each one
+DIMENSIONS = {
+    'question': 'Question',
+    'state': 'LocationDesc',
+    'year': 'YearStart',
+    'category': 'StratificationCategory1',
+    'stratification': 'Stratification1',
+}
+
+# Aggregates combined from the cube cells: the cube column and how cells are merged
+DECOMPOSABLE = {
+    'sum': ('sum', 'sum'),
+    'count': ('count', 'sum'),
+    'min': ('min', 'min'),
+    'max': ('max', 'max'),
+}
+# Aggregates computed on the rows, with the name of the pandas aggregation
+SCAN_AGGREGATES = {'mean': 'mean', 'count': 'count', 'sum': 'sum', 'min': 'min',
+                   'max': 'max', 'median': 'median', 'std': 'std'}
+
+# Largest number of groups a query can return
+MAX_GROUPS = 100000
+
+
+class Query: # pylint: disable=too-few-public-methods
+    """
+    A parsed and validated query.
+
+    Filters map a dimension to the list of accepted values, the group-by is a list
+    of dimensions and the aggregates a list of names of SCAN_AGGREGATES.
+    """
+    def __init__(self, filters, group_by, aggregates, explain=False):
+        self.filters = filters
+        self.group_by = group_by
+        self.aggregates = aggregates
+        self.explain = explain
+
+    @property
+    def decomposable(self):
+        """
+        Whether every aggregate can be combined from the cube.
+        """
+        return all(name == 'mean' or name in DECOMPOSABLE for name in self.aggregates)
+
+
+def parse_query(spec):
+    """
+    Validate the spec of a query.
+
+    Example spec: {"filters": {"question": "...", "year": [2019, 2020]},
+                   "group_by": ["state"], "aggregates": ["mean", "count"]}
+
+    Args:
+        spec (dict): The query, as sent by the client
+
+    Returns:
+        Query: The parsed query
+
+    Raises:
+        ValueError: If the spec is malformed
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("The query must be a JSON object")
+    unknown = set(spec) - {'filters', 'group_by', 'aggregates', 'explain'}
+    if unknown:
+        raise ValueError(f"Unknown query fields: {', '.join(sorted(unknown))}")
+
+    filters = parse_filters(spec.get('filters', {}))
+
+    group_by = spec.get('group_by', [])
+    group_by = [group_by] if isinstance(group_by, str) else group_by
+    if not isinstance(group_by, list) or len(set(group_by)) != len(group_by):
+        raise ValueError("'group_by' must be a list of distinct dimensions")
+    for dimension in group_by:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+
+    aggregates = spec.get('aggregates', ['mean'])
+    aggregates = [aggregates] if isinstance(aggregates, str) else aggregates
+    if not isinstance(aggregates, list) or not aggregates:
+        raise ValueError("'aggregates' must be a non-empty list")
+    for name in aggregates:
+        if name not in SCAN_AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {name}")
+
+    return Query(filters, group_by, list(dict.fromkeys(aggregates)), bool(spec.get('explain')))
+
+
+def parse_filters(raw_filters):
+    """
+    Validate the filters of a query.
+
+    Args:
+        raw_filters (dict): Accepted value, or list of values, of some dimensions
+
+    Returns:
+        dict: List of accepted values of every filtered dimension
+
+    Raises:
+        ValueError: If a filter is malformed
+    """
+    if not isinstance(raw_filters, dict):
+        raise ValueError("'filters' must map dimensions to values")
+
+    filters = {}
+    for dimension, values in raw_filters.items():
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        values = values if isinstance(values, list) else [values]
+        if not values or not all(isinstance(value, (str, int)) for value in values):
+            raise ValueError(f"Filter on {dimension} needs one or more strings or numbers")
+        if dimension == 'year':
+            try:
+                values = [int(value) for value in values]
+            except ValueError as e:
+                raise ValueError("Filter on year needs years") from e
+        filters[dimension] = values
+    return filters
+
+
+def to_json_value(value):
+    """
+    Convert a value of a result frame to a JSON friendly one.
+
+    Args:
+        value: A pandas or numpy scalar
+
+    Returns:
+        The Python value, None for a missing one
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class QueryEngine:
+    """
+    Plans and executes the queries on one dataset.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.cube = None
+        self.partitions = None
+        self.cube_partitions = None
+        self.lock = Lock()
+
+    def prepare(self):
+        """
+        Build the aggregate cube and the question partitions, once.
+        """
+        if self.cube is not None:
+            return
+        with self.lock:
+            if self.cube is not None:
+                return
+            columns = list(DIMENSIONS.values())
+            self.partitions = self.df.groupby('Question', sort=False).indices
+            cube = self.df.groupby(columns, dropna=False, sort=False)['Data_Value'] \
+                .agg(['sum', 'count', 'min', 'max']).reset_index()
+            self.cube_partitions = cube.groupby('Question', sort=False).indices
+            self.cube = cube
+
+    def plan(self, query):
+        """
+        Pick the cheapest way to answer a query.
+
+        The cost of a plan is the number of rows it reads: the cells of the cube or
+        the rows of the dataset, in the partitions of the filtered questions if any.
+
+        Args:
+            query (Query): The query
+
+        Returns:
+            dict: The chosen strategy, its estimated cost and the other candidates
+        """
+        self.prepare()
+        questions = query.filters.get('question')
+
+        candidates = []
+        if query.decomposable:
+            candidates.append(('cube', self.rows_read(self.cube_partitions, questions,
+                                                      len(self.cube))))
+        if questions is not None:
+            candidates.append(('partition_scan', self.rows_read(self.partitions, questions,
+                                                                len(self.df))))
+        candidates.append(('full_scan', len(self.df)))
+
+        strategy, cost = min(candidates, key=lambda candidate: candidate[1])
+        return {
+            'strategy': strategy,
+            'estimated_rows': cost,
+            'dataset_rows': len(self.df),
+            'cube_cells': len(self.cube),
+            'steps': self.describe(query, strategy),
+            'candidates': dict(candidates),
+        }
+
+    @staticmethod
+    def rows_read(partitions, questions, total):
+        """
+        Count the rows a plan reads.
+
+        Args:
+            partitions (dict): Positions of the rows of every question
+            questions (list): The filtered questions, None for all of them
+            total (int): Number of rows without a question filter
+
+        Returns:
+            int: Number of rows read
+        """
+        if questions is None:
+            return total
+        return sum(len(partitions.get(question, ())) for question in questions)
+
+    @staticmethod
+    def describe(query, strategy):
+        """
+        Describe the steps of a plan.
+
+        Args:
+            query (Query): The query
+            strategy (str): 'cube', 'partition_scan' or 'full_scan'
+
+        Returns:
+            list: One sentence per step
+        """
+        source = 'aggregate cube' if strategy == 'cube' else 'dataset'
+        steps = [f"read the partitions of {len(query.filters['question'])} question(s) "
+                 f"of the {source}" if strategy != 'full_scan' and 'question' in query.filters
+                 else f"read the whole {source}"]
+        steps.extend(f"filter {dimension} in {values}"
+                     for dimension, values in query.filters.items()
+                     if dimension != 'question' or strategy == 'full_scan')
+        if query.group_by:
+            steps.append(f"group by {', '.join(query.group_by)}")
+        if strategy == 'cube':
+            steps.append(f"combine the cells into {', '.join(query.aggregates)}")
+        else:
+            steps.append(f"aggregate Data_Value into {', '.join(query.aggregates)}")
+        return steps
+
+    def select(self, frame, partitions, query, use_partitions):
+        """
+        Select the rows matching the filters of a query.
+
+        Args:
+            frame (pandas.DataFrame): The dataset or the cube
+            partitions (dict): Positions of the rows of every question in frame
+            query (Query): The query
+            use_partitions (bool): Read only the partitions of the filtered questions
+
+        Returns:
+            pandas.DataFrame: The matching rows
+        """
+        filters = dict(query.filters)
+        if use_partitions and 'question' in filters:
+            positions = [partitions[question] for question in filters.pop('question')
+                         if question in partitions]
+            frame = frame.iloc[np.concatenate(positions) if positions else []]
+
+        mask = None
+        for dimension, values in filters.items():
+            matches = frame[DIMENSIONS[dimension]].isin(values)
+            mask = matches if mask is None else mask & matches
+        return frame if mask is None else frame[mask]
+
+    def execute(self, query):
+        """
+        Answer a query, or only explain its plan.
+
+        Args:
+            query (Query): The query
+
+        Returns:
+            dict: 'rows', one record per group with its dimensions and aggregates,
+                  and 'plan' when the query asked to explain it
+
+        Raises:
+            ValueError: If the query has more than MAX_GROUPS groups
+        """
+        with span('plan'):
+            plan = self.plan(query)
+        if query.explain:
+            return {'plan': plan}
+
+        strategy = plan['strategy']
+        with span('filter', strategy=strategy):
+            if strategy == 'cube':
+                rows = self.select(self.cube, self.cube_partitions, query, True)
+            else:
+                rows = self.select(self.df, self.partitions, query, strategy == 'partition_scan')
+
+        with span('groupby'):
+            result = self.aggregate(rows, query, strategy == 'cube')
+        if len(result) > MAX_GROUPS:
+            raise ValueError(f"The query has more than {MAX_GROUPS} groups")
+
+        with span('to_dict'):
+            records = [{name: to_json_value(value) for name, value in record.items()}
+                       for record in result.to_dict('records')]
+        return {'rows': records}
+
+    @staticmethod
+    def aggregate(rows, query, from_cube):
+        """
+        Compute the aggregates of every group.
+
+        Args:
+            rows (pandas.DataFrame): The selected rows of the dataset or cells of the cube
+            query (Query): The query
+            from_cube (bool): The rows are cube cells, to be combined
+
+        Returns:
+            pandas.DataFrame: One row per group, dimensions and aggregates as columns
+        """
+        keys = [DIMENSIONS[dimension] for dimension in query.group_by]
+        if from_cube:
+            needed = {'sum', 'count'} if 'mean' in query.aggregates else set()
+            needed.update(name for name in query.aggregates if name in DECOMPOSABLE)
+            merge = {DECOMPOSABLE[name][0]: DECOMPOSABLE[name][1] for name in needed}
+            if keys:
+                combined = rows.groupby(keys, dropna=False, sort=True).agg(merge)
+            else:
+                combined = pd.DataFrame([{column: rows[column].agg(how)
+                                          for column, how in merge.items()}])
+            if 'mean' in query.aggregates:
+                combined['mean'] = combined['sum'] / combined['count'].where(combined['count'] > 0)
+            result = combined[query.aggregates]
+        elif keys:
+            result = rows.groupby(keys, dropna=False, sort=True)['Data_Value'] \
+                .agg([SCAN_AGGREGATES[name] for name in query.aggregates])
+            result.columns = query.aggregates
+        else:
+            result = pd.DataFrame([{name: rows['Data_Value'].agg(SCAN_AGGREGATES[name])
+                                    for name in query.aggregates}])
+
+        if keys:
+            result = result.reset_index()
+        else:
+            result = result.reset_index(drop=True)
+        return result.rename(columns={column: dimension
+                                      for dimension, column in DIMENSIONS.items()})
@@ -0,0 +1,172 @@
+"""
+This module implements the storage of job results.
+Results are kept as already serialized JSON payloads, so serving them does not
+need to decode and re-encode them. Two backends are provided: a bounded in-memory
+store that spills cold or large results to disk, and the original file-per-job layout.
+"""
+from collections import OrderedDict
+from threading import Lock
+import os
+
+
+class FileResultStore:
+    """
+    Stores every result in its own file, named after the job ID.
+
+    This is the original layout of the results/ directory, kept as a compatibility
+    backend and used by the in-memory store for spilled results.
+    """
+    def __init__(self, directory='results'):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+
+    def put(self, job_id, payload):
+        """
+        Save the result of a job.
+
+        Args:
+            job_id (int): ID of the job
+            payload (str): The result, serialized as JSON
+        """
+        with open(os.path.join(self.directory, str(job_id)), 'w', encoding='utf-8') as f:
+            f.write(payload)
+
+    def get(self, job_id):
+        """
+        Load the result of a job.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            str: The result serialized as JSON, or None if there is no result
+        """
+        try:
+            with open(os.path.join(self.directory, str(job_id)), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def stats(self):
+        """
+        Get the occupancy of the store.
+
+        Returns:
+            dict: Name of the backend and its directory
+        """
+        return {'backend': 'file', 'directory': self.directory}
+
+
+class MemoryResultStore: # pylint: disable=too-many-instance-attributes
+    """
+    Bounded in-memory result store with spill-to-disk.
+
+    Results are kept in an LRU ordered dictionary. Results bigger than
+    spill_bytes are written straight to disk, and when more than max_entries
+    results or max_bytes bytes are in memory the least recently used ones are
+    moved to disk. Reading a result still in memory is a dictionary lookup.
+    """
+    def __init__(self, max_entries=10000, spill_bytes=1 << 20, spill_store=None,
+                 max_bytes=256 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_bytes = spill_bytes
+        self.spill_store = spill_store if spill_store is not None else FileResultStore()
+        self.entries = OrderedDict()
+        # Results evicted from memory whose write to disk is not finished yet
+        self.spilling = {}
+        self.memory_bytes = 0
+        self.spilled = 0
+        self.lock = Lock()
+
+    def put(self, job_id, payload):
+        """
+        Save the result of a job, in memory if it is small enough.
+
+        Args:
+            job_id (int): ID of the job
+            payload (str): The result, serialized as JSON
+        """
+        if len(payload) > self.spill_bytes:
+            self.spill_store.put(job_id, payload)
+            with self.lock:
+                self.spilled += 1
+            return
+
+        evicted = []
+        with self.lock:
+            self.entries[job_id] = payload
+            self.memory_bytes += len(payload)
+            while len(self.entries) > self.max_entries or self.memory_bytes > self.max_bytes:
+                evicted_id, evicted_payload = self.entries.popitem(last=False)
+                self.memory_bytes -= len(evicted_payload)
+                # Readers find the result there until it is on disk
+                self.spilling[evicted_id] = evicted_payload
+                evicted.append((evicted_id, evicted_payload))
+
+        # Write outside of the lock, so readers and writers are not held by the disk
+        for evicted_id, evicted_payload in evicted:
+            self.spill_store.put(evicted_id, evicted_payload)
+            with self.lock:
+                self.spilling.pop(evicted_id, None)
+                self.spilled += 1
+
+    def get(self, job_id):
+        """
+        Load the result of a job.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            str: The result serialized as JSON, or None if there is no result
+        """
+        with self.lock:
+            payload = self.entries.get(job_id)
+            if payload is not None:
+                self.entries.move_to_end(job_id)
+                return payload
+            payload = self.spilling.get(job_id)
+            if payload is not None:
+                return payload
+
+        return self.spill_store.get(job_id)
+
+    def stats(self):
+        """
+        Get the occupancy of the store.
+
+        Returns:
+            dict: Number of results and bytes in memory and number of spilled results
+        """
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self.entries),
+                'bytes': self.memory_bytes,
+                'spilled': self.spilled
+            }
+
+
+def create_result_store():
+    """
+    Create the result store selected by the environment.
+
+    RESULT_STORE chooses the backend ('memory' by default, or 'file').
+    RESULT_STORE_MAX_ENTRIES, RESULT_STORE_MAX_BYTES and RESULT_STORE_SPILL_BYTES tune
+    the in-memory store.
+
+    Returns:
+        MemoryResultStore or FileResultStore: The configured store
+    """
+    backend = os.environ.get('RESULT_STORE', 'memory')
+    if backend == 'file':
+        return FileResultStore()
+    if backend == 'memory':
+        return MemoryResultStore(int(os.environ.get('RESULT_STORE_MAX_ENTRIES', 10000)),
+                                 int(os.environ.get('RESULT_STORE_SPILL_BYTES', 1 << 20)),
+                                 max_bytes=int(os.environ.get('RESULT_STORE_MAX_BYTES',
+                                                              256 << 20)))
+
+    raise ValueError(f"Unknown result store backend: {backend}")
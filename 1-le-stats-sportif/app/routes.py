@@ -2,11 +2,81 @@
 This module defines all the API routes for the Le Stats Sportif server.
 It handles various endpoints for calculating statistics based on nutrition and health data.
 """
+# pylint: disable=too-many-lines
 
 import os
 import json
-from flask import request, jsonify
+import math
+import time
+import hashlib
+import hmac
+from flask import request, jsonify, Response, g
 from app import webserver
+from app.datasets import DEFAULT_DATASET
+from app.events import job_event, format_closed, format_event
+from app.memory import memory_report
+from app.query import parse_query
+from app.sampling import APPROXIMABLE
+
+# Upper bound (in seconds) of the 'wait' parameter of get_results
+MAX_WAIT = float(os.environ.get('GET_RESULTS_MAX_WAIT', 30.0))
+# Seconds between two checks of a job owned by another process of the server
+REMOTE_POLL_INTERVAL = 0.02
+# Seconds between two checks of the jobs of another process awaited by an event stream
+SSE_REMOTE_POLL_INTERVAL = float(os.environ.get('SSE_REMOTE_POLL_INTERVAL', 0.25))
+# Largest result (in bytes) embedded in an event of the /api/events stream
+SSE_INLINE_BYTES = int(os.environ.get('SSE_INLINE_BYTES', 4096))
+# Seconds between two keep-alive comments of an idle event stream
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15.0))
+
+# Token expected in the X-Admin-Token header of the admin routes, unset to disable them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Upper bound (in seconds) of the duration of a profile
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60.0))
+
+# Default and maximum number of jobs in a page of /api/jobs
+JOBS_PAGE_SIZE = 100
+JOBS_MAX_PAGE_SIZE = 1000
+
+# Largest number of job IDs of a get_results_bulk request, and of queries of a batch
+MAX_BULK_SIZE = int(os.environ.get('MAX_BULK_SIZE', 1000))
+
+# Requests asking for a synchronous answer are computed inline below this cost (in seconds)
+SYNC_MAX_COST = float(os.environ.get('SYNC_MAX_COST_MS', 10.0)) / 1000
+# Compute time assumed for an endpoint that did not run any job yet (in seconds)
+DEFAULT_COST = {
+    'state_mean': 0.001,
+    'global_mean': 0.001,
+    'state_diff_from_mean': 0.002,
+    'state_mean_by_category': 0.002,
+}
+
+# Parameters of every statistics endpoint, in the order taken by the DataIngestor method
+ENDPOINTS = {
+    'states_mean': ('question',),
+    'state_mean': ('question', 'state'),
+    'best5': ('question',),
+    'worst5': ('question',),
+    'global_mean': ('question',),
+    'diff_from_mean': ('question',),
+    'state_diff_from_mean': ('question', 'state'),
+    'mean_by_category': ('question',),
+    'state_mean_by_category': ('question', 'state'),
+    'query': ('spec',),
+    'correlation': ('by',),
+    'trend': ('question',),
+}
+# Optional parameters of some endpoints, passed after the others, None when missing
+OPTIONAL_PARAMS = {
+    'trend': ('state', 'stratification'),
+}
+
+@webserver.before_request
+def stamp_request():
+    """
+    Record when the request was received, the start of the trace of the jobs it creates.
+    """
+    g.received = time.monotonic()
 
 # Example endpoint definition
 @webserver.route('/api/post_endpoint', methods=['POST'])
@@ -35,6 +105,10 @@ def post_endpoint():
 def get_results(job_id):
     """
     Retrieve the results of a previously submitted job.
+
+    An optional 'wait' query parameter (in seconds) makes the request block until
+    the job completes or the timeout expires, instead of returning 'running' at once.
+    The timeout is capped by the GET_RESULTS_MAX_WAIT environment variable.
     
     Args:
         job_id (str): The ID of the job to retrieve results for
@@ -43,66 +117,638 @@ def get_results(job_id):
         JSON: Status of the job and results if completed
     """
     webserver.logger.info("Received get_results request for job_id: %s", job_id)
-    job_id = int(job_id)
+    job_id = parse_job_id(job_id)
+    # Block until the job completes if the client asked to wait
+    wait = min(request.args.get('wait', 0.0, type=float), MAX_WAIT)
+    if wait > 0:
+        wait_for_job(job_id, wait)
+
+    return Response(job_result(job_id), mimetype='application/json')
+
+@webserver.route('/api/get_results_bulk', methods=['GET', 'POST'])
+def get_results_bulk():
+    """
+    Retrieve the statuses and results of many jobs at once.
+
+    The job IDs are given either as a comma separated 'job_ids' query parameter or
+    as a 'job_ids' list in the JSON body, MAX_BULK_SIZE of them at most. The
+    optional 'wait' query parameter blocks until all the jobs complete or the
+    timeout expires, like for get_results.
+
+    Returns:
+        JSON: A 'results' list with one entry per job, in the requested order, or
+              an error with a 400 status code for a malformed request
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        job_ids = data.get('job_ids', []) if isinstance(data, dict) else None
+        if not isinstance(job_ids, list) or not all(
+                isinstance(job_id, (int, str)) and not isinstance(job_id, bool)
+                for job_id in job_ids):
+            return bad_request("Expected a 'job_ids' list of job IDs")
+    else:
+        job_ids = request.args.get('job_ids', '').split(',')
+    webserver.logger.info("Received get_results_bulk request for %s jobs", len(job_ids))
+    if len(job_ids) > MAX_BULK_SIZE:
+        return bad_request(f"Too many job IDs, at most {MAX_BULK_SIZE}")
+    job_ids = [parse_job_id(job_id) for job_id in job_ids if job_id != '']
+
+    # Wait for all the jobs on a single deadline
+    wait = min(request.args.get('wait', 0.0, type=float), MAX_WAIT)
+    deadline = time.monotonic() + wait
+    for job_id in job_ids:
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            wait_for_job(job_id, remaining)
+
+    results = ', '.join(f'{{"job_id": {json.dumps(job_id)}, "result": {job_result(job_id)}}}'
+                        for job_id in job_ids)
+    return Response(f'{{"results": [{results}]}}', mimetype='application/json')
+
+def bad_request(reason):
+    """
+    Reject a malformed request.
+
+    Args:
+        reason (str): What is wrong with the request
+
+    Returns:
+        tuple: JSON error and 400 status code
+    """
+    return jsonify({"status": "error", "reason": reason}), 400
+
+def parse_job_id(job_id):
+    """
+    Convert a job ID received from a client.
+
+    Args:
+        job_id (str or int): The job ID, as sent by the client
+
+    Returns:
+        int: The job ID, or None if it is not a number
+    """
+    try:
+        return int(job_id)
+    except (TypeError, ValueError):
+        return None
+
+def find_job(job_id):
+    """
+    Look up a job, whichever process of the server owns it.
+
+    Args:
+        job_id (int): The ID of the job
+
+    Returns:
+        dict: The job info, or None if the job does not exist
+    """
+    job_info = webserver.tasks_runner.jobs.get(job_id)
+    if job_info is None and webserver.tasks_runner.shared_jobs is not None:
+        job_info = webserver.tasks_runner.shared_jobs.lookup(job_id)
+    return job_info
+
+def wait_for_job(job_id, timeout):
+    """
+    Block until a job is no longer running or the timeout expires.
+
+    Jobs of this process are waited for on their completion event, jobs owned by
+    another process by polling the shared job store.
+
+    Args:
+        job_id (int): The ID of the job
+        timeout (float): Seconds to wait at most
+    """
+    job_info = webserver.tasks_runner.jobs.get(job_id)
+    if job_info is not None:
+        if job_info['status'] == 'running':
+            job_info['completed'].wait(timeout)
+        return
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job_info = find_job(job_id)
+        if job_info is None or job_info['status'] != 'running':
+            return
+        time.sleep(min(REMOTE_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+def job_result(job_id):
+    """
+    Build the JSON answer describing the state of a job.
+
+    The result of a done job is spliced in as stored, without being decoded.
+
+    Args:
+        job_id (int): The ID of the job
+
+    Returns:
+        str: Status of the job and results if completed, serialized as JSON
+    """
+    job_info = find_job(job_id)
     # Check if the job_id is valid
-    if job_id not in webserver.tasks_runner.jobs:
+    if job_info is None:
         webserver.logger.error("Invalid job_id: %s", job_id)
+        return json.dumps({
+            "reason": "Invalid job_id",
+            "status": "error"
+        })
+    status = job_info['status']
+    webserver.logger.info("Job %s is %s", job_id, status)
+    # Check if the job failed
+    if status == 'error':
+        return json.dumps({
+            "reason": job_info['reason'],
+            "status": "error"
+        })
+    # Still running or cancelled
+    if status != 'done':
+        return json.dumps({
+            "status": status
+        })
+    # The job is done, the stored payload is already serialized
+    payload = webserver.tasks_runner.result_store.get(job_id)
+    if payload is None:
+        webserver.logger.error("Result of job %s is missing from the result store", job_id)
+        return json.dumps({
+            "reason": "Result not found",
+            "status": "error"
+        })
+    return f'{{"data": {payload}, "status": "done"}}'
+
+@webserver.route('/api/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a job that was not picked up by a worker yet.
+
+    In multi-process mode, only the process that received the job can cancel it.
+
+    Args:
+        job_id (str): The ID of the job to cancel
+
+    Returns:
+        JSON: Whether the job was cancelled or the reason it could not be
+    """
+    webserver.logger.info("Received cancel request for job_id: %s", job_id)
+    job_id = parse_job_id(job_id)
+    if job_id not in webserver.tasks_runner.jobs:
+        job_info = find_job(job_id)
+        if job_info is None:
+            webserver.logger.error("Invalid job_id: %s", job_id)
+            return jsonify({
+                "status": "error",
+                "reason": "Invalid job_id"
+            })
+        # Only the process that queued a job can take it out of its queue
         return jsonify({
             "status": "error",
-            "reason": "Invalid job_id"
+            "reason": "Job owned by another server process" if job_info['status'] == 'running'
+                      else "Job already started"
         })
-    # Check if the job is still running
-    if webserver.tasks_runner.jobs[job_id]['status'] == 'running':
-        webserver.logger.info("Job %s is still running", job_id)
+    if not webserver.tasks_runner.cancel_job(job_id):
         return jsonify({
-            "status": "running"
+            "status": "error",
+            "reason": "Job already started"
         })
-    # Check if the job is done
-    if webserver.tasks_runner.jobs[job_id]['status'] == 'done':
-        webserver.logger.info("Job %s is done", job_id)
-        result_file = f"results/{str(job_id)}"
-        if os.path.exists(result_file):
-            with open(result_file, 'r', encoding='utf-8') as f:
-                result = json.load(f)
-            return jsonify({
-                "status": "done",
-                "data": result
-            })
 
     return jsonify({
-                "status": "done",
-                "data": result
-            })
+        "status": "cancelled"
+    })
 
-@webserver.route('/api/states_mean', methods=['POST'])
-def states_mean_request():
+@webserver.route('/api/events', methods=['GET'])
+def events():
     """
-    Handle requests to calculate the mean value for each state for a specific question.
-    
+    Stream job completion notifications as Server-Sent Events.
+
+    Every job that is done, failed or was cancelled produces one event. The optional
+    'job_ids' query parameter (comma separated) restricts the stream to those jobs;
+    the stream then ends once all of them completed. Results smaller than the
+    'inline' query parameter (in bytes) are embedded in the events.
+
+    In multi-process mode, the requested jobs owned by another process are polled
+    from the shared job store every SSE_REMOTE_POLL_INTERVAL seconds; a stream
+    without 'job_ids' only gets the events of the process that serves it.
+
+    Every subscriber holds a request thread until it disconnects, so at most
+    SSE_MAX_SUBSCRIBERS streams (2000 by default) are open at once; the next ones
+    get a 503. A client
+    too slow to read its events gets those already queued, then an 'overflow'
+    event listing the requested jobs it missed, and the stream ends.
+
+    Returns:
+        Response: A text/event-stream response
+    """
+    webserver.logger.info("Received events subscription: %s", request.args)
+    job_ids = None
+    if request.args.get('job_ids'):
+        try:
+            job_ids = {int(job_id) for job_id in request.args['job_ids'].split(',')}
+        except ValueError:
+            return bad_request("Invalid job_ids")
+    inline_bytes = request.args.get('inline', SSE_INLINE_BYTES, type=int)
+    subscription = webserver.tasks_runner.events.subscribe(job_ids)
+    if subscription is None:
+        return jsonify({
+            "status": "error",
+            "reason": "Too many event streams"
+        }), 503, {'Retry-After': str(math.ceil(SSE_HEARTBEAT))}
+
+    def relevant(event, pending):
+        if pending is None:
+            return True
+        if event['job_id'] not in pending:
+            return False
+        pending.discard(event['job_id'])
+        return True
+
+    def stream():
+        pending = set(job_ids) if job_ids is not None else None
+        try:
+            # Replay the requested jobs that completed before the subscription
+            for job_id in sorted(job_ids or ()):
+                event = completed_job_event(job_id)
+                if event is not None:
+                    pending.discard(job_id)
+                    yield format_event(event, inline_bytes)
+
+            # No event is published here for the jobs of the other processes
+            foreign = {job_id for job_id in pending or ()
+                       if job_id not in webserver.tasks_runner.jobs}
+            next_poll = time.monotonic() + SSE_REMOTE_POLL_INTERVAL
+            idle = 0.0
+            while pending is None or pending:
+                if subscription.closed:
+                    # Deliver what was queued before the overflow, then say what was lost
+                    for event in subscription.drain():
+                        if relevant(event, pending):
+                            yield format_event(event, inline_bytes)
+                    yield format_closed(pending)
+                    break
+                timeout = min(SSE_REMOTE_POLL_INTERVAL, SSE_HEARTBEAT) if foreign \
+                    else SSE_HEARTBEAT
+                event = subscription.next_event(timeout)
+                if event is not None and relevant(event, pending):
+                    yield format_event(event, inline_bytes)
+                if foreign and time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + SSE_REMOTE_POLL_INTERVAL
+                    for completed in completed_foreign_events(foreign):
+                        pending.discard(completed['job_id'])
+                        yield format_event(completed, inline_bytes)
+                idle = 0.0 if event is not None else idle + timeout
+                if idle >= SSE_HEARTBEAT:
+                    idle = 0.0
+                    yield ': keep-alive\n\n'
+        finally:
+            webserver.tasks_runner.events.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The generator never runs if the response is dropped before being sent
+    response.call_on_close(lambda: webserver.tasks_runner.events.unsubscribe(subscription))
+    return response
+
+def completed_foreign_events(foreign):
+    """
+    Check the jobs of other processes awaited by an event stream.
+
+    Args:
+        foreign (set): IDs of the awaited jobs, those that completed are removed
+
+    Returns:
+        list: The events of the jobs that completed
+    """
+    completed = []
+    for job_id in sorted(foreign):
+        event = completed_job_event(job_id)
+        if event is not None:
+            foreign.discard(job_id)
+            completed.append(event)
+    return completed
+
+def completed_job_event(job_id):
+    """
+    Build the event of a job that is no longer running.
+
+    Args:
+        job_id (int): The ID of the job
+
+    Returns:
+        dict: The event, None if the job is still running
+    """
+    job_info = find_job(job_id)
+    if job_info is None:
+        return {'job_id': job_id, 'status': 'error', 'reason': 'Invalid job_id'}
+    if job_info['status'] == 'running':
+        return None
+    payload = None
+    if job_info['status'] == 'done':
+        payload = webserver.tasks_runner.result_store.get(job_id)
+    return job_event(job_info, payload)
+
+@webserver.route('/api/batch', methods=['POST'])
+def batch_request():
+    """
+    Handle a batch of heterogeneous statistics requests in one round trip.
+
+    The body is a list of queries (or an object with a 'queries' list), MAX_BULK_SIZE
+    of them at most. Every query holds the name of the 'endpoint' and the same
+    parameters as the request sent to that endpoint, e.g.
+    {"endpoint": "state_mean", "question": "...", "state": "Ohio"}.
+
+    Returns:
+        JSON: A 'jobs' list with, for every query, its job ID or the reason it was
+              rejected, or an error with a 400 status code for a malformed request
+    """
+    data = request.get_json(silent=True)
+    queries = data.get('queries', []) if isinstance(data, dict) else data
+    if webserver.tasks_runner.graceful_shutdown.is_set():
+        webserver.logger.error("Server is shutting down, cannot process request.")
+        return jsonify({
+            "status": "error",
+            "reason": "shutting down"
+        })
+    if not isinstance(queries, list):
+        return bad_request("Expected a list of queries")
+    webserver.logger.info("Received batch request with %s queries", len(queries))
+    if len(queries) > MAX_BULK_SIZE:
+        return bad_request(f"Too many queries, at most {MAX_BULK_SIZE}")
+
+    jobs_info = []
+    for query in queries:
+        reason = validate_query(query)
+        if reason is None and webserver.rate_limiter.acquire(client_id(), query['endpoint']):
+            reason = "Rate limit exceeded"
+        if reason is not None:
+            jobs_info.append({"status": "error", "reason": reason})
+        else:
+            jobs_info.append({"job_id": create_job(query['endpoint'], query)})
+
+    return jsonify({"jobs": jobs_info})
+
+def validate_query(query):
+    """
+    Check that a query of a batch names a known endpoint and has all its parameters.
+
+    Args:
+        query (dict): The query to check
+
+    Returns:
+        str: The reason the query is invalid, or None if it is valid
+    """
+    if not isinstance(query, dict) or query.get('endpoint') not in ENDPOINTS:
+        return "Unknown endpoint"
+    for param in ENDPOINTS[query['endpoint']]:
+        if param not in query:
+            return f"Missing parameter: {param}"
+    if unknown_dataset(query):
+        return "Unknown dataset"
+    return None
+
+def create_job(endpoint, data, inline=False):
+    """
+    Create a job computing a statistic and add it to the thread pool.
+
+    Args:
+        endpoint (str): Name of the statistic, one of ENDPOINTS
+        data (dict): Parameters of the request
+        inline (bool): Compute the job right away on the calling thread
+
+    Returns:
+        int: The ID of the new job
+    """
+    # Allocate the job_id atomically, request threads may run concurrently
+    job_id = webserver.tasks_runner.jobs.allocate_id()
+    # Results precomputed at startup are served as they are
+    payload = warmed_up(endpoint, data)
+    # Create task as a closure
+    def task():
+        if payload is not None:
+            return payload
+        try:
+            return getattr(dataset(data), endpoint)(*job_params(endpoint, data))
+        finally:
+            # Charge the caches the job built to the memory budget of the datasets
+            webserver.datasets.refresh(dataset_name(data))
+
+    if inline:
+        webserver.tasks_runner.run_inline(job_id, task, endpoint, g.get('received'))
+        webserver.logger.info("Job %s computed inline.", job_id)
+        return job_id
+
+    # Remote workers get the arguments instead of the closure, they only know the
+    # default dataset
+    args = None
+    if payload is None and isinstance(data, dict) and \
+            data.get('dataset', DEFAULT_DATASET) == DEFAULT_DATASET and \
+            all(param in data for param in ENDPOINTS[endpoint]):
+        args = job_params(endpoint, data)
+
+    # Add task to the thread pool. Task will contain the job_id, the task and the status
+    webserver.tasks_runner.add_job(job_id, task, endpoint, args, client_id(),
+                                   g.get('received'))
+
+    webserver.logger.info("Job %s added to the queue for processing.", job_id)
+    return job_id
+
+def job_params(endpoint, data):
+    """
+    Get the arguments of the DataIngestor method of an endpoint from a request.
+
+    The OPTIONAL_PARAMS follow the required ones, and the optional 'approx'
+    parameter of the statistics is passed last.
+
+    Args:
+        endpoint (str): Name of the statistic, one of ENDPOINTS
+        data (dict): Parameters of the request
+
+    Returns:
+        list: The arguments
+
+    Raises:
+        KeyError: If a parameter is missing
+    """
+    params = [data[param] for param in ENDPOINTS[endpoint]]
+    params.extend(data.get(param) for param in OPTIONAL_PARAMS.get(endpoint, ()))
+    if endpoint in APPROXIMABLE and data.get('approx'):
+        params.append(data['approx'])
+    return params
+
+def dataset_name(data):
+    """
+    Get the name of the dataset a request asks for.
+
+    Args:
+        data (dict): Parameters of the request, with an optional 'dataset' name
+
+    Returns:
+        str: The name, DEFAULT_DATASET when the request names none
+    """
+    name = data.get('dataset') if isinstance(data, dict) else None
+    return DEFAULT_DATASET if name is None else name
+
+def dataset(data):
+    """
+    Get the dataset a request asks for, loading it if needed.
+
+    Args:
+        data (dict): Parameters of the request, with an optional 'dataset' name
+
+    Returns:
+        DataIngestor: The dataset, the default one when the request names none
+
+    Raises:
+        ValueError: If the dataset is not registered
+    """
+    name = dataset_name(data)
+    if name == DEFAULT_DATASET:
+        return webserver.data_ingestor
+    return webserver.datasets.get(name)
+
+def unknown_dataset(data):
+    """
+    Check if a request names a dataset that is not registered.
+
+    Args:
+        data (dict): Parameters of the request
+
+    Returns:
+        bool: True if the 'dataset' parameter is set and unknown
+    """
+    name = data.get('dataset') if isinstance(data, dict) else None
+    return name is not None and (not isinstance(name, str) or name not in webserver.datasets)
+
+def warmed_up(endpoint, data):
+    """
+    Look up the result of a request among the results precomputed at startup.
+
+    Args:
+        endpoint (str): Name of the statistic, one of ENDPOINTS
+        data (dict): Parameters of the request
+
+    Returns:
+        Payload: The serialized result, or None if it was not precomputed
+    """
+    if webserver.warmup is None or not isinstance(data, dict) or \
+            data.get('dataset', DEFAULT_DATASET) != DEFAULT_DATASET:
+        return None
+    try:
+        return webserver.warmup.get(endpoint, job_params(endpoint, data))
+    except KeyError:
+        return None
+
+def client_id():
+    """
+    Identify the client of the current request.
+
+    Clients are told apart by their X-API-Key header, or by their address when
+    they send none. Keys are hashed, so they never show up in the usage stats.
+
+    Returns:
+        str: Identifier of the client
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return request.remote_addr or 'unknown'
+
+def rate_limited(retry_after):
+    """
+    Build the answer to a request over the rate limit of its client.
+
+    Args:
+        retry_after (float): Seconds to wait before retrying
+
+    Returns:
+        tuple: JSON error, 429 status code and Retry-After header
+    """
+    webserver.logger.warning("Client %s is over its rate limit", client_id())
+    return jsonify({
+        "status": "error",
+        "reason": "Rate limit exceeded"
+    }), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+def wants_sync():
+    """
+    Check if the client asked for a synchronous answer.
+
+    Synchronous mode is requested with the 'sync' query parameter or the
+    'X-Sync' header, set to 1 or true.
+
+    Returns:
+        bool: True if the client wants the result in the response
+    """
+    flag = request.args.get('sync', request.headers.get('X-Sync', ''))
+    return flag.lower() in ('1', 'true', 'yes')
+
+def estimated_cost(endpoint):
+    """
+    Estimate the compute time of a job of an endpoint.
+
+    Uses the average compute time measured so far, or DEFAULT_COST before the
+    endpoint ran any job. Endpoints without a default are assumed to be expensive.
+
+    Args:
+        endpoint (str): Name of the statistic, one of ENDPOINTS
+
+    Returns:
+        float: Estimated compute time in seconds
+    """
+    cost = webserver.tasks_runner.metrics.mean_duration(endpoint, 'compute')
+    if cost is None:
+        cost = DEFAULT_COST.get(endpoint, float('inf'))
+    return cost
+
+def with_job_id(job_id, answer):
+    """
+    Add the job ID to the JSON answer describing the state of a job.
+
+    The answer is spliced as is when it is a non empty object, as job_result
+    builds it, so the result it embeds is not decoded again.
+
+    Args:
+        job_id (int): The ID of the job
+        answer (str): Status of the job and results if completed, serialized as JSON
+
+    Returns:
+        str: The answer with a leading 'job_id' field
+    """
+    if answer.startswith('{"') and answer.endswith('}'):
+        return f'{{"job_id": {json.dumps(job_id)}, {answer[1:]}'
+    return json.dumps({'job_id': job_id, **json.loads(answer)})
+
+def submit_job(endpoint, data):
+    """
+    Submit the request of a statistics endpoint as a new job.
+
+    If the client asked for a synchronous answer, the job is estimated to be
+    cheaper than SYNC_MAX_COST and its dataset is already loaded, it is computed
+    inline and its result is returned along with the job ID. Otherwise only the
+    job ID is returned, and the job is queued like an asynchronous one.
+
+    Args:
+        endpoint (str): Name of the statistic, one of ENDPOINTS
+        data (dict): Parameters of the request
+
     Returns:
         JSON: Job ID for the created task or error if server is shutting down
     """
-    data = request.json
-    webserver.logger.info("Received states_mean request with data: %s", data)
+    if unknown_dataset(data):
+        return jsonify({
+            "status": "error",
+            "reason": "Unknown dataset"
+        })
+
+    retry_after = webserver.rate_limiter.acquire(client_id(), endpoint)
+    if retry_after:
+        return rate_limited(retry_after)
+
     # Check if the graceful shutdown event is set
     if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.states_mean(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
+        if wants_sync() and estimated_cost(endpoint) <= SYNC_MAX_COST and \
+                webserver.datasets.is_loaded(dataset_name(data)):
+            job_id = create_job(endpoint, data, inline=True)
+            return Response(with_job_id(job_id, job_result(job_id)),
+                            mimetype='application/json')
         # Return associated job_id
-        return jsonify({"job_id": job_id})
+        return jsonify({"job_id": create_job(endpoint, data)})
 
     webserver.logger.error("Server is shutting down, cannot process request.")
     return jsonify({
@@ -110,6 +756,18 @@ def states_mean_request():
         "reason": "shutting down"
     })
 
+@webserver.route('/api/states_mean', methods=['POST'])
+def states_mean_request():
+    """
+    Handle requests to calculate the mean value for each state for a specific question.
+    
+    Returns:
+        JSON: Job ID for the created task or error if server is shutting down
+    """
+    data = request.json
+    webserver.logger.info("Received states_mean request with data: %s", data)
+    return submit_job('states_mean', data)
+
 @webserver.route('/api/state_mean', methods=['POST'])
 def state_mean_request():
     """
@@ -120,30 +778,7 @@ def state_mean_request():
     """
     data = request.json
     webserver.logger.info("Received state_mean request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.state_mean(data['question'], data['state'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-            "status": "error",
-            "reason": "shutting down"
-    })
+    return submit_job('state_mean', data)
 
 @webserver.route('/api/best5', methods=['POST'])
 def best5_request():
@@ -155,30 +790,7 @@ def best5_request():
     """
     data = request.json
     webserver.logger.info("Received best5 request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.best5(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('best5', data)
 
 @webserver.route('/api/worst5', methods=['POST'])
 def worst5_request():
@@ -190,30 +802,7 @@ def worst5_request():
     """
     data = request.json
     webserver.logger.info("Received worst5 request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.worst5(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('worst5', data)
 
 @webserver.route('/api/global_mean', methods=['POST'])
 def global_mean_request():
@@ -225,30 +814,7 @@ def global_mean_request():
     """
     data = request.json
     webserver.logger.info("Received global_mean request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.global_mean(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('global_mean', data)
 
 
 @webserver.route('/api/diff_from_mean', methods=['POST'])
@@ -261,30 +827,7 @@ def diff_from_mean_request():
     """
     data = request.json
     webserver.logger.info("Received diff_from_mean request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.diff_from_mean(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('diff_from_mean', data)
 
 @webserver.route('/api/state_diff_from_mean', methods=['POST'])
 def state_diff_from_mean_request():
@@ -296,30 +839,7 @@ def state_diff_from_mean_request():
     """
     data = request.json
     webserver.logger.info("Received state_diff_from_mean request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.state_diff_from_mean(data['question'], data['state'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('state_diff_from_mean', data)
 
 @webserver.route('/api/mean_by_category', methods=['POST'])
 def mean_by_category_request():
@@ -331,30 +851,7 @@ def mean_by_category_request():
     """
     data = request.json
     webserver.logger.info("Received mean_by_category request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.mean_by_category(data['question'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
-
-    webserver.logger.error("Server is shutting down, cannot process request.")
-    return jsonify({
-        "status": "error",
-        "reason": "shutting down"
-    })
+    return submit_job('mean_by_category', data)
 
 @webserver.route('/api/state_mean_by_category', methods=['POST'])
 def state_mean_by_category_request():
@@ -366,53 +863,288 @@ def state_mean_by_category_request():
     """
     data = request.json
     webserver.logger.info("Received state_mean_by_category request with data: %s", data)
-    if not webserver.tasks_runner.graceful_shutdown.is_set():
-        job_id = webserver.job_counter
-        # Create task as a closure
-        def task():
-            result = webserver.data_ingestor.state_mean_by_category(data['question'], data['state'])
-            return result
-
-        # Add task to the thread pool. Task will contain the job_id, the task and the status
-        webserver.tasks_runner.add_job(job_id, task)
-        # Increment job_id counter
-        webserver.job_counter += 1
-        # Increment threadpool remaining jobs
-        with webserver.tasks_runner.remaining_jobs_lock:
-            webserver.tasks_runner.remaining_jobs += 1
-
-        webserver.logger.info("Job %s added to the queue for processing.", job_id)
-        # Return associated job_id
-        return jsonify({"job_id": job_id})
+    return submit_job('state_mean_by_category', data)
 
-    webserver.logger.error("Server is shutting down, cannot process request.")
+@webserver.route('/api/query', methods=['POST'])
+def query_request():
+    """
+    Handle a declarative query: filters, group-by dimensions and aggregates.
+
+    The body is the query, e.g. {"filters": {"question": "...", "year": 2019},
+    "group_by": ["state"], "aggregates": ["mean", "count"]}. The dimensions are
+    question, state, year, category and stratification; the aggregates mean,
+    count, sum, min, max, median and std. With "explain": true the result is the
+    plan of the query and its estimated cost instead of its rows.
+
+    Returns:
+        JSON: Job ID for the created task, or the reason the query is invalid
+    """
+    data = request.json
+    webserver.logger.info("Received query request with data: %s", data)
+    # The dataset is not part of the query itself
+    name = data.pop('dataset', None) if isinstance(data, dict) else None
+    try:
+        parse_query(data)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "reason": str(e)
+        })
+    return submit_job('query', {'spec': data, 'dataset': name})
+
+
+@webserver.route('/api/correlation', methods=['POST'])
+def correlation_request():
+    """
+    Handle requests for the correlation matrix of the per-state means.
+
+    The optional "by" parameter is "question" (the default) for the correlations
+    between the questions across the states, or "state" for the similarities
+    between the states across the questions.
+
+    Returns:
+        JSON: Job ID for the created task or error if server is shutting down
+    """
+    data = request.get_json(silent=True)
+    webserver.logger.info("Received correlation request with data: %s", data)
+    data = data if isinstance(data, dict) else {}
+    return submit_job('correlation', {'by': data.get('by', 'question'),
+                                      'dataset': data.get('dataset')})
+
+
+@webserver.route('/api/trend', methods=['POST'])
+def trend_request():
+    """
+    Handle requests for the yearly trend of the states for a question.
+
+    The "question" is required, "state" and "stratification" (a Stratification1
+    value) optionally restrict the result.
+
+    Returns:
+        JSON: Job ID for the created task or error if server is shutting down
+    """
+    data = request.json
+    webserver.logger.info("Received trend request with data: %s", data)
+    return submit_job('trend', data)
+
+
+@webserver.route('/api/datasets', methods=['GET'])
+def get_datasets():
+    """
+    List the datasets this server can answer on.
+
+    Every statistics endpoint takes an optional "dataset" parameter naming one of
+    them; the requests without it use the "default" dataset.
+
+    Returns:
+        JSON: Memory budget and, for every dataset, its path, whether it is loaded,
+              its size and how many times it was loaded, used and evicted
+    """
+    webserver.logger.info("Received request for the datasets.")
     return jsonify({
-        "status": "error",
-        "reason": "shutting down"
+        "status": "done",
+        "data": webserver.datasets.stats()
     })
 
+def server_remaining_jobs():
+    """
+    Count the jobs that are queued or running, in every process of the server.
+
+    Returns:
+        int: Number of remaining jobs
+    """
+    if webserver.tasks_runner.shared_jobs is not None:
+        return webserver.tasks_runner.shared_jobs.remaining()
+    return webserver.tasks_runner.remaining_jobs
 
 @webserver.route('/api/num_jobs', methods=['GET'])
 def get_num_jobs():
     """
     Get the number of jobs currently in the queue waiting to be processed.
+
+    The number is read from the counters kept by the job registry, without
+    walking the job table. In multi-process mode, the jobs of every process are
+    counted in the shared job store.
     
     Returns:
         JSON: Number of remaining jobs
     """
-    webserver.logger.info("Received request for number of jobs in the queue.")
-    # Return the number of jobs in the queue
-    webserver.logger.info("Number of jobs in the queue: %s", webserver.tasks_runner.remaining_jobs)
+    num_jobs = server_remaining_jobs()
+    webserver.logger.info("Number of jobs in the queue: %s", num_jobs)
     return jsonify({
-        'num_jobs': webserver.tasks_runner.remaining_jobs
+        'num_jobs': num_jobs
     })
 
+@webserver.route('/api/ready', methods=['GET'])
+def get_ready():
+    """
+    Check if the server is ready to serve requests.
+
+    The server is not ready while the startup warm-up runs (see app/warmup.py),
+    or once it is shutting down.
+
+    Returns:
+        JSON: Readiness and progress of the warm-up, with a 503 status code when
+              the server is not ready
+    """
+    warmup = webserver.warmup.status() if webserver.warmup is not None else None
+    shutting_down = webserver.tasks_runner.graceful_shutdown.is_set()
+    ready = not shutting_down and (warmup is None or warmup['ready'])
+    return jsonify({
+        "status": "ready" if ready else "shutting down" if shutting_down else "warming up",
+        "warmup": warmup
+    }), 200 if ready else 503
+
+@webserver.route('/api/workers', methods=['GET'])
+def get_workers():
+    """
+    Get the health of the worker pool.
+
+    Returns:
+        JSON: Alive workers, respawned workers and failed jobs per endpoint
+    """
+    webserver.logger.info("Received request for worker pool status.")
+    return jsonify({
+        "status": "done",
+        "data": webserver.tasks_runner.supervisor.status()
+    })
+
+@webserver.route('/api/clients', methods=['GET'])
+def get_clients():
+    """
+    Get the usage of the server by every client.
+
+    Returns:
+        JSON: Requests, throttled requests, queued and served jobs of every client
+    """
+    webserver.logger.info("Received request for client usage stats.")
+    clients = {}
+    for client, usage in webserver.rate_limiter.stats().items():
+        clients.setdefault(client, {}).update(usage)
+    for client, usage in webserver.tasks_runner.queue.stats().items():
+        clients.setdefault(client, {}).update(usage)
+    return jsonify({
+        "status": "done",
+        "data": clients
+    })
+
+@webserver.route('/api/admin/profile', methods=['POST'])
+def profile_server():
+    """
+    Profile the whole server (request threads and workers) for some seconds.
+
+    Admin only: the X-Admin-Token header must match the ADMIN_TOKEN environment
+    variable. The 'seconds' query parameter sets the duration (1 by default),
+    'interval' the seconds between two samples, and 'idle=true' also counts the
+    threads waiting for work. With 'format=collapsed' the stacks are returned in
+    the collapsed format of flamegraph tools instead of aggregated stats.
+
+    Returns:
+        JSON: Samples per thread and the hottest functions, or the collapsed stacks
+    """
+    if not is_admin():
+        return jsonify({"status": "error", "reason": "Forbidden"}), 403
+
+    seconds = min(max(request.args.get('seconds', 1.0, type=float), 0.0), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+    idle = request.args.get('idle', '').lower() in ('1', 'true', 'yes')
+    webserver.logger.info("Profiling the server for %s seconds", seconds)
+
+    profiler = webserver.profiler.profile(seconds, interval, idle)
+    if profiler is None:
+        return jsonify({"status": "error", "reason": "A profile is already running"}), 409
+
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify({
+        "status": "done",
+        "data": profiler.stats(request.args.get('top', 20, type=int))
+    })
+
+def is_admin():
+    """
+    Check that the current request carries the admin token.
+
+    Returns:
+        bool: True if ADMIN_TOKEN is set and matches the X-Admin-Token header
+    """
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@webserver.route('/api/memory', methods=['GET'])
+def get_memory():
+    """
+    Account for the memory of this server process.
+
+    Reports the footprint of every column of the dataset and the estimated size of
+    its caches (query cube, stratified sample, correlation pivot, trend fits), the
+    estimated size of the job table and of the closures retained by its jobs, the
+    bytes of the queued jobs, the result store and trace buffer occupancy, the
+    process RSS and the size of every loaded dataset, its DataFrame and its caches.
+    'deep=0' skips walking the strings of the dataset, which is slow on big ones.
+    When allocations are traced (see /api/admin/tracemalloc), the 'top' lines of
+    code holding the most memory are listed, with their growth since the last call.
+
+    Returns:
+        JSON: Memory usage, in bytes
+    """
+    webserver.logger.info("Received request for memory usage.")
+    deep = request.args.get('deep', '1').lower() in ('1', 'true', 'yes')
+    report = memory_report(webserver.tasks_runner, webserver.data_ingestor, deep)
+    report['tracemalloc'] = webserver.memory_tracker.report(request.args.get('top', 10, type=int))
+    report['datasets'] = webserver.datasets.stats()
+    return jsonify({
+        "status": "done",
+        "data": report
+    })
+
+@webserver.route('/api/admin/tracemalloc', methods=['POST'])
+def toggle_tracemalloc():
+    """
+    Start or stop tracing the allocations reported by /api/memory.
+
+    Admin only. 'action' is 'start' (with the number of 'frames' kept per
+    allocation, 1 by default) or 'stop'. Tracing slows every allocation down.
+
+    Returns:
+        JSON: Whether allocations are now traced
+    """
+    if not is_admin():
+        return jsonify({"status": "error", "reason": "Forbidden"}), 403
+
+    action = request.args.get('action')
+    if action == 'start':
+        webserver.memory_tracker.start(max(request.args.get('frames', 1, type=int), 1))
+    elif action == 'stop':
+        webserver.memory_tracker.stop()
+    else:
+        return jsonify({"status": "error", "reason": "Unknown action"})
+    webserver.logger.warning("Allocation tracing: %s", action)
+    return jsonify({
+        "status": "done",
+        "data": {"tracing": action == 'start'}
+    })
+
+@webserver.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Expose the job timing metrics in the Prometheus text format.
+
+    Returns:
+        Response: Latency histograms, throughput counters and worker utilization
+    """
+    metrics = webserver.tasks_runner.metrics.render(webserver.tasks_runner.queue.qsize(),
+                                                    webserver.tasks_runner.num_threads)
+    return Response(metrics, mimetype='text/plain; version=0.0.4')
+
 @webserver.route('/api/graceful_shutdown', methods=['GET'])
 def graceful_shutdown():
     """
     Initiate a graceful shutdown of the server.
     
     Sets the shutdown flag and continues processing existing jobs without accepting new ones.
+    In multi-process mode every process of the server is shut down, and the answer
+    covers the jobs of all of them.
     
     Returns:
         JSON: Status indicating if the server is still processing jobs or ready to shut down
@@ -420,8 +1152,10 @@ def graceful_shutdown():
     webserver.logger.info("Received request for graceful shutdown.")
     # Set the graceful shutdown event
     webserver.tasks_runner.graceful_shutdown.set()
+    if webserver.broadcast_shutdown is not None:
+        webserver.broadcast_shutdown()
     # Check if there are any remaining jobs in the queue
-    if webserver.tasks_runner.remaining_jobs > 0:
+    if server_remaining_jobs() > 0:
         webserver.logger.info("Server is still processing jobs.")
         return jsonify({
             "status": "running"
@@ -436,22 +1170,76 @@ def graceful_shutdown():
 @webserver.route('/api/jobs', methods=['GET'])
 def jobs():
     """
-    Get information about all jobs that have been submitted to the server.
-    
+    Get information about the jobs that have been submitted to the server.
+
+    The jobs are returned in pages of at most 'limit' jobs (100 by default), in ID
+    order. The 'next_cursor' of the answer is passed as 'cursor' to get the next page,
+    and is null after the last one. The jobs can be filtered by 'status', 'endpoint'
+    and submission time ('since' and 'until', as UNIX timestamps).
+    With 'summary=1' only the number of jobs in every state is returned.
+
     Returns:
-        JSON: List of all job IDs and their current status
+        JSON: List of job IDs and their current status, or the counts per status
     """
-    webserver.logger.info("Received request for all jobs information.")
-    data = []
+    webserver.logger.info("Received request for jobs information: %s", request.args)
+    if request.args.get('summary', '').lower() in ('1', 'true', 'yes'):
+        return jsonify({
+            "status": "done",
+            "data": webserver.tasks_runner.jobs.counts()
+        })
+
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = min(max(request.args.get('limit', JOBS_PAGE_SIZE, type=int), 1), JOBS_MAX_PAGE_SIZE)
+    status = request.args.get('status')
+    endpoint = request.args.get('endpoint')
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+
+    def matches(job_info):
+        return ((status is None or job_info['status'] == status) and
+                (endpoint is None or job_info['endpoint'] == endpoint) and
+                (since is None or job_info['submitted_at'] >= since) and
+                (until is None or job_info['submitted_at'] <= until))
+
+    filtered = any(value is not None for value in (status, endpoint, since, until))
+    found, next_cursor = webserver.tasks_runner.jobs.scan(cursor, limit,
+                                                          matches if filtered else None)
     # Extract job informations from the tasks_runner
-    for job_id, job_info in webserver.tasks_runner.jobs.items():
-        data.append({
-            f'job_id_{str(job_id)}': job_info['status']
+    data = [{f'job_id_{str(job_info["job_id"])}': job_info['status']} for job_info in found]
+    webserver.logger.info("Sent information about %s jobs", len(data))
+    return jsonify({
+        "status": "done",
+        "data": data,
+        "next_cursor": next_cursor
+    })
+
+@webserver.route('/api/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    """
+    Get the trace of a recent job: the timed spans of its way through the server.
+
+    Only the traces of the latest TRACE_BUFFER_SIZE jobs of this process are kept.
+    With 'format=chrome' the trace is returned in the Trace Event Format, to be
+    saved and opened in chrome://tracing or Perfetto.
+
+    Args:
+        job_id (str): The ID of the job
+
+    Returns:
+        JSON: Spans of the job with their thread, start and duration in milliseconds
+    """
+    webserver.logger.info("Received trace request for job_id: %s", job_id)
+    trace = webserver.tasks_runner.traces.get(parse_job_id(job_id))
+    if trace is None:
+        return jsonify({
+            "status": "error",
+            "reason": "Trace not found"
         })
-    webserver.logger.info("Sent jobs information: %s", data)
+    if request.args.get('format') == 'chrome':
+        return jsonify({"traceEvents": trace.to_events(), "displayTimeUnit": "ms"})
     return jsonify({
         "status": "done",
-        "data": data  
+        "data": trace.to_dict()
     })
 
 # You can check localhost in your browser to see what this displays
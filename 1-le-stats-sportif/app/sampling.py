@@ -0,0 +1,306 @@
+"""
+This module implements the approximate answers of the statistics endpoints.
+
+The rows with a value are shuffled once and every (question, state) stratum keeps
+its first APPROX_SAMPLE_SIZE rows, ranked in that random order. A level of the
+sample is the rows ranked below some size, so a bigger level always contains the
+smaller ones and is just a longer prefix of the question partition of the sample.
+Estimates are computed on a level with their 95% confidence interval: per state
+from the sample of the stratum, across states with the stratified estimator
+weighted by the number of rows of every state.
+
+A request asks for a target error (the largest half-width of the intervals) or for
+a time budget. Levels are tried from the smallest until the error is reached or
+the budget would be exceeded; when even the whole sample misses the target error,
+the exact answer is computed instead.
+"""
+from threading import Lock
+import math
+import os
+import time
+import numpy as np
+
+# Quantile of the normal distribution for 95% confidence intervals
+Z_95 = 1.96
+# Smallest level of the sample, every next level is LEVEL_GROWTH times bigger
+FIRST_LEVEL = 32
+LEVEL_GROWTH = 4
+
+# Endpoints that can be approximated, and their number of arguments
+APPROXIMABLE = {
+    'states_mean': 1, 'state_mean': 2, 'best5': 1, 'worst5': 1, 'global_mean': 1,
+    'diff_from_mean': 1, 'state_diff_from_mean': 2, 'mean_by_category': 1,
+    'state_mean_by_category': 2,
+}
+
+
+def parse_approx(approx):
+    """
+    Validate the approx parameter of a request.
+
+    Args:
+        approx: True for the whole sample, or a dict with a target 'error' (in
+                Data_Value units) or a time budget 'time_ms'
+
+    Returns:
+        dict: The target 'error' and the 'time_ms' budget, None when not set
+
+    Raises:
+        ValueError: If the parameter is malformed
+    """
+    if approx is True:
+        return {'error': None, 'time_ms': None}
+    if not isinstance(approx, dict) or not set(approx) <= {'error', 'time_ms'} or \
+            not all(isinstance(value, (int, float)) and value > 0 for value in approx.values()):
+        raise ValueError("'approx' must be true, or hold a positive 'error' or 'time_ms'")
+    return {'error': approx.get('error'), 'time_ms': approx.get('time_ms')}
+
+
+def interval(mean, var, n, population):
+    """
+    Compute the half-width of the 95% confidence interval of a sample mean.
+
+    Args:
+        mean (float): Mean of the sample
+        var (float): Variance of the sample, NaN for a single row
+        n (int): Size of the sample
+        population (int): Size of the sampled population
+
+    Returns:
+        float: Half-width of the interval, 0 when the sample is the whole population,
+               inf when it is unknown
+    """
+    if n >= population:
+        return 0.0
+    if n < 2 or math.isnan(var) or math.isnan(mean):
+        return math.inf
+    return Z_95 * math.sqrt((1 - n / population) * var / n)
+
+
+def bounds(estimate, half_width):
+    """
+    Build a confidence interval.
+
+    Args:
+        estimate (float): The estimate
+        half_width (float): Half-width of the interval
+
+    Returns:
+        list: Low and high bounds, None for an unknown interval
+    """
+    if math.isinf(half_width) or math.isnan(estimate):
+        return None
+    return [estimate - half_width, estimate + half_width]
+
+
+class StratifiedSample: # pylint: disable=too-many-instance-attributes
+    """
+    Random rows of every (question, state) stratum of a dataset, and the estimates
+    of the statistics computed from them.
+
+    The sample size of every stratum can be set with APPROX_SAMPLE_SIZE.
+    """
+    def __init__(self, df, best_is_max, size=None, seed=0):
+        self.df = df
+        self.best_is_max = best_is_max
+        self.size = size or int(os.environ.get('APPROX_SAMPLE_SIZE', 1024))
+        self.seed = seed
+        self.sample = None
+        self.partitions = None
+        self.populations = None
+        self.lock = Lock()
+
+    @property
+    def levels(self):
+        """
+        Sample sizes per stratum tried by a request, in increasing order.
+        """
+        levels = []
+        level = FIRST_LEVEL
+        while level < self.size:
+            levels.append(level)
+            level *= LEVEL_GROWTH
+        return levels + [self.size]
+
+    def prepare(self):
+        """
+        Draw the sample and count the rows of every stratum, once.
+        """
+        if self.sample is not None:
+            return
+        with self.lock:
+            if self.sample is not None:
+                return
+            columns = ['Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1',
+                       'Data_Value']
+            valid = self.df.loc[self.df['Data_Value'].notna(), columns]
+            shuffled = valid.sample(frac=1.0, random_state=self.seed)
+            shuffled['rank'] = shuffled.groupby(['Question', 'LocationDesc'],
+                                                sort=False).cumcount()
+            sample = shuffled[shuffled['rank'] < self.size] \
+                .sort_values(['Question', 'rank'], kind='stable').reset_index(drop=True)
+
+            self.populations = valid.groupby(columns[:4], dropna=False).size()
+            self.partitions = sample.groupby('Question', sort=False).indices
+            self.sample = sample
+
+    def level_rows(self, question, level, state=None):
+        """
+        Get the rows of a level of the sample.
+
+        Args:
+            question (str): The question
+            level (int): Number of rows kept per state
+            state (str): Only the rows of this state, None for all states
+
+        Returns:
+            pandas.DataFrame: The rows
+
+        Raises:
+            ValueError: If the question or the state is not found in the dataset
+        """
+        if question not in self.partitions:
+            raise ValueError(f"Question '{question}' not found in the dataset.")
+        positions = self.partitions[question]
+        ranks = self.sample['rank'].to_numpy()[positions]
+        rows = self.sample.iloc[positions[:np.searchsorted(ranks, level)]]
+        if state is not None:
+            rows = rows[rows['LocationDesc'] == state]
+            if rows.empty:
+                raise ValueError(f"State '{state}' not found in the dataset.")
+        return rows
+
+    def group_estimates(self, question, rows, keys):
+        """
+        Estimate the mean of every group of rows.
+
+        Args:
+            question (str): The question of the rows
+            rows (pandas.DataFrame): Rows of a level of the sample
+            keys (list): Columns identifying a group, LocationDesc first
+
+        Returns:
+            dict: Estimate, half-width and population of every group, by key tuple
+        """
+        stats = rows.groupby(keys, sort=False)['Data_Value'].agg(['count', 'mean', 'var'])
+        populations = self.populations.loc[question].groupby(level=list(range(len(keys)))) \
+            .sum()
+        estimates = {}
+        for key, (n, mean, var) in zip(stats.index, stats.itertuples(index=False)):
+            population = int(populations.loc[key])
+            estimates[key if isinstance(key, tuple) else (key,)] = \
+                (mean, interval(mean, var, n, population), population)
+        return estimates
+
+    def states(self, question, level, state=None):
+        """
+        Estimate the mean of every state for a question.
+
+        Returns:
+            dict: Estimate and half-width of every state
+        """
+        estimates = self.group_estimates(question, self.level_rows(question, level, state),
+                                         ['LocationDesc'])
+        return {key[0]: (mean, half) for key, (mean, half, _) in estimates.items()}
+
+    def overall(self, question, level):
+        """
+        Estimate the mean of a question across all states, weighted by their rows.
+
+        Returns:
+            tuple: Estimate and half-width
+        """
+        estimates = self.group_estimates(question, self.level_rows(question, level),
+                                         ['LocationDesc'])
+        total = sum(population for _, _, population in estimates.values())
+        mean = sum(population * value for value, _, population in estimates.values()) / total
+        variance = sum((population / total * half / Z_95) ** 2
+                       for _, half, population in estimates.values())
+        return mean, Z_95 * math.sqrt(variance)
+
+    def compute(self, endpoint, args, level):
+        """
+        Estimate a statistic on one level of the sample.
+
+        Args:
+            endpoint (str): Name of the statistic, one of APPROXIMABLE
+            args (list): Arguments of the statistic
+            level (int): Number of rows kept per state
+
+        Returns:
+            tuple: Estimates and intervals, both with the shape of the exact result,
+                   and the largest half-width
+        """
+        question = args[0]
+        if endpoint in ('mean_by_category', 'state_mean_by_category'):
+            state = args[1] if endpoint == 'state_mean_by_category' else None
+            estimates = self.group_estimates(
+                question, self.level_rows(question, level, state),
+                ['LocationDesc', 'StratificationCategory1', 'Stratification1'])
+            pairs = {str(key if state is None else key[1:]): (mean, half)
+                     for key, (mean, half, _) in sorted(estimates.items())}
+        elif endpoint == 'global_mean':
+            pairs = {'global_mean': self.overall(question, level)}
+        elif endpoint in ('diff_from_mean', 'state_diff_from_mean'):
+            state = args[1] if endpoint == 'state_diff_from_mean' else None
+            overall, overall_half = self.overall(question, level)
+            pairs = {name: (overall - mean, math.hypot(overall_half, half))
+                     for name, (mean, half) in self.states(question, level, state).items()}
+        else:
+            pairs = self.states(question, level, args[1] if endpoint == 'state_mean' else None)
+            if endpoint in ('states_mean', 'best5', 'worst5'):
+                descending = (endpoint == 'best5') == (question in self.best_is_max)
+                pairs = dict(sorted(pairs.items(), key=lambda item: item[1][0],
+                                    reverse=endpoint != 'states_mean' and descending))
+                if endpoint != 'states_mean':
+                    pairs = dict(list(pairs.items())[:5])
+
+        estimates = {key: mean for key, (mean, _) in pairs.items()}
+        intervals = {key: bounds(mean, half) for key, (mean, half) in pairs.items()}
+        worst = max((half for _, half in pairs.values()), default=0.0)
+        if endpoint == 'state_mean_by_category':
+            estimates, intervals = {args[1]: estimates}, {args[1]: intervals}
+        return estimates, intervals, worst
+
+    def estimate(self, endpoint, args, approx, exact):
+        """
+        Answer a statistic from the sample, within a target error or a time budget.
+
+        Args:
+            endpoint (str): Name of the statistic, one of APPROXIMABLE
+            args (list): Arguments of the statistic
+            approx: The approx parameter of the request, see parse_approx
+            exact (callable): Computes the exact answer, when the target error is missed
+
+        Returns:
+            dict: The estimates ('result'), their 95% intervals ('ci'), the sample size
+                  per state used, and whether the answer is approximate
+
+        Raises:
+            ValueError: If the approx parameter, the question or the state is invalid
+        """
+        target = parse_approx(approx)
+        started = time.monotonic()
+        self.prepare()
+
+        levels = self.levels
+        if target['error'] is None and target['time_ms'] is None:
+            levels = levels[-1:]
+        for index, level in enumerate(levels):
+            level_started = time.monotonic()
+            estimates, intervals, worst = self.compute(endpoint, args, level)
+            if target['error'] is not None and worst <= target['error']:
+                break
+            if target['time_ms'] is not None and index + 1 < len(levels):
+                # The next level reads up to LEVEL_GROWTH times more rows
+                elapsed = time.monotonic() - started
+                if elapsed + LEVEL_GROWTH * (time.monotonic() - level_started) > \
+                        target['time_ms'] / 1000:
+                    break
+        else:
+            if target['error'] is not None and worst > target['error']:
+                return {'approximate': False, 'confidence': 0.95, 'sample_size': None,
+                        'result': exact(), 'ci': None}
+
+        return {'approximate': True, 'confidence': 0.95, 'sample_size': level,
+                'result': estimates, 'ci': intervals}
@@ -0,0 +1,180 @@
+"""
+This module implements the job table and result store shared by the processes
+of a multi-process server. It is backed by a local SQLite database in WAL mode,
+so any process can answer for a job submitted to another one, without any
+external service.
+"""
+from threading import local
+import sqlite3
+
+
+class SqliteDatabase: # pylint: disable=too-few-public-methods
+    """
+    SQLite database in WAL mode shared by several processes.
+
+    Every thread gets its own connection, as SQLite connections can not be shared
+    between threads or across a fork.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.local = local()
+        # WAL lets readers of every process run concurrently with the writer
+        self._connection().execute('PRAGMA journal_mode=WAL')
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        """
+        Close the connection of the calling thread.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class SqliteJobStore(SqliteDatabase):
+    """
+    Job states and results shared between processes through SQLite.
+
+    Every process mirrors the jobs it owns into the 'jobs' table: a row is inserted
+    when the job is submitted and updated when it completes. The store also acts as
+    the result store of the thread pool, keeping the serialized payload of every
+    done job.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self._connection().execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                   'job_id INTEGER PRIMARY KEY, status TEXT NOT NULL, '
+                                   'endpoint TEXT, reason TEXT, submitted_at REAL, '
+                                   'payload TEXT)')
+
+    def add(self, job_info):
+        """
+        Publish a newly submitted job.
+
+        Args:
+            job_info (dict): The job, as kept by the thread pool
+        """
+        self._connection().execute(
+            'INSERT OR REPLACE INTO jobs (job_id, status, endpoint, submitted_at) '
+            'VALUES (?, ?, ?, ?)',
+            (job_info['job_id'], job_info['status'], job_info.get('endpoint'),
+             job_info.get('submitted_at')))
+
+    def finish(self, job_info):
+        """
+        Publish the final state of a job.
+
+        Args:
+            job_info (dict): The job that completed or was cancelled
+        """
+        self._connection().execute('UPDATE jobs SET status = ?, reason = ? WHERE job_id = ?',
+                                   (job_info['status'], job_info.get('reason'),
+                                    job_info['job_id']))
+
+    def lookup(self, job_id):
+        """
+        Look up a job owned by any process.
+
+        Args:
+            job_id (int): The job ID
+
+        Returns:
+            dict: The job ID, status, endpoint and failure reason, or None if unknown
+        """
+        row = self._connection().execute(
+            'SELECT status, endpoint, reason, submitted_at FROM jobs WHERE job_id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job_info = {'job_id': job_id, 'status': row[0], 'endpoint': row[1],
+                    'submitted_at': row[3]}
+        if row[2] is not None:
+            job_info['reason'] = row[2]
+        return job_info
+
+    def remaining(self):
+        """
+        Count the jobs of every process that are not finished yet.
+
+        Returns:
+            int: Number of queued or running jobs
+        """
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+
+    def last_job_id(self, index, count):
+        """
+        Find the biggest job ID allocated so far by a process of the server.
+
+        Args:
+            index (int): Index of the process, from 0 to count - 1
+            count (int): Number of processes
+
+        Returns:
+            int: The biggest job ID of the process, or None if it has no job
+        """
+        return self._connection().execute(
+            'SELECT MAX(job_id) FROM jobs WHERE job_id % ? = ?',
+            (count, (index + 1) % count)).fetchone()[0]
+
+    def fail_running(self, index, count, reason):
+        """
+        Mark as failed the jobs left unfinished by a process that died.
+
+        Args:
+            index (int): Index of the process, from 0 to count - 1
+            count (int): Number of processes
+            reason (str): Reason reported for the failed jobs
+
+        Returns:
+            int: Number of jobs marked as failed
+        """
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'error', reason = ? "
+            "WHERE status = 'running' AND job_id % ? = ?",
+            (reason, count, (index + 1) % count))
+        return cursor.rowcount
+
+    def put(self, job_id, payload):
+        """
+        Save the result of a job.
+
+        Args:
+            job_id (int): ID of the job
+            payload (str): The result, serialized as JSON
+        """
+        self._connection().execute('UPDATE jobs SET payload = ? WHERE job_id = ?',
+                                   (payload, job_id))
+
+    def get(self, job_id):
+        """
+        Load the result of a job.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            str: The result serialized as JSON, or None if there is no result
+        """
+        row = self._connection().execute('SELECT payload FROM jobs WHERE job_id = ?',
+                                         (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def stats(self):
+        """
+        Get the occupancy of the store.
+
+        Returns:
+            dict: Name of the backend, its path and the number of jobs per status
+        """
+        rows = self._connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+        return {'backend': 'sqlite', 'path': self.path, 'jobs': dict(rows.fetchall())}
@@ -1,21 +1,57 @@
 """
 This module implements a thread pool system for handling asynchronous tasks.
-It provides classes to manage a pool of worker threads and execute submitted jobs.
+It provides classes to manage a pool of worker threads and execute submitted jobs,
+and a supervisor thread that keeps the pool at full capacity.
 """
-from queue import Queue, Empty
-from threading import Thread, Event, Lock
+from queue import Empty
+from threading import Thread, Event, Lock, current_thread
 import os
 import json
+import logging
+import time
+from app.metrics import Metrics
+from app.result_store import create_result_store
+from app.events import MAX_SUBSCRIBERS, EventBus, job_event
+from app.job_registry import JobRegistry
+from app.broker import create_broker, ResultCollector
+from app.fair_share import MAX_CLIENTS, FairQueue, parse_weights
+from app.tracing import Trace, TraceBuffer, activate, create_trace_exporter
+from app.warmup import Payload
 
-class ThreadPool:
+logger = logging.getLogger(__name__)
+
+# Fair queuing cost (in seconds) of a job whose endpoint has no measured compute time yet
+DEFAULT_JOB_COST = 0.01
+
+# Spans of a job trace delimited by two of its timestamps, and the thread they are shown on
+TRACE_PHASES = (
+    ('queue_wait', 'enqueued', 'started', 'queue'),
+    ('compute', 'started', 'computed', None),
+    ('serialize', 'computed', 'serialized', None),
+    ('write', 'serialized', 'finished', None),
+)
+
+class ThreadPool: # pylint: disable=too-many-instance-attributes
     """
     Manages a pool of worker threads to execute tasks asynchronously.
-    
+
     This class creates and maintains a fixed number of threads that pull tasks
     from a shared queue. The number of threads is determined by either an environment
     variable (TP_NUM_OF_THREADS) or by the system's CPU count.
+    Finished results are saved in a result store, selected with the RESULT_STORE
+    environment variable unless one is given. When the pool is part of a multi-process
+    server, shared_jobs mirrors the state of its jobs for the other processes.
+    When a job broker is configured (see app/broker.py), the statistic jobs on the
+    default dataset are executed by standalone worker processes; the pool threads
+    run the others, never the request threads.
+    The queue is shared fairly between the clients that submit jobs; the weight of
+    every client can be set with CLIENT_WEIGHTS, e.g. 'key:3f2a...=2,10.0.0.7=0.5'
+    (weights must be positive), and MAX_CLIENTS bounds the clients it tracks (see
+    app/fair_share.py).
+    The traces of the latest TRACE_BUFFER_SIZE jobs are kept for debugging, and
+    appended to the TRACE_FILE file if it is set (see app/tracing.py).
     """
-    def __init__(self):
+    def __init__(self, result_store=None, broker=None):
         if 'TP_NUM_OF_THREADS' in os.environ:
             self.num_threads = int(os.environ['TP_NUM_OF_THREADS'])
 
@@ -23,85 +59,438 @@ class ThreadPool:
             self.num_threads = os.cpu_count()
 
         self.threads = []
-        self.queue = Queue()
-        self.jobs = {}
-        self.remaining_jobs = 0
-        self.remaining_jobs_lock = Lock()
+        self.queue = FairQueue(parse_weights(os.environ.get('CLIENT_WEIGHTS', '')),
+                               int(os.environ.get('MAX_CLIENTS', MAX_CLIENTS)))
+        self.jobs = JobRegistry()
         self.graceful_shutdown = Event()
+        self.supervisor = Supervisor(self)
+        self.metrics = Metrics()
+        self.result_store = result_store or create_result_store()
+        self.events = EventBus(
+            max_subscribers=int(os.environ.get('SSE_MAX_SUBSCRIBERS', MAX_SUBSCRIBERS)))
+        self.shared_jobs = None
+        self.broker = broker or create_broker()
+        self.collector = ResultCollector(self)
+        self.traces = TraceBuffer(int(os.environ.get('TRACE_BUFFER_SIZE', 1000)))
+        self.trace_exporter = create_trace_exporter()
+
+    @property
+    def remaining_jobs(self):
+        """
+        Number of jobs that are queued or running.
+        """
+        counts = self.jobs.counts()
+        return counts['queued'] + counts['running']
 
     # Add a job to the queue
-    def add_job(self, job_id, task):
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def add_job(self, job_id, task, endpoint=None, args=None, client=None, received=None):
+        """
+        Add a job to the thread pool's task queue, or to the broker.
+
+        Args:
+            job_id (int): Unique identifier for the job
+            task (callable): The function to execute
+            endpoint (str): Name of the endpoint that created the job
+            args (list): Arguments of the DataIngestor method of the endpoint,
+                         needed by the remote workers
+            client (str): Identifier of the client that submitted the job
+            received (float): time.monotonic() at the receipt of the HTTP request
+        """
+        job_info = self.register(new_job(job_id, task, endpoint, client), received)
+
+        # Remote workers only know the statistics of the default dataset, the other
+        # jobs (other datasets, warmed-up results, malformed ones) run in the pool
+        if self.broker is None or args is None:
+            # Expensive jobs use up more of the fair share of their client
+            cost = self.metrics.mean_duration(endpoint, 'compute') or DEFAULT_JOB_COST
+            self.enqueued(job_info, queue='fair_share', cost=cost)
+            self.queue.put(job_info, cost)
+        else:
+            self.enqueued(job_info, queue='broker')
+            self.broker.submit(job_id, endpoint, args)
+            self.collector.wake.set()
+
+    def register(self, job_info, received=None):
         """
-        Add a job to the thread pool's task queue.
-        
+        Make a new job known to the pool, and start its trace.
+
+        Args:
+            job_info (dict): The job, as created by new_job
+            received (float): time.monotonic() at the receipt of the HTTP request
+
+        Returns:
+            dict: The job info
+        """
+        trace = job_info['trace']
+        if received is not None:
+            trace.add('http.receive', received, job_info['timestamps']['submitted'],
+                      client=job_info.get('client'))
+        self.traces.add(trace)
+
+        self.jobs.add(job_info)
+        if self.shared_jobs is not None:
+            self.shared_jobs.add(job_info)
+        return job_info
+
+    @staticmethod
+    def enqueued(job_info, **args):
+        """
+        Close the enqueue span of a job, right before it is handed to a queue.
+
+        The job may complete as soon as it is queued, so the span is recorded first.
+
+        Args:
+            job_info (dict): The job about to be queued
+            **args: Details shown with the span
+        """
+        timestamps = job_info['timestamps']
+        timestamps['enqueued'] = time.monotonic()
+        job_info['trace'].add('enqueue', timestamps['submitted'], timestamps['enqueued'], **args)
+
+    # Run a job on the calling thread
+    def run_inline(self, job_id, task, endpoint=None, received=None):
+        """
+        Execute a job right away on the calling thread, bypassing the queue.
+
+        The job is registered like a queued one, so it can still be looked up by ID.
+
         Args:
             job_id (int): Unique identifier for the job
             task (callable): The function to execute
+            endpoint (str): Name of the endpoint that created the job
+            received (float): time.monotonic() at the receipt of the HTTP request
+
+        Returns:
+            dict: The job info, already completed
+        """
+        job_info = self.register(new_job(job_id, task, endpoint), received)
+        self.execute(job_info)
+        return job_info
+
+    def execute(self, job_info):
+        """
+        Execute a single job on the calling thread and record its outcome.
+
+        On success the result is saved in the result store and the job is marked as 'done'.
+        On failure the job is marked as 'error' and the reason is kept in the job info.
+        The monotonic timestamp of every phase is kept in job_info['timestamps'] and
+        aggregated into the pool metrics. The DataIngestor records the spans of its
+        sub-steps in the trace of the job while the task runs.
+
+        Args:
+            job_info (dict): The job to execute, as created by add_job
+        """
+        job_id = job_info['job_id']
+        timestamps = job_info['timestamps']
+        if not self.jobs.start(job_info):
+            return
+        timestamps['started'] = time.monotonic()
+
+        payload = None
+        status = 'error'
+        try:
+            # Execute the task
+            with activate(job_info['trace']):
+                result = job_info['task']()
+            timestamps['computed'] = time.monotonic()
+
+            # Warmed-up results are already serialized, see app/warmup.py
+            payload = result if isinstance(result, Payload) else json.dumps(result)
+            timestamps['serialized'] = time.monotonic()
+
+            # Save the result in the result store
+            self.result_store.put(job_id, payload)
+
+            status = 'done'
+        # A bad input must not take the worker down with it
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.error("Job %s (%s) failed: %r", job_id, job_info.get('endpoint'), e)
+            job_info['reason'] = str(e)
+            self.supervisor.record_failure(job_info.get('endpoint'))
+        finally:
+            timestamps['finished'] = time.monotonic()
+            self.finish_job(job_info, status, payload)
+
+    def start_remote(self, job_id):
+        """
+        Mark a job leased by a remote worker as running, once.
+
+        The job is seen running when the collector polls the broker, so its start
+        time is the poll that found it leased.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            bool: False if the job is unknown or was cancelled
+        """
+        job_info = self.jobs.get(job_id)
+        if job_info is None:
+            return False
+        if job_info.get('started'):
+            return True
+        if not self.jobs.start(job_info):
+            return False
+        job_info['timestamps']['started'] = time.monotonic()
+        return True
+
+    def complete_remote(self, job_id, status, payload=None, reason=None):
+        """
+        Record the outcome of a job executed by a remote worker.
+
+        Args:
+            job_id (int): ID of the job
+            status (str): 'done' or 'error'
+            payload (str): The result serialized as JSON, if done
+            reason (str): Why the job failed, if error
+        """
+        if not self.start_remote(job_id):
+            return
+        job_info = self.jobs[job_id]
+        timestamps = job_info['timestamps']
+        timestamps['finished'] = time.monotonic()
+        job_info['trace'].add('remote', timestamps['started'], timestamps['finished'],
+                              status=status)
+
+        if status == 'done':
+            self.result_store.put(job_id, payload)
+        else:
+            job_info['reason'] = reason
+            self.supervisor.record_failure(job_info.get('endpoint'))
+        self.finish_job(job_info, status, payload)
+
+    def finish_job(self, job_info, status, payload):
+        """
+        Publish the final state of a started job.
+
+        Args:
+            job_info (dict): The job that completed
+            status (str): 'done' or 'error'
+            payload (str): The result serialized as JSON, None if the job failed
         """
-        job_info = {
-            'job_id': job_id,
-            'status': 'running',
-            'task' : task
-        }
+        self.metrics.record_job(job_info.get('endpoint'), status, job_info['timestamps'])
+        self.close_trace(job_info, runner=current_thread().name)
 
-        self.jobs[job_id] = job_info
-        self.queue.put(job_info)
+        # Mark the job as done or failed, which updates the remaining jobs count
+        self.jobs.finish(job_info, status)
+        if self.shared_jobs is not None:
+            self.shared_jobs.finish(job_info)
+
+        # Wake up the clients waiting for this job
+        job_info['completed'].set()
+        self.events.publish(job_event(job_info, payload))
+
+    # Cancel a job that was not picked up yet
+    def cancel_job(self, job_id):
+        """
+        Cancel a job that is still waiting in the queue.
+
+        The job stays in the queue, but the worker that dequeues it skips it.
+
+        Args:
+            job_id (int): ID of the job to cancel
+
+        Returns:
+            bool: True if the job was cancelled, False if it already started
+        """
+        job_info = self.jobs[job_id]
+        # A job leased by a remote worker can not be taken back
+        if self.broker is not None and not self.broker.cancel(job_id):
+            return False
+        if not self.jobs.cancel(job_info):
+            return False
+        if self.shared_jobs is not None:
+            self.shared_jobs.finish(job_info)
+        self.close_trace(job_info)
+
+        job_info['completed'].set()
+        self.events.publish(job_event(job_info))
+        return True
+
+    def close_trace(self, job_info, **args):
+        """
+        Record the phases of a completed job in its trace, and export it.
+
+        The trace stays in the ring buffer, the job info lets go of it.
+
+        Args:
+            job_info (dict): The job that completed
+            **args: Details shown with the queue wait span
+        """
+        trace = job_info.pop('trace', None)
+        if trace is None:
+            return
+        timestamps = job_info['timestamps']
+        for name, start, end, thread in TRACE_PHASES:
+            if start in timestamps and end in timestamps:
+                trace.add(name, timestamps[start], timestamps[end], thread,
+                          **(args if name == 'queue_wait' else {}))
+        if self.trace_exporter is not None:
+            self.trace_exporter.export(trace)
 
     # Start the thread pool
     def start(self):
         """
         Start all the worker threads in the thread pool.
-        
-        Creates and starts the specified number of TaskRunner threads.
+
+        Creates and starts the specified number of TaskRunner threads, then starts
+        the supervisor that respawns any worker that dies. With a broker, the
+        thread collecting the results of the remote workers is started too.
         """
+        if self.broker is not None:
+            self.broker.purge()
+            self.collector.start()
         for i in range(self.num_threads):
             thread = TaskRunner(i, self)
             self.threads.append(thread)
             thread.start()
 
+        self.supervisor.start()
+
+
+def new_job(job_id, task, endpoint, client=None):
+    """
+    Create the info kept by the thread pool about a job.
+
+    Args:
+        job_id (int): Unique identifier for the job
+        task (callable): The function to execute
+        endpoint (str): Name of the endpoint that created the job
+        client (str): Identifier of the client that submitted the job
+
+    Returns:
+        dict: The job info, in the 'running' state
+    """
+    return {
+        'job_id': job_id,
+        'status': 'running',
+        'endpoint': endpoint,
+        'client': client,
+        'task' : task,
+        'submitted_at': time.time(),
+        'timestamps': {'submitted': time.monotonic()},
+        'trace': Trace(job_id, endpoint),
+        'completed': Event()
+    }
+
+
+class Supervisor(Thread):
+    """
+    Watchdog thread that keeps the worker pool at full capacity.
+
+    Periodically checks every TaskRunner, and the collector of the remote results
+    when a broker is used, and replaces the ones that are no longer alive. It also
+    keeps a per-endpoint count of failed jobs, reported by the workers.
+    The check interval can be set with the TP_SUPERVISOR_INTERVAL environment variable.
+    """
+    def __init__(self, threadpool):
+        Thread.__init__(self, daemon = True)
+        self.threadpool = threadpool
+        self.interval = float(os.environ.get('TP_SUPERVISOR_INTERVAL', 1.0))
+        self.failures = {}
+        self.respawns = 0
+        self.lock = Lock()
+
+    def record_failure(self, endpoint):
+        """
+        Count a failed job for the given endpoint.
+
+        Args:
+            endpoint (str): Name of the endpoint whose job failed
+        """
+        with self.lock:
+            self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+    def check_workers(self):
+        """
+        Replace every dead worker thread with a fresh TaskRunner, and a dead
+        collector with a fresh ResultCollector.
+
+        Returns:
+            int: Number of threads that were respawned
+        """
+        respawned = 0
+        collector = self.threadpool.collector
+        # A collector that was never started belongs to a pool without a broker
+        if collector.ident is not None and not collector.is_alive():
+            logger.error("Result collector died, respawning it")
+            self.threadpool.collector = ResultCollector(self.threadpool)
+            self.threadpool.collector.start()
+            respawned += 1
+
+        for i, thread in enumerate(self.threadpool.threads):
+            if thread.is_alive():
+                continue
+
+            logger.error("Worker %s died, respawning it", thread.id)
+            replacement = TaskRunner(thread.id, self.threadpool)
+            self.threadpool.threads[i] = replacement
+            replacement.start()
+            respawned += 1
+
+        with self.lock:
+            self.respawns += respawned
+        return respawned
+
+    def status(self):
+        """
+        Get a snapshot of the pool health.
+
+        Returns:
+            dict: Number of alive workers, respawns so far, failures per endpoint
+                  and the registered remote workers, if any
+        """
+        with self.lock:
+            status = {
+                'num_threads': self.threadpool.num_threads,
+                'alive_threads': sum(t.is_alive() for t in self.threadpool.threads),
+                'respawns': self.respawns,
+                'failures': dict(self.failures)
+            }
+        if self.threadpool.broker is not None:
+            status['remote_workers'] = self.threadpool.broker.workers()
+        return status
+
+    def run(self):
+        """
+        Main execution method for the supervisor.
+
+        Checks the workers every interval until graceful shutdown is requested.
+        """
+        while not self.threadpool.graceful_shutdown.wait(self.interval):
+            self.check_workers()
+
 
 class TaskRunner(Thread):
     """
     Worker thread that executes tasks from the thread pool's queue.
-    
+
     Inherits from Thread and continuously pulls jobs from the queue,
-    executes them, and saves their results to disk.
+    executes them, and saves their results in the result store. A job that raises is
+    marked as 'error' and the worker moves on to the next one.
     """
     def __init__(self, tid, threadpool):
-        Thread.__init__(self, daemon = True)
+        Thread.__init__(self, name = f'TaskRunner-{tid}', daemon = True)
         self.id = tid
         self.threadpool = threadpool
 
     def run(self):
         """
         Main execution method for the thread.
-        
-        Continuously pulls jobs from the queue, executes them, and saves results to disk.
+
+        Continuously pulls jobs from the queue, executes them, and saves their results.
         """
         while not self.threadpool.graceful_shutdown.is_set():
             # Get pending job
-            # Execute the job and save the result to disk
+            # Execute the job and save the result
             # Repeat until graceful_shutdown
             try:
                 # Get job from queue
                 job_info = self.threadpool.queue.get(timeout = 1.0)
-                job_id = job_info['job_id']
-                task = job_info['task']
-                # Execute the task
-                result = task()
-
-                # Save the result to disk
-                with open(f'results/{job_id}', 'w', encoding='utf-8') as f:
-                    json.dump(result, f)
-
-                # Mark the job as done
-                job_info['status'] = 'done'
-                self.threadpool.queue.task_done()
-
-                # Update the remaining jobs count
-                with self.threadpool.remaining_jobs_lock:
-                    self.threadpool.remaining_jobs -= 1
-
             except Empty:
                 # No jobs in the queue
                 continue
+
+            self.threadpool.execute(job_info)
+            self.threadpool.queue.task_done()
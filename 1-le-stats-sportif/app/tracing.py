@@ -0,0 +1,386 @@
+"""
+This module implements the per-job traces used to debug individual slow jobs.
+Every job carries a trace made of timed spans: the receipt of its HTTP request,
+its enqueue, its wait in the queue until a TaskRunner picks it up, every sub-step
+of the DataIngestor method and the serialization and persistence of its result.
+The traces of the latest jobs are kept in a ring buffer, and can be written to a
+file in the Trace Event Format read by chrome://tracing and Perfetto.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Empty, Queue
+from threading import Condition, Lock, Thread, current_thread, local
+import atexit
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Trace of the job being computed by the current thread, see activate()
+_active = local()
+
+# Threads numbered at most in a trace file, the least recently seen number is reused
+MAX_THREAD_IDS = 256
+
+# Seconds the process exit waits for the pending traces to be written
+FLUSH_TIMEOUT = 5.0
+
+
+class Span:
+    """
+    Context manager timing a block of code into a span of a trace.
+
+    A block left by an exception is still recorded, with the exception type.
+    """
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.add(self.name, self.start, time.monotonic(), **self.args)
+        return False
+
+
+class NoSpan:
+    """
+    Span of the code running outside of a traced job, records nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class ThreadIds: # pylint: disable=too-few-public-methods
+    """
+    Numbers the threads of the traces written to the same file.
+
+    Request threads come and go, so at most 'capacity' threads are numbered: a new
+    thread takes over the number of the least recently seen one, and is labelled
+    again under it.
+    """
+    def __init__(self, capacity=MAX_THREAD_IDS):
+        self.capacity = capacity
+        self.ids = OrderedDict()
+
+    def lookup(self, thread):
+        """
+        Get the number of a thread.
+
+        Args:
+            thread (str): Name of the thread
+
+        Returns:
+            tuple: Number of the thread, and whether it must be labelled
+        """
+        tid = self.ids.get(thread)
+        if tid is not None:
+            self.ids.move_to_end(thread)
+            return tid, False
+        if len(self.ids) >= self.capacity:
+            _, tid = self.ids.popitem(last=False)
+        else:
+            tid = len(self.ids) + 1
+        self.ids[thread] = tid
+        return tid, True
+
+
+class Trace:
+    """
+    The spans of one job.
+
+    Every span holds its name, its monotonic start and end times, the name of the
+    thread that ran it and free-form arguments. Spans are appended by the request
+    thread, then by the worker thread, never by both at once.
+    """
+    def __init__(self, job_id, endpoint=None):
+        self.job_id = job_id
+        self.endpoint = endpoint
+        self.spans = []
+
+    def add(self, name, start, end, thread=None, **args):
+        """
+        Record a span that already ended.
+
+        Args:
+            name (str): Name of the span
+            start (float): time.monotonic() at the start of the span
+            end (float): time.monotonic() at the end of the span
+            thread (str): Name of the thread shown with the span, the current one by default
+            **args: Details shown with the span
+        """
+        self.spans.append((name, start, end, thread or current_thread().name, args))
+
+    def span(self, name, **args):
+        """
+        Time a block of code.
+
+        Args:
+            name (str): Name of the span
+            **args: Details shown with the span
+
+        Returns:
+            Span: Context manager recording the span when the block ends
+        """
+        return Span(self, name, args)
+
+    def to_dict(self):
+        """
+        Describe the trace for the API.
+
+        Returns:
+            dict: Job ID, endpoint, total duration and the spans in start order, with
+                  their start relative to the first span, in milliseconds
+        """
+        spans = sorted(self.spans, key=lambda span: span[1])
+        origin = spans[0][1] if spans else 0.0
+        return {
+            'job_id': self.job_id,
+            'endpoint': self.endpoint,
+            'duration_ms': round(1000 * (max(span[2] for span in spans) - origin), 3)
+                           if spans else 0.0,
+            'spans': [{'name': name, 'thread': thread,
+                       'start_ms': round(1000 * (start - origin), 3),
+                       'duration_ms': round(1000 * (end - start), 3), 'args': args}
+                      for name, start, end, thread, args in spans],
+        }
+
+    def to_events(self, pid=None, threads=None):
+        """
+        Convert the trace to the Trace Event Format.
+
+        Every span is a complete ('X') event on the thread that ran it. The threads
+        are numbered by name, and a 'thread_name' metadata event labels every thread
+        the first time it is numbered.
+
+        Args:
+            pid (int): Process of the events, the current one by default
+            threads (ThreadIds): Numbers of the threads already labelled, updated;
+                                 shared by the traces written to the same file, so a
+                                 thread keeps its number and label across them
+
+        Returns:
+            list: The events, timestamps in microseconds
+        """
+        pid = os.getpid() if pid is None else pid
+        threads = ThreadIds() if threads is None else threads
+        events = []
+        for name, start, end, thread, args in list(self.spans):
+            tid, new = threads.lookup(thread)
+            if new:
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                               'tid': tid, 'args': {'name': thread}})
+            events.append({'name': name, 'cat': self.endpoint or 'job', 'ph': 'X',
+                           'ts': round(start * 1e6, 3), 'dur': round((end - start) * 1e6, 3),
+                           'pid': pid, 'tid': tid, 'args': dict(args, job_id=self.job_id)})
+        return events
+
+
+@contextmanager
+def activate(trace):
+    """
+    Make a trace the target of span() on the current thread while a block runs.
+
+    Args:
+        trace (Trace): Trace of the job about to be computed
+    """
+    previous = getattr(_active, 'trace', None)
+    _active.trace = trace
+    try:
+        yield trace
+    finally:
+        _active.trace = previous
+
+
+def span(name, **args):
+    """
+    Time a block of code into the trace of the job computed by the current thread.
+
+    Cheap no-op when the thread is not computing a traced job, so the DataIngestor
+    can be used on its own.
+
+    Args:
+        name (str): Name of the span
+        **args: Details shown with the span
+
+    Returns:
+        Span or NoSpan: Context manager recording the span when the block ends
+    """
+    trace = getattr(_active, 'trace', None)
+    return NO_SPAN if trace is None else Span(trace, name, args)
+
+
+class TraceBuffer:
+    """
+    Ring buffer of the traces of the latest jobs.
+
+    A trace is added when its job is submitted, so running jobs can be inspected;
+    once more than 'capacity' traces are kept, the oldest ones are dropped.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.traces = OrderedDict()
+        self.lock = Lock()
+
+    def add(self, trace):
+        """
+        Keep the trace of a new job.
+
+        Args:
+            trace (Trace): The trace to keep
+        """
+        with self.lock:
+            self.traces[trace.job_id] = trace
+            while len(self.traces) > self.capacity:
+                self.traces.popitem(last=False)
+
+    def get(self, job_id):
+        """
+        Look up the trace of a job.
+
+        Args:
+            job_id (int): ID of the job
+
+        Returns:
+            Trace: The trace, or None if the job is unknown or its trace was dropped
+        """
+        with self.lock:
+            return self.traces.get(job_id)
+
+    def values(self):
+        """
+        List the kept traces, oldest first.
+
+        Returns:
+            list: The traces
+        """
+        with self.lock:
+            return list(self.traces.values())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.traces)
+
+
+class TraceExporter:
+    """
+    Appends the traces of the completed jobs to a file.
+
+    The file uses the JSON Array Format of the Trace Event Format, whose closing
+    bracket is optional: the file can be opened in a trace viewer at any time,
+    even while the server runs. Workers only queue their traces; a background
+    thread converts them and appends them to the file in batches, so exporting
+    does not add file I/O to the latency of the jobs. Threads keep the same number
+    in all the traces of the file, and are labelled once (see ThreadIds). A failed
+    write is logged and its traces dropped, the writer goes on with the next ones.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.threads = ThreadIds()
+        self.queue = Queue()
+        self.writer = None
+        self.pending = 0
+        self.done = Condition()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace):
+        """
+        Queue a trace to be appended to the file.
+
+        Args:
+            trace (Trace): Trace of a completed job
+        """
+        if self.writer is None:
+            self.start()
+        with self.done:
+            self.pending += 1
+        self.queue.put(trace)
+
+    def start(self):
+        """
+        Start the background writer, once per process.
+        """
+        with self.done:
+            if self.writer is not None:
+                return
+            self.writer = Thread(target=self.run, name='TraceExporter', daemon=True)
+            self.writer.start()
+        # Write the pending traces when the process exits
+        atexit.register(self.flush)
+
+    def run(self):
+        """
+        Body of the background writer: append every batch of queued traces.
+        """
+        while True:
+            traces = [self.queue.get()]
+            try:
+                while True:
+                    traces.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            try:
+                self.write(traces)
+            # A full disk must not stop the writer, the queue would grow forever
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.error("Writing %s traces to %s failed: %r", len(traces), self.path, e)
+            with self.done:
+                self.pending -= len(traces)
+                self.done.notify_all()
+
+    def write(self, traces):
+        """
+        Append the events of some traces to the file, with a single write.
+
+        Args:
+            traces (list): Traces of completed jobs
+        """
+        pid = os.getpid()
+        lines = ''.join(json.dumps(event) + ',\n' for trace in traces
+                        for event in trace.to_events(pid, self.threads))
+        with open(self.path, 'a', encoding='utf-8') as file:
+            if file.tell() == 0:
+                lines = '[\n' + lines
+            file.write(lines)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Wait until the queued traces are written.
+
+        Args:
+            timeout (float): Seconds to wait at most
+
+        Returns:
+            bool: False if traces were still pending after the timeout
+        """
+        with self.done:
+            return self.done.wait_for(lambda: self.pending == 0, timeout)
+
+
+def create_trace_exporter():
+    """
+    Create the trace exporter selected by the environment.
+
+    TRACE_FILE is the path of the file the traces are appended to.
+
+    Returns:
+        TraceExporter: The exporter, or None if TRACE_FILE is not set
+    """
+    path = os.environ.get('TRACE_FILE')
+    return TraceExporter(path) if path else None
@@ -0,0 +1,163 @@
+"""
+This module computes the trend of a question over the years, for every state.
+
+The rows of the question, optionally of a single stratification, are averaged
+per (state, YearStart) into a dense state x year matrix, NaN where a state has no
+value for a year. A least-squares line is then fitted to every row of the matrix
+at once, with sums over the years that have a value. The fits of a question are
+computed on first use and kept: a DataIngestor never changes its dataset, so they
+stay valid for its whole life.
+"""
+from threading import Lock
+import math
+import numpy as np
+from app.tracing import span
+
+
+def fit_slopes(years, means):
+    """
+    Fit a least-squares line to every row of a matrix of yearly means.
+
+    Args:
+        years (numpy.ndarray): The years, one per column
+        means (numpy.ndarray): Means as a state x year matrix, NaN if missing
+
+    Returns:
+        tuple: Slope (per year) and intercept of every row, NaN for a row with less
+               than 2 years, and the number of years of every row
+    """
+    present = ~np.isnan(means)
+    x = np.where(present, years.astype(float), 0.0)
+    y = np.where(present, means, 0.0)
+
+    count = present.sum(axis=1)
+    sum_x = x.sum(axis=1)
+    sum_y = y.sum(axis=1)
+    sum_xx = (x * x).sum(axis=1)
+    sum_xy = (x * y).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = count * sum_xx - sum_x * sum_x
+        slope = (count * sum_xy - sum_x * sum_y) / denominator
+        intercept = (sum_y - slope * sum_x) / count
+    slope[(count < 2) | (denominator == 0)] = np.nan
+    intercept[np.isnan(slope)] = np.nan
+    return slope, intercept, count
+
+
+def to_float(value):
+    """
+    Convert a float to a JSON friendly value.
+
+    Args:
+        value (float): The value
+
+    Returns:
+        float: The value, None for NaN
+    """
+    return None if math.isnan(value) else value
+
+
+class TrendEngine:
+    """
+    Fits the yearly trend of every state for the questions of a dataset.
+    """
+    def __init__(self, df, best_is_max):
+        self.df = df
+        self.best_is_max = best_is_max
+        self.results = {}
+        self.lock = Lock()
+
+    def fit(self, question, stratification=None):
+        """
+        Fit the trend of every state for a question, once.
+
+        Args:
+            question (str): The question
+            stratification (str): Only use the rows of this Stratification1
+
+        Returns:
+            dict: The years, and the yearly means and the fit of every state, from
+                  the most improving to the most worsening
+
+        Raises:
+            ValueError: If the question or the stratification is not found
+        """
+        key = (question, stratification)
+        if key in self.results:
+            return self.results[key]
+
+        with span('filter'):
+            rows = self.df[self.df['Question'] == question]
+            if rows.empty:
+                raise ValueError(f"Question '{question}' not found in the dataset.")
+            if stratification is not None:
+                rows = rows[rows['Stratification1'] == stratification]
+                if rows.empty:
+                    raise ValueError(f"Stratification '{stratification}' not found "
+                                     f"for this question.")
+        with span('pivot'):
+            means = rows.groupby(['LocationDesc', 'YearStart'])['Data_Value'].mean() \
+                .unstack('YearStart').sort_index(axis=1)
+        result = self.summarize(question, means)
+        with self.lock:
+            self.results[key] = result
+        return result
+
+    def summarize(self, question, means):
+        """
+        Fit the trend of every state from its yearly means.
+
+        Args:
+            question (str): The question of the means
+            means (pandas.DataFrame): Means as a state x year frame
+
+        Returns:
+            dict: The years, and the yearly means and the fit of every state, from
+                  the most improving to the most worsening
+        """
+        with span('fit'):
+            matrix = means.to_numpy(dtype=float)
+            slope, intercept, count = fit_slopes(means.columns.to_numpy(), matrix)
+
+        with span('to_dict'):
+            sign = 1 if question in self.best_is_max else -1
+            states = {}
+            for index, state in enumerate(means.index):
+                states[str(state)] = {
+                    'means': [to_float(value) for value in matrix[index].tolist()],
+                    'slope': to_float(float(slope[index])),
+                    'intercept': to_float(float(intercept[index])),
+                    'years': int(count[index]),
+                    'direction': None if math.isnan(slope[index]) else
+                                 'improving' if sign * slope[index] > 0 else
+                                 'worsening' if sign * slope[index] < 0 else 'stable',
+                }
+            # From the most improving to the most worsening, single years last
+            ordered = sorted(states.items(), key=lambda item: (
+                item[1]['slope'] is None, -sign * (item[1]['slope'] or 0.0)))
+        return {'years': [int(year) for year in means.columns], 'states': dict(ordered)}
+
+    def trend(self, question, state=None, stratification=None):
+        """
+        Get the yearly means and the trend of the states for a question.
+
+        Args:
+            question (str): The question
+            state (str): Only this state, None for all of them
+            stratification (str): Only use the rows of this Stratification1
+
+        Returns:
+            dict: The question, the years and the yearly means and fit of the states
+
+        Raises:
+            ValueError: If the question, the state or the stratification is not found
+        """
+        fitted = self.fit(question, stratification)
+        states = fitted['states']
+        if state is not None:
+            if state not in states:
+                raise ValueError(f"State '{state}' not found in the dataset.")
+            states = {state: states[state]}
+        return {'question': question, 'stratification': stratification,
+                'years': fitted['years'], 'states': states}
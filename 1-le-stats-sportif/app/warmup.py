@@ -0,0 +1,151 @@
+"""
+This module implements the optional warm-up of the server at startup.
+
+The questions are few and fixed, so the results of every question-level endpoint
+can be computed for all of them before the first request. They are kept already
+serialized, and the jobs asking for one of them are served from this cache
+instead of computing and encoding the result again. The warm-up runs in parallel
+on WARMUP_THREADS threads and its progress is reported by /api/ready.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Endpoints whose only parameter is the question
+WARMUP_ENDPOINTS = ('states_mean', 'global_mean', 'diff_from_mean', 'best5', 'worst5',
+                    'mean_by_category')
+
+
+class Payload(str):
+    """
+    A result already serialized as JSON, stored as is by the thread pool.
+    """
+
+
+class Materializer:
+    """
+    Computes and keeps the result of every question-level endpoint for every question.
+    """
+    def __init__(self, data_ingestor, threads=None):
+        self.data_ingestor = data_ingestor
+        self.threads = threads or int(os.environ.get('WARMUP_THREADS', os.cpu_count() or 1))
+        self.payloads = {}
+        self.failed = []
+        self.total = 0
+        self.duration = None
+        self.lock = Lock()
+
+    def tasks(self):
+        """
+        List the results to compute.
+
+        Returns:
+            list: (endpoint, question) pairs
+        """
+        questions = self.data_ingestor.questions_best_is_min + \
+            self.data_ingestor.questions_best_is_max
+        return [(endpoint, question) for question in questions for endpoint in WARMUP_ENDPOINTS]
+
+    def materialize(self, endpoint, question):
+        """
+        Compute and keep one result.
+
+        Args:
+            endpoint (str): Name of the statistic
+            question (str): The question
+        """
+        try:
+            payload = Payload(json.dumps(getattr(self.data_ingestor, endpoint)(question)))
+        # A question missing from the dataset only fails its own results
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.warning("Warm-up of %s for '%s' failed: %r", endpoint, question, e)
+            with self.lock:
+                self.failed.append({'endpoint': endpoint, 'question': question,
+                                    'reason': str(e)})
+            return
+        with self.lock:
+            self.payloads[(endpoint, question)] = payload
+
+    def run(self):
+        """
+        Compute all the results, in parallel, and wait for them.
+        """
+        tasks = self.tasks()
+        self.total = len(tasks)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.threads,
+                                thread_name_prefix='Warmup') as executor:
+            for endpoint, question in tasks:
+                executor.submit(self.materialize, endpoint, question)
+        self.duration = time.monotonic() - started
+        logger.info("Warm-up computed %s results in %.2fs, %s failed",
+                    len(self.payloads), self.duration, len(self.failed))
+
+    def start(self):
+        """
+        Run the warm-up in the background.
+        """
+        self.total = len(self.tasks())
+        Thread(target=self.run, name='Warmup', daemon=True).start()
+
+    @property
+    def ready(self):
+        """
+        Whether the warm-up is over.
+        """
+        return self.duration is not None
+
+    def get(self, endpoint, params):
+        """
+        Look up a warmed-up result.
+
+        Args:
+            endpoint (str): Name of the statistic
+            params (list): Arguments of the DataIngestor method
+
+        Returns:
+            Payload: The serialized result, or None if it was not computed
+        """
+        if len(params) != 1 or not isinstance(params[0], str):
+            return None
+        return self.payloads.get((endpoint, params[0]))
+
+    def status(self):
+        """
+        Report the progress of the warm-up.
+
+        Returns:
+            dict: Whether it is over, the results computed, failed and expected, and
+                  how long it took
+        """
+        with self.lock:
+            return {
+                'ready': self.ready,
+                'computed': len(self.payloads),
+                'failed': list(self.failed),
+                'total': self.total,
+                'duration': self.duration,
+            }
+
+
+def create_materializer(data_ingestor):
+    """
+    Create the warm-up selected by the environment.
+
+    WARMUP=1 enables it, WARMUP_THREADS is the number of threads computing the
+    results (the number of CPUs by default).
+
+    Args:
+        data_ingestor (DataIngestor): The dataset
+
+    Returns:
+        Materializer: The warm-up, or None when it is disabled
+    """
+    if os.environ.get('WARMUP', '0').lower() not in ('1', 'true', 'yes'):
+        return None
+    return Materializer(data_ingestor)
@@ -0,0 +1,93 @@
+"""
+This module implements the standalone workers that execute jobs out of the API
+server process. A worker loads its own copy of the dataset, registers with the
+job broker, leases jobs, computes them and pushes the results back, while a
+background thread keeps sending heartbeats.
+"""
+from threading import Thread, Event
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Pulls statistic jobs from a broker and executes them with a DataIngestor.
+
+    The heartbeat interval and the idle poll interval can be set with the
+    LESTATS_HEARTBEAT and LESTATS_WORKER_POLL environment variables.
+    """
+    def __init__(self, broker, data_ingestor, worker_id=None):
+        self.broker = broker
+        self.data_ingestor = data_ingestor
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.heartbeat_interval = float(os.environ.get('LESTATS_HEARTBEAT', 1.0))
+        self.poll_interval = float(os.environ.get('LESTATS_WORKER_POLL', 0.05))
+        self.stopped = Event()
+
+    def execute(self, endpoint, args):
+        """
+        Compute a statistic.
+
+        Args:
+            endpoint (str): Name of the statistic, a DataIngestor method
+            args (list): Arguments of the statistic
+
+        Returns:
+            str: The result serialized as JSON
+        """
+        return json.dumps(getattr(self.data_ingestor, endpoint)(*args))
+
+    def run_once(self):
+        """
+        Lease a job, execute it and push its outcome back to the broker.
+
+        Returns:
+            bool: False if no job was queued
+        """
+        job = self.broker.lease(self.worker_id)
+        if job is None:
+            return False
+
+        job_id, endpoint, args = job
+        try:
+            payload = self.execute(endpoint, args)
+            accepted = self.broker.complete(job_id, self.worker_id, 'done', payload)
+        # A bad input must not take the worker down with it
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.error("Job %s (%s) failed: %r", job_id, endpoint, e)
+            accepted = self.broker.complete(job_id, self.worker_id, 'error', reason=str(e))
+
+        if not accepted:
+            logger.warning("Job %s was re-delivered to another worker, result dropped", job_id)
+        return True
+
+    def send_heartbeats(self):
+        """
+        Body of the heartbeat thread: refresh the registration until the worker stops.
+        """
+        while not self.stopped.wait(self.heartbeat_interval):
+            if not self.broker.heartbeat(self.worker_id):
+                logger.warning("Worker %s was declared dead, registering again", self.worker_id)
+                self.broker.register(self.worker_id)
+
+    def run(self):
+        """
+        Register with the broker and execute jobs until stop is called.
+        """
+        self.broker.register(self.worker_id)
+        Thread(target=self.send_heartbeats, daemon=True).start()
+        logger.info("Worker %s started", self.worker_id)
+
+        while not self.stopped.is_set():
+            if not self.run_once():
+                self.stopped.wait(self.poll_interval)
+
+    def stop(self):
+        """
+        Ask the worker to stop after its current job.
+        """
+        self.stopped.set()
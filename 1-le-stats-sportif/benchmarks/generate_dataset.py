@@ -0,0 +1,202 @@
+"""
+Generator of synthetic datasets for performance work.
+
+Writes CSV files with the columns of nutrition_activity_obesity_usa_subset.csv and
+a realistic cardinality: the 9 questions known by the DataIngestor, 54 locations,
+6 stratification categories with 28 stratifications, and 12 years. Rows are drawn
+at random and written in chunks, so files of 100M rows are generated in constant
+memory.
+
+Usage:
+    python benchmarks/generate_dataset.py --rows 1000000 --output synthetic-1M.csv
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    '', 'YearStart', 'YearEnd', 'LocationAbbr', 'LocationDesc', 'Datasource', 'Class',
+    'Topic', 'Question', 'Data_Value_Unit', 'Data_Value_Type', 'Data_Value', 'Data_Value_Alt',
+    'Data_Value_Footnote_Symbol', 'Data_Value_Footnote', 'Low_Confidence_Limit',
+    'High_Confidence_Limit ', 'Sample_Size', 'Total', 'Age(years)', 'Education', 'Gender',
+    'Income', 'Race/Ethnicity', 'GeoLocation', 'ClassID', 'TopicID', 'QuestionID',
+    'DataValueTypeID', 'LocationID', 'StratificationCategory1', 'Stratification1',
+    'StratificationCategoryId1', 'StratificationID1',
+]
+
+# Question, class, topic, class ID, topic ID, question ID and typical value
+QUESTIONS = [
+    ('Percent of adults aged 18 years and older who have an overweight classification',
+     'Obesity / Weight Status', 'Obesity / Weight Status', 'OWS', 'OWS1', 'Q037', 35.0),
+    ('Percent of adults aged 18 years and older who have obesity',
+     'Obesity / Weight Status', 'Obesity / Weight Status', 'OWS', 'OWS1', 'Q036', 30.0),
+    ('Percent of adults who engage in no leisure-time physical activity',
+     'Physical Activity', 'Physical Activity - Behavior', 'PA', 'PA1', 'Q047', 25.0),
+    ('Percent of adults who report consuming fruit less than one time daily',
+     'Fruits and Vegetables', 'Fruits and Vegetables - Behavior', 'FV', 'FV1', 'Q018', 38.0),
+    ('Percent of adults who report consuming vegetables less than one time daily',
+     'Fruits and Vegetables', 'Fruits and Vegetables - Behavior', 'FV', 'FV1', 'Q019', 22.0),
+    ('Percent of adults who achieve at least 150 minutes a week of moderate-intensity '
+     'aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic '
+     'activity (or an equivalent combination)',
+     'Physical Activity', 'Physical Activity - Behavior', 'PA', 'PA1', 'Q043', 50.0),
+    ('Percent of adults who achieve at least 150 minutes a week of moderate-intensity '
+     'aerobic physical activity or 75 minutes a week of vigorous-intensity aerobic '
+     'physical activity and engage in muscle-strengthening activities on 2 or more '
+     'days a week',
+     'Physical Activity', 'Physical Activity - Behavior', 'PA', 'PA1', 'Q045', 20.0),
+    ('Percent of adults who achieve at least 300 minutes a week of moderate-intensity '
+     'aerobic physical activity or 150 minutes a week of vigorous-intensity aerobic '
+     'activity (or an equivalent combination)',
+     'Physical Activity', 'Physical Activity - Behavior', 'PA', 'PA1', 'Q044', 32.0),
+    ('Percent of adults who engage in muscle-strengthening activities on 2 or more '
+     'days a week',
+     'Physical Activity', 'Physical Activity - Behavior', 'PA', 'PA1', 'Q046', 30.0),
+]
+
+LOCATIONS = [
+    ('AL', 'Alabama'), ('AK', 'Alaska'), ('AZ', 'Arizona'), ('AR', 'Arkansas'),
+    ('CA', 'California'), ('CO', 'Colorado'), ('CT', 'Connecticut'), ('DE', 'Delaware'),
+    ('DC', 'District of Columbia'), ('FL', 'Florida'), ('GA', 'Georgia'), ('GU', 'Guam'),
+    ('HI', 'Hawaii'), ('ID', 'Idaho'), ('IL', 'Illinois'), ('IN', 'Indiana'), ('IA', 'Iowa'),
+    ('KS', 'Kansas'), ('KY', 'Kentucky'), ('LA', 'Louisiana'), ('ME', 'Maine'),
+    ('MD', 'Maryland'), ('MA', 'Massachusetts'), ('MI', 'Michigan'), ('MN', 'Minnesota'),
+    ('MS', 'Mississippi'), ('MO', 'Missouri'), ('MT', 'Montana'), ('NE', 'Nebraska'),
+    ('NV', 'Nevada'), ('NH', 'New Hampshire'), ('NJ', 'New Jersey'), ('NM', 'New Mexico'),
+    ('NY', 'New York'), ('NC', 'North Carolina'), ('ND', 'North Dakota'), ('OH', 'Ohio'),
+    ('OK', 'Oklahoma'), ('OR', 'Oregon'), ('PA', 'Pennsylvania'), ('PR', 'Puerto Rico'),
+    ('RI', 'Rhode Island'), ('SC', 'South Carolina'), ('SD', 'South Dakota'),
+    ('TN', 'Tennessee'), ('TX', 'Texas'), ('US', 'National'), ('UT', 'Utah'),
+    ('VT', 'Vermont'), ('VI', 'Virgin Islands'), ('VA', 'Virginia'), ('WA', 'Washington'),
+    ('WV', 'West Virginia'), ('WI', 'Wisconsin'),
+]
+
+# Category, category ID, and the name and ID of its stratifications
+STRATIFICATIONS = [
+    ('Total', 'OVR', [('Total', 'OVERALL')]),
+    ('Age (years)', 'AGEYR', [('18 - 24', 'AGEYR1824'), ('25 - 34', 'AGEYR2534'),
+                              ('35 - 44', 'AGEYR3544'), ('45 - 54', 'AGEYR4554'),
+                              ('55 - 64', 'AGEYR5564'), ('65 or older', 'AGEYR65PLUS')]),
+    ('Education', 'EDU', [('Less than high school', 'EDUHS'),
+                          ('High school graduate', 'EDUHSGRAD'),
+                          ('Some college or technical school', 'EDUCOTEC'),
+                          ('College graduate', 'EDUCOGRAD')]),
+    ('Gender', 'GEN', [('Male', 'MALE'), ('Female', 'FEMALE')]),
+    ('Income', 'INC', [('Less than $15,000', 'INCLESS15'), ('$15,000 - $24,999', 'INC1525'),
+                       ('$25,000 - $34,999', 'INC2535'), ('$35,000 - $49,999', 'INC3550'),
+                       ('$50,000 - $74,999', 'INC5075'), ('$75,000 or greater', 'INC75PLUS'),
+                       ('Data not reported', 'INCNR')]),
+    ('Race/Ethnicity', 'RACE', [('Non-Hispanic White', 'RACEWHT'),
+                                ('Non-Hispanic Black', 'RACEBLK'), ('Hispanic', 'RACEHIS'),
+                                ('Asian', 'RACEASN'), ('Hawaiian/Pacific Islander', 'RACEHPI'),
+                                ('American Indian/Alaska Native', 'RACENAA'),
+                                ('2 or more races', 'RACE2PLUS'), ('Other', 'RACEOTH')]),
+]
+
+# Every stratification, with its category
+STRATA = [(category, category_id, name, strat_id)
+          for category, category_id, names in STRATIFICATIONS
+          for name, strat_id in names]
+
+# Columns of the original dataset named after a stratification category
+CATEGORY_COLUMNS = {'Total': 'Total', 'Age (years)': 'Age(years)', 'Education': 'Education',
+                    'Gender': 'Gender', 'Income': 'Income', 'Race/Ethnicity': 'Race/Ethnicity'}
+
+YEARS = list(range(2011, 2023))
+# Fraction of rows without a value, as in the original dataset
+MISSING_VALUES = 0.1
+
+
+def generate_chunk(rng, start, size):
+    """
+    Generate a chunk of random rows.
+
+    Args:
+        rng (numpy.random.Generator): Source of randomness
+        start (int): Index of the first row
+        size (int): Number of rows
+
+    Returns:
+        pandas.DataFrame: The rows, with the columns of the original dataset
+    """
+    questions = rng.integers(len(QUESTIONS), size=size)
+    locations = rng.integers(len(LOCATIONS), size=size)
+    stratification = rng.integers(len(STRATA), size=size)
+    years = np.array(YEARS)[rng.integers(len(YEARS), size=size)]
+
+    typical = np.array([question[6] for question in QUESTIONS])[questions]
+    values = np.round(np.clip(rng.normal(typical, typical / 5), 0.5, 99.5), 1)
+    values[rng.random(size) < MISSING_VALUES] = np.nan
+    margin = np.round(rng.uniform(0.5, 5.0, size), 1)
+
+    def pick(table, indices, field):
+        return np.array([row[field] for row in table], dtype=object)[indices]
+
+    chunk = pd.DataFrame({
+        '': np.arange(start, start + size),
+        'YearStart': years,
+        'YearEnd': years,
+        'LocationAbbr': pick(LOCATIONS, locations, 0),
+        'LocationDesc': pick(LOCATIONS, locations, 1),
+        'Datasource': 'Behavioral Risk Factor Surveillance System',
+        'Class': pick(QUESTIONS, questions, 1),
+        'Topic': pick(QUESTIONS, questions, 2),
+        'Question': pick(QUESTIONS, questions, 0),
+        'Data_Value_Type': 'Value',
+        'Data_Value': values,
+        'Data_Value_Alt': values,
+        'Low_Confidence_Limit': np.round(values - margin, 1),
+        'High_Confidence_Limit ': np.round(values + margin, 1),
+        'Sample_Size': rng.integers(50, 10000, size=size),
+        'ClassID': pick(QUESTIONS, questions, 3),
+        'TopicID': pick(QUESTIONS, questions, 4),
+        'QuestionID': pick(QUESTIONS, questions, 5),
+        'DataValueTypeID': 'VALUE',
+        'LocationID': locations + 1,
+        'StratificationCategory1': pick(STRATA, stratification, 0),
+        'Stratification1': pick(STRATA, stratification, 2),
+        'StratificationCategoryId1': pick(STRATA, stratification, 1),
+        'StratificationID1': pick(STRATA, stratification, 3),
+    }, columns=COLUMNS)
+
+    # Fill the column of the category with the name of the stratification
+    for category, column in CATEGORY_COLUMNS.items():
+        mask = chunk['StratificationCategory1'] == category
+        chunk.loc[mask, column] = chunk.loc[mask, 'Stratification1']
+    return chunk
+
+
+def generate(path, rows, seed=0, chunk_size=1000000):
+    """
+    Write a synthetic dataset.
+
+    Args:
+        path (str): Path of the CSV file to write
+        rows (int): Number of rows
+        seed (int): Seed of the random generator, the same seed gives the same file
+        chunk_size (int): Number of rows generated at once
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        chunk = generate_chunk(rng, start, min(chunk_size, rows - start))
+        chunk.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def main(argv=None):
+    """
+    Parse the command line and generate the dataset.
+
+    Args:
+        argv (list): Command line arguments, sys.argv by default
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+    generate(args.output, args.rows, args.seed, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
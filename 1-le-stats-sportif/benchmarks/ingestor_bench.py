@@ -0,0 +1,205 @@
+"""
+Microbenchmarks of the DataIngestor across dataset sizes.
+
+For every size, a synthetic dataset is generated (once, then cached) and measured
+in a fresh process: the time to load it, the memory used by the loaded DataFrame
+and by the whole process, and the time of every statistic method. The report holds
+a scaling curve (size -> median time) per method, to be compared between versions.
+
+Usage:
+    python benchmarks/ingestor_bench.py --sizes 10000,100000,1000000 --output bench.json
+    python benchmarks/ingestor_bench.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+# Only the data ingestor is needed, do not start a webserver when importing app
+os.environ['LESTATS_ROLE'] = 'benchmark'
+
+# pylint: disable=wrong-import-position
+from generate_dataset import QUESTIONS, generate
+from report import read_report, write_report
+
+QUESTION = QUESTIONS[1][0]
+STATE = 'Ohio'
+
+# Statistic methods and their arguments
+METHODS = {
+    'states_mean': (QUESTION,),
+    'state_mean': (QUESTION, STATE),
+    'best5': (QUESTION,),
+    'worst5': (QUESTION,),
+    'global_mean': (QUESTION,),
+    'diff_from_mean': (QUESTION,),
+    'state_diff_from_mean': (QUESTION, STATE),
+    'mean_by_category': (QUESTION,),
+    'state_mean_by_category': (QUESTION, STATE),
+}
+
+
+def dataset_path(data_dir, rows):
+    """
+    Get the path of the synthetic dataset of a size, generating it if needed.
+
+    Args:
+        data_dir (str): Directory of the cached datasets
+        rows (int): Number of rows
+
+    Returns:
+        str: Path of the dataset
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'synthetic-{rows}.csv')
+    if not os.path.exists(path):
+        generate(path + '.tmp', rows)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def measure(path, repeat):
+    """
+    Measure the DataIngestor on one dataset, in the current process.
+
+    Args:
+        path (str): Path of the dataset
+        repeat (int): Number of timed calls of every method
+
+    Returns:
+        dict: Load time, memory usage and timings of every method
+    """
+    from app.data_ingestor import DataIngestor # pylint: disable=import-outside-toplevel
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    ingestor = DataIngestor(path)
+    load_s = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    methods = {}
+    for name, args in METHODS.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            getattr(ingestor, name)(*args)
+            timings.append(time.perf_counter() - start)
+        methods[name] = {'median_s': statistics.median(timings), 'min_s': min(timings)}
+
+    return {
+        'load_s': load_s,
+        'dataframe_bytes': int(ingestor.df.memory_usage(deep=True).sum()),
+        # ru_maxrss is in kilobytes on Linux
+        'load_peak_rss_bytes': (rss_after - rss_before) * 1024,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'methods': methods,
+    }
+
+
+def version():
+    """
+    Describe the code being measured.
+
+    Returns:
+        dict: Git commit, Python and pandas versions
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import pandas # pylint: disable=import-outside-toplevel
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pandas.__version__}
+
+
+def run(sizes, data_dir, repeat):
+    """
+    Measure every size, each one in a fresh process so memory peaks do not add up.
+
+    Args:
+        sizes (list): Numbers of rows
+        data_dir (str): Directory of the cached datasets
+        repeat (int): Number of timed calls of every method
+
+    Returns:
+        dict: The report, with the results of every size and the scaling curves
+    """
+    results = {}
+    for rows in sizes:
+        path = dataset_path(data_dir, rows)
+        output = subprocess.run([sys.executable, __file__, '--measure', path,
+                                 '--repeat', str(repeat)],
+                                check=True, capture_output=True, text=True).stdout
+        results[str(rows)] = json.loads(output)
+
+    curves = {'load_s': [[rows, results[str(rows)]['load_s']] for rows in sizes],
+              'dataframe_bytes': [[rows, results[str(rows)]['dataframe_bytes']]
+                                  for rows in sizes]}
+    for name in METHODS:
+        curves[name] = [[rows, results[str(rows)]['methods'][name]['median_s']]
+                        for rows in sizes]
+    return {'version': version(), 'repeat': repeat, 'sizes': sizes,
+            'results': results, 'curves': curves}
+
+
+def compare(base, new):
+    """
+    Compare the scaling curves of two reports.
+
+    Args:
+        base (dict): Report of the reference version
+        new (dict): Report of the version under test
+
+    Returns:
+        list: Lines of a text table with the ratio new / base of every point
+    """
+    lines = [f"{'curve':<24}{'rows':>12}{'base':>14}{'new':>14}{'ratio':>8}"]
+    for name, points in new['curves'].items():
+        base_points = dict(base['curves'].get(name, []))
+        for rows, value in points:
+            if rows in base_points and base_points[rows]:
+                ratio = value / base_points[rows]
+                lines.append(f'{name:<24}{rows:>12}{base_points[rows]:>14.6g}'
+                             f'{value:>14.6g}{ratio:>8.2f}')
+    return lines
+
+
+def main(argv=None):
+    """
+    Parse the command line and run, or compare, the benchmarks.
+
+    Args:
+        argv (list): Command line arguments, sys.argv by default
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated numbers of rows')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'))
+    parser.add_argument('--output', default='-', help="report file, '-' for stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two reports instead of running the benchmarks')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        json.dump(measure(args.measure, args.repeat), sys.stdout)
+        return
+
+    if args.compare:
+        print('\n'.join(compare(read_report(args.compare[0]), read_report(args.compare[1]))))
+        return
+
+    write_report(run([int(size) for size in args.sizes.split(',')], args.data_dir, args.repeat),
+                 args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+Load test for a running Le Stats Sportif server.
+
+Replays the requests of the checker corpus (tests/<endpoint>/input/*.json), plus
+synthetic variations of them, from several concurrent clients sharing a pool of
+keep-alive connections. Every client submits a request, waits for its result with
+the 'wait' parameter of get_results, and starts over. A sampler thread records the
+queue depth of the server over time.
+
+The report is a JSON document with the throughput, the error rate and the latency
+percentiles of every endpoint, both for the submission and for the full round trip
+until the result is available.
+
+Usage:
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --concurrency 16 \\
+        --duration 30 --mix best5=2,states_mean=1 --output report.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import argparse
+import glob
+import itertools
+import json
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from report import write_report
+
+# Seconds a client waits for a result in one get_results request
+RESULT_WAIT = 10.0
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_corpus(tests_dir):
+    """
+    Load the request bodies of the checker corpus.
+
+    Args:
+        tests_dir (str): Directory with one sub-directory per endpoint
+
+    Returns:
+        dict: List of request bodies of every endpoint
+    """
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(tests_dir, '*', 'input', '*.json'))):
+        endpoint = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        with open(path, encoding='utf-8') as file:
+            corpus.setdefault(endpoint, []).append(json.load(file))
+    return corpus
+
+
+def parse_mix(spec, endpoints):
+    """
+    Parse the request mix.
+
+    Args:
+        spec (str): Comma separated 'endpoint=weight' pairs, empty for an even mix
+        endpoints (list): Endpoints found in the corpus
+
+    Returns:
+        dict: Weight of every endpoint
+    """
+    if not spec:
+        return dict.fromkeys(endpoints, 1.0)
+
+    mix = {}
+    for item in spec.split(','):
+        endpoint, weight = item.split('=', 1)
+        if endpoint not in endpoints:
+            raise ValueError(f"No requests in the corpus for endpoint {endpoint}")
+        mix[endpoint] = float(weight)
+    return mix
+
+
+class RequestGenerator: # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    Draws request bodies from the corpus.
+
+    With probability 'synthetic', a body is a variation of the corpus instead of
+    one of its entries: the question and the state are drawn independently from
+    all the questions and states of the corpus. With probability 'invalid', the
+    state is replaced by one missing from the dataset, to exercise the error path.
+    """
+    def __init__(self, corpus, mix, synthetic=0.5, invalid=0.0, seed=None):
+        self.corpus = corpus
+        self.endpoints = list(mix)
+        self.weights = list(mix.values())
+        self.synthetic = synthetic
+        self.invalid = invalid
+        self.random = random.Random(seed)
+        bodies = [body for entries in corpus.values() for body in entries]
+        self.questions = sorted({body['question'] for body in bodies if 'question' in body})
+        self.states = sorted({body['state'] for body in bodies if 'state' in body})
+
+    def next(self):
+        """
+        Draw the next request.
+
+        Returns:
+            tuple: The endpoint and the request body
+        """
+        endpoint = self.random.choices(self.endpoints, self.weights)[0]
+        body = dict(self.random.choice(self.corpus[endpoint]))
+        if self.random.random() < self.synthetic:
+            body['question'] = self.random.choice(self.questions)
+            if 'state' in body:
+                body['state'] = self.random.choice(self.states)
+        if 'state' in body and self.random.random() < self.invalid:
+            body['state'] = 'Atlantis'
+        return endpoint, body
+
+
+def percentiles(values):
+    """
+    Summarize latencies.
+
+    Args:
+        values (list): Latencies in seconds
+
+    Returns:
+        dict: Count, mean, max and PERCENTILES of the latencies, in milliseconds
+    """
+    if not values:
+        return {'count': 0}
+
+    values = sorted(values)
+    summary = {
+        'count': len(values),
+        'mean_ms': round(1000 * sum(values) / len(values), 3),
+        'max_ms': round(1000 * values[-1], 3),
+    }
+    for p in PERCENTILES:
+        index = min(len(values) - 1, int(p / 100 * len(values)))
+        summary[f'p{p}_ms'] = round(1000 * values[index], 3)
+    return summary
+
+
+class LoadTest:
+    """
+    Runs the clients and the queue depth sampler, and builds the report.
+    """
+    def __init__(self, url, generator, concurrency, sample_interval=0.5):
+        self.url = url.rstrip('/')
+        self.generator = generator
+        self.concurrency = concurrency
+        self.sample_interval = sample_interval
+        self.session = requests.Session()
+        # One keep-alive connection per client
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.samples = []
+        self.stopped = Event()
+
+    def run_request(self):
+        """
+        Submit one request and wait for its result.
+
+        Returns:
+            dict: Endpoint, outcome, submission latency and round trip latency
+        """
+        endpoint, body = self.generator.next()
+        outcome = {'endpoint': endpoint, 'status': 'error'}
+        start = time.perf_counter()
+        try:
+            response = self.session.post(f'{self.url}/api/{endpoint}', json=body, timeout=30)
+            outcome['submit'] = time.perf_counter() - start
+            if response.status_code != 200 or 'job_id' not in response.json():
+                outcome['status'] = f'http_{response.status_code}'
+                return outcome
+
+            job_id = response.json()['job_id']
+            result = response.json()
+            while result.get('status', 'running') == 'running':
+                result = self.session.get(f'{self.url}/api/get_results/{job_id}',
+                                          params={'wait': RESULT_WAIT},
+                                          timeout=RESULT_WAIT + 30).json()
+            outcome['status'] = result['status']
+            outcome['latency'] = time.perf_counter() - start
+        except requests.RequestException as e:
+            outcome['status'] = type(e).__name__
+        return outcome
+
+    def sample_queue_depth(self, started):
+        """
+        Body of the sampler thread: record the number of pending jobs over time.
+
+        Args:
+            started (float): perf_counter time at which the test started
+        """
+        while not self.stopped.wait(self.sample_interval):
+            try:
+                num_jobs = self.session.get(f'{self.url}/api/num_jobs', timeout=5).json()
+                self.samples.append([round(time.perf_counter() - started, 3),
+                                     num_jobs['num_jobs']])
+            except requests.RequestException:
+                continue
+
+    def client(self, deadline, counter, num_requests):
+        """
+        Body of a client thread: send requests until the deadline or the budget runs out.
+
+        Args:
+            deadline (float): perf_counter time at which to stop
+            counter (itertools.count): Number of requests sent by all the clients
+            num_requests (int): Maximum number of requests, None for no limit
+
+        Returns:
+            list: The outcome of every request
+        """
+        outcomes = []
+        # next() on a count is atomic, the clients share the budget without a lock
+        while time.perf_counter() < deadline and \
+                (num_requests is None or next(counter) < num_requests):
+            outcomes.append(self.run_request())
+        return outcomes
+
+    def run(self, duration, num_requests=None):
+        """
+        Run the load test.
+
+        Args:
+            duration (float): Maximum duration of the test, in seconds
+            num_requests (int): Maximum number of requests, None for no limit
+
+        Returns:
+            dict: The report
+        """
+        started = time.perf_counter()
+        sampler = Thread(target=self.sample_queue_depth, args=(started,), daemon=True)
+        sampler.start()
+
+        deadline = started + duration
+        counter = itertools.count()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            futures = [pool.submit(self.client, deadline, counter, num_requests)
+                       for _ in range(self.concurrency)]
+            outcomes = [outcome for future in futures for outcome in future.result()]
+
+        elapsed = time.perf_counter() - started
+        self.stopped.set()
+        sampler.join()
+        return self.report(outcomes, elapsed)
+
+    def report(self, outcomes, elapsed):
+        """
+        Aggregate the outcomes of the requests.
+
+        Args:
+            outcomes (list): Outcome of every request
+            elapsed (float): Duration of the test, in seconds
+
+        Returns:
+            dict: Totals, per endpoint statistics and queue depth samples
+        """
+        endpoints = {}
+        for outcome in outcomes:
+            stats = endpoints.setdefault(outcome['endpoint'],
+                                         {'submit': [], 'latency': [], 'statuses': {}})
+            stats['statuses'][outcome['status']] = stats['statuses'].get(outcome['status'], 0) + 1
+            for key in ('submit', 'latency'):
+                if key in outcome:
+                    stats[key].append(outcome[key])
+
+        report_endpoints = {}
+        for endpoint, stats in sorted(endpoints.items()):
+            total = sum(stats['statuses'].values())
+            report_endpoints[endpoint] = {
+                'requests': total,
+                'throughput_rps': round(total / elapsed, 3),
+                'error_rate': round(1 - stats['statuses'].get('done', 0) / total, 4),
+                'statuses': stats['statuses'],
+                'submit_latency': percentiles(stats['submit']),
+                'round_trip_latency': percentiles(stats['latency']),
+            }
+
+        done = sum(1 for outcome in outcomes if outcome['status'] == 'done')
+        return {
+            'config': {'url': self.url, 'concurrency': self.concurrency},
+            'duration_s': round(elapsed, 3),
+            'requests': len(outcomes),
+            'throughput_rps': round(len(outcomes) / elapsed, 3) if elapsed else 0.0,
+            'error_rate': round(1 - done / len(outcomes), 4) if outcomes else 0.0,
+            'round_trip_latency': percentiles([outcome['latency'] for outcome in outcomes
+                                               if 'latency' in outcome]),
+            'endpoints': report_endpoints,
+            'queue_depth': {
+                'max': max((depth for _, depth in self.samples), default=0),
+                'samples': self.samples,
+            },
+        }
+
+
+def main(argv=None):
+    """
+    Parse the command line, run the load test and write its report.
+
+    Args:
+        argv (list): Command line arguments, sys.argv by default
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--tests-dir', default=os.path.join(here, '..', 'tests'))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='maximum duration of the test, in seconds')
+    parser.add_argument('--requests', type=int, default=None,
+                        help='maximum number of requests')
+    parser.add_argument('--mix', default='',
+                        help="request mix, e.g. 'best5=2,states_mean=1' (even by default)")
+    parser.add_argument('--synthetic', type=float, default=0.5,
+                        help='fraction of synthetic variations of the corpus')
+    parser.add_argument('--invalid', type=float, default=0.0,
+                        help='fraction of requests for an unknown state')
+    parser.add_argument('--sample-interval', type=float, default=0.5,
+                        help='seconds between two queue depth samples')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default='-', help="report file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.tests_dir)
+    generator = RequestGenerator(corpus, parse_mix(args.mix, list(corpus)),
+                                 args.synthetic, args.invalid, args.seed)
+    load_test = LoadTest(args.url, generator, args.concurrency, args.sample_interval)
+    write_report(load_test.run(args.duration, args.requests), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Performance regression gate.
+
+Runs a fixed set of scenarios, the DataIngestor statistic methods and end-to-end
+API requests served by the Flask app in-process, on a synthetic dataset. Every
+scenario is measured over several trials; the mean of the trials and its 95%
+confidence interval are kept, so a change is only reported when it is beyond the
+noise of the measurement.
+
+'record' saves the results as the baseline, 'check' compares a new run with it and
+exits with status 1 when a latency grew, a throughput dropped or the peak memory
+grew by more than the threshold.
+
+Usage:
+    python benchmarks/perf_gate.py record
+    python benchmarks/perf_gate.py check --threshold 0.15
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+# pylint: disable=wrong-import-position
+from ingestor_bench import METHODS, QUESTION, dataset_path, version
+from report import read_report, write_report
+
+# Version of the baseline format, baselines of another version are not compared
+BASELINE_FORMAT = 1
+# Jobs submitted at once by the throughput scenario
+THROUGHPUT_JOBS = 50
+# Two-sided 95% quantiles of the Student t distribution, by degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+        9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+
+
+def t_quantile(df):
+    """
+    Get the 95% quantile of the Student t distribution.
+
+    Args:
+        df (int): Degrees of freedom
+
+    Returns:
+        float: The quantile, rounded up to the closest tabulated degrees of freedom
+    """
+    for known in sorted(T_95):
+        if df <= known:
+            return T_95[known]
+    return 1.96
+
+
+def summarize(samples):
+    """
+    Summarize the trials of a scenario.
+
+    Args:
+        samples (list): Result of every trial
+
+    Returns:
+        dict: Mean, standard deviation and 95% confidence interval of the mean
+    """
+    mean = statistics.fmean(samples)
+    stdev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    half_width = t_quantile(len(samples) - 1) * stdev / math.sqrt(len(samples)) \
+        if len(samples) > 1 else 0.0
+    return {'mean': mean, 'stdev': stdev, 'ci_low': mean - half_width,
+            'ci_high': mean + half_width, 'trials': len(samples)}
+
+
+def ingestor_scenarios(ingestor, iterations):
+    """
+    Build the DataIngestor scenarios.
+
+    Args:
+        ingestor (DataIngestor): The loaded dataset
+        iterations (int): Calls per trial
+
+    Returns:
+        dict: Name, unit and trial function of every scenario
+    """
+    scenarios = {}
+    for name, args in METHODS.items():
+        def trial(method=getattr(ingestor, name), args=args):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                method(*args)
+            return (time.perf_counter() - start) / iterations
+        scenarios[f'ingestor.{name}'] = ('latency_s', trial)
+    return scenarios
+
+
+def api_scenarios(client, iterations):
+    """
+    Build the end-to-end API scenarios.
+
+    Args:
+        client (FlaskClient): Test client of the webserver
+        iterations (int): Requests per trial of the latency scenarios
+
+    Returns:
+        dict: Name, unit and trial function of every scenario
+    """
+    def wait(job_id):
+        result = {'status': 'running'}
+        while result['status'] == 'running':
+            result = client.get(f'/api/get_results/{job_id}?wait=10').get_json()
+        return result
+
+    def round_trip(endpoint, body):
+        def trial():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                wait(client.post(f'/api/{endpoint}', json=body).get_json()['job_id'])
+            return (time.perf_counter() - start) / iterations
+        return trial
+
+    def throughput():
+        start = time.perf_counter()
+        job_ids = [client.post('/api/states_mean', json={'question': QUESTION}).get_json()
+                   ['job_id'] for _ in range(THROUGHPUT_JOBS)]
+        for job_id in job_ids:
+            wait(job_id)
+        return THROUGHPUT_JOBS / (time.perf_counter() - start)
+
+    return {
+        'api.states_mean': ('latency_s', round_trip('states_mean', {'question': QUESTION})),
+        'api.state_mean_by_category': ('latency_s', round_trip(
+            'state_mean_by_category', {'question': QUESTION, 'state': 'Ohio'})),
+        'api.throughput': ('jobs_per_s', throughput),
+    }
+
+
+def measure(path, trials, iterations):
+    """
+    Run every scenario on one dataset, in the current process.
+
+    Args:
+        path (str): Path of the dataset
+        trials (int): Number of trials of every scenario
+        iterations (int): Calls per trial
+
+    Returns:
+        dict: Unit and trial results of every scenario, and the peak memory
+    """
+    os.chdir(ROOT)
+    # The API scenarios need the full webserver, ingestor_bench only asked for the ingestor
+    os.environ['LESTATS_ROLE'] = 'server'
+    os.environ['LESTATS_DATASET'] = path
+    from app import webserver # pylint: disable=import-outside-toplevel
+
+    scenarios = ingestor_scenarios(webserver.data_ingestor, iterations)
+    scenarios.update(api_scenarios(webserver.test_client(), iterations))
+
+    results = {}
+    for name, (unit, trial) in scenarios.items():
+        # One warm-up run, so caches and lazy initializations are not measured
+        trial()
+        results[name] = {'unit': unit, 'samples': [trial() for _ in range(trials)]}
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'scenarios': results, 'peak_rss_bytes': peak}
+
+
+def run(rows, trials, iterations, data_dir):
+    """
+    Run the scenarios in a fresh process and summarize them.
+
+    The dataset is generated here, if needed, so neither its generation time nor
+    its memory is measured.
+
+    Args:
+        rows (int): Number of rows of the synthetic dataset
+        trials (int): Number of trials of every scenario
+        iterations (int): Calls per trial
+        data_dir (str): Directory of the cached datasets
+
+    Returns:
+        dict: The results, in the baseline format
+    """
+    path = dataset_path(data_dir, rows)
+    output = subprocess.run([sys.executable, __file__, 'measure', '--dataset', path,
+                             '--trials', str(trials), '--iterations', str(iterations)],
+                            check=True, capture_output=True, text=True).stdout
+    measured = json.loads(output)
+    return {
+        'format': BASELINE_FORMAT,
+        'version': version(),
+        'config': {'rows': rows, 'trials': trials, 'iterations': iterations},
+        'peak_rss_bytes': measured['peak_rss_bytes'],
+        'scenarios': {name: dict(summarize(result['samples']), unit=result['unit'])
+                      for name, result in measured['scenarios'].items()},
+    }
+
+
+def find_regressions(baseline, current, threshold, memory_threshold):
+    """
+    Compare a run with the baseline.
+
+    The confidence intervals of both runs are compared, so the noise of either one
+    is not taken for a regression: a latency regresses when the low end of its
+    interval is more than threshold above the high end of the baseline's, a
+    throughput when the high end of its interval is more than threshold below the
+    low end of the baseline's. Memory regresses when the peak grew by more than
+    memory_threshold.
+
+    Args:
+        baseline (dict): The baseline results
+        current (dict): The results of the new run
+        threshold (float): Tolerated relative change of latencies and throughputs
+        memory_threshold (float): Tolerated relative growth of the peak memory
+
+    Returns:
+        list: Description of every regression
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        if result['unit'] == 'latency_s' and \
+                result['ci_low'] > base['ci_high'] * (1 + threshold):
+            regressions.append(f"{name}: latency {base['mean'] * 1000:.3f} ms -> "
+                               f"{result['mean'] * 1000:.3f} ms "
+                               f"(+{result['mean'] / base['mean'] - 1:.0%})")
+        elif result['unit'] == 'jobs_per_s' and \
+                result['ci_high'] < base['ci_low'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['mean']:.1f} -> "
+                               f"{result['mean']:.1f} jobs/s "
+                               f"({result['mean'] / base['mean'] - 1:.0%})")
+
+    if current['peak_rss_bytes'] > baseline['peak_rss_bytes'] * (1 + memory_threshold):
+        regressions.append(f"peak memory: {baseline['peak_rss_bytes'] / (1 << 20):.0f} MiB -> "
+                           f"{current['peak_rss_bytes'] / (1 << 20):.0f} MiB")
+    return regressions
+
+
+def main(argv=None):
+    """
+    Parse the command line and record, check, or measure.
+
+    Args:
+        argv (list): Command line arguments, sys.argv by default
+
+    Returns:
+        int: Exit status, 1 if the check found a regression
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('command', choices=('record', 'check', 'measure'))
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baselines', 'baseline.json'))
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='rows of the synthetic dataset')
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='tolerated relative change of latencies and throughputs')
+    parser.add_argument('--memory-threshold', type=float, default=0.10,
+                        help='tolerated relative growth of the peak memory')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'))
+    parser.add_argument('--output', default=None, help='also write the new run to this file')
+    parser.add_argument('--dataset', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'measure':
+        json.dump(measure(args.dataset, args.trials, args.iterations), sys.stdout)
+        return 0
+
+    current = run(args.rows, args.trials, args.iterations, args.data_dir)
+    if args.output:
+        write_report(current, args.output)
+
+    if args.command == 'record':
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        write_report(current, args.baseline)
+        print(f"Baseline of {len(current['scenarios'])} scenarios saved to {args.baseline}")
+        return 0
+
+    baseline = read_report(args.baseline)
+    if baseline.get('format') != BASELINE_FORMAT or baseline['config'] != current['config']:
+        print("The baseline was recorded with another format or configuration, record it again")
+        return 1
+
+    regressions = find_regressions(baseline, current, args.threshold, args.memory_threshold)
+    for name, result in sorted(current['scenarios'].items()):
+        base = baseline['scenarios'].get(name, {}).get('mean')
+        change = f"{result['mean'] / base - 1:+.1%}" if base else 'new'
+        print(f"{name:<36}{result['mean']:>14.6g} {result['unit']:<11}{change:>8}")
+    if regressions:
+        print(f"\n{len(regressions)} performance regression(s) against {baseline['version']}:")
+        print('\n'.join(regressions))
+        return 1
+
+    print("\nNo performance regression")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
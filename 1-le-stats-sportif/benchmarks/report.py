@@ -0,0 +1,35 @@
+"""
+Reading and writing of the JSON reports of the benchmarks.
+"""
+import json
+import sys
+
+
+def write_report(report, path):
+    """
+    Write a report.
+
+    Args:
+        report (dict): The report
+        path (str): Path of the report file, '-' for stdout
+    """
+    if path == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+def read_report(path):
+    """
+    Read a report.
+
+    Args:
+        path (str): Path of the report file
+
+    Returns:
+        dict: The report
+    """
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
@@ -0,0 +1,16 @@
+"""
+Runs the webserver as several processes sharing one port.
+
+The number of processes is read from LESTATS_PROCESSES (the number of CPUs by
+default); FLASK_RUN_HOST and FLASK_RUN_PORT select the address to listen on.
+"""
+import os
+
+os.environ.setdefault('LESTATS_PROCESSES', str(os.cpu_count() or 1))
+
+# The app package reads LESTATS_PROCESSES when it is imported
+from app.multiprocess import serve # pylint: disable=wrong-import-position
+
+if __name__ == '__main__':
+    serve(os.environ.get('FLASK_RUN_HOST', '127.0.0.1'),
+          int(os.environ.get('FLASK_RUN_PORT', 5000)))
@@ -0,0 +1,191 @@
+import os
+import tempfile
+import time
+import unittest
+from threading import Event, Thread, current_thread
+from app.broker import SqliteBroker
+from app.task_runner import ThreadPool
+from app.worker import Worker
+
+
+class FakeIngestor:
+    """
+    Stands for the DataIngestor of a worker.
+    """
+    def __init__(self):
+        self.release = Event()
+
+    def global_mean(self, question):
+        """
+        Return a result once the test releases the job.
+        """
+        self.release.wait(5.0)
+        return {'global_mean': len(question)}
+
+    def state_mean(self, question, state):
+        """
+        Return a result built from the arguments.
+        """
+        if state == 'NotAState':
+            raise ValueError(f"State '{state}' not found in the dataset.")
+        return {state: len(question)}
+
+
+class TestBroker(unittest.TestCase):
+    """
+    Test cases for the job broker and the out-of-process workers.
+    """
+
+    def setUp(self):
+        """
+        Create a broker in a temporary directory.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.broker = SqliteBroker(os.path.join(self.directory.name, 'broker.db'),
+                                   worker_timeout=0.05, max_deliveries=2)
+
+    def tearDown(self):
+        """
+        Remove the broker database.
+        """
+        self.directory.cleanup()
+
+    def test_lease_complete_collect(self):
+        """
+        Test that jobs are leased once, in order, and collected with their result.
+        """
+        self.broker.submit(2, 'state_mean', ['q', 'Ohio'])
+        self.broker.submit(1, 'state_mean', ['q', 'Iowa'])
+
+        self.assertEqual(self.broker.lease('a'), (1, 'state_mean', ['q', 'Iowa']))
+        self.assertEqual(self.broker.lease('b')[0], 2)
+        self.assertIsNone(self.broker.lease('a'))
+        self.assertFalse(self.broker.cancel(1))
+
+        self.assertTrue(self.broker.complete(1, 'a', 'done', '{"Iowa": 1}'))
+        self.assertEqual(self.broker.collect(), [(1, 'done', '{"Iowa": 1}', None)])
+        self.assertEqual(self.broker.collect(), [])
+
+    def test_dead_worker_jobs_are_redelivered(self):
+        """
+        Test that the job of a worker without heartbeats goes to another worker.
+        """
+        self.broker.register('a')
+        self.broker.submit(1, 'state_mean', ['q', 'Iowa'])
+        self.broker.lease('a')
+
+        time.sleep(0.1)
+        self.broker.register('b')
+        self.assertEqual(self.broker.reap(), ['a'])
+        self.assertFalse(self.broker.heartbeat('a'))
+
+        self.assertEqual(self.broker.lease('b')[0], 1)
+        self.assertFalse(self.broker.complete(1, 'a', 'done', '{}'))
+        self.assertTrue(self.broker.complete(1, 'b', 'done', '{}'))
+
+        time.sleep(0.1)
+        self.assertEqual(self.broker.reap(), ['b'])
+        self.assertEqual([w['worker_id'] for w in self.broker.workers()], [])
+
+    def test_job_fails_after_max_deliveries(self):
+        """
+        Test that a job lost by too many workers is marked as an error.
+        """
+        self.broker.submit(1, 'state_mean', ['q', 'Iowa'])
+        for worker_id in ('a', 'b'):
+            self.broker.register(worker_id)
+            self.broker.lease(worker_id)
+            time.sleep(0.1)
+            self.broker.reap()
+
+        self.assertEqual(self.broker.collect(), [(1, 'error', None, 'Job lost by its workers')])
+
+    def test_thread_pool_with_remote_worker(self):
+        """
+        Test that the thread pool gets the results computed by a worker.
+        """
+        threadpool = ThreadPool(broker=self.broker)
+        threadpool.start()
+        worker = Worker(self.broker, FakeIngestor(), 'w1')
+        Thread(target=worker.run, daemon=True).start()
+
+        try:
+            threadpool.add_job(1, None, 'state_mean', ['abc', 'Iowa'])
+            threadpool.add_job(2, None, 'state_mean', ['abc', 'NotAState'])
+            for job_id in (1, 2):
+                self.assertTrue(threadpool.jobs[job_id]['completed'].wait(2.0))
+
+            self.assertEqual(threadpool.jobs[1]['status'], 'done')
+            self.assertEqual(threadpool.result_store.get(1), '{"Iowa": 3}')
+            self.assertEqual(threadpool.jobs[2]['status'], 'error')
+            self.assertIn('NotAState', threadpool.jobs[2]['reason'])
+            self.assertEqual(threadpool.remaining_jobs, 0)
+            self.assertEqual(threadpool.supervisor.status()['remote_workers'][0]['completed'], 2)
+
+            # Jobs the workers can not run go to the pool threads, not the caller
+            threads = []
+            threadpool.add_job(3, lambda: threads.append(current_thread().name) or {}, 'trend')
+            self.assertTrue(threadpool.jobs[3]['completed'].wait(2.0))
+            self.assertEqual(threadpool.jobs[3]['status'], 'done')
+            self.assertTrue(threads[0].startswith('TaskRunner-'))
+        finally:
+            worker.stop()
+            threadpool.graceful_shutdown.set()
+
+    def test_leased_jobs_are_running(self):
+        """
+        Test that a job leased by a worker is counted as running until it completes.
+        """
+        threadpool = ThreadPool(broker=self.broker)
+        threadpool.start()
+        ingestor = FakeIngestor()
+        worker = Worker(self.broker, ingestor, 'w1')
+        Thread(target=worker.run, daemon=True).start()
+
+        try:
+            threadpool.add_job(1, None, 'global_mean', ['abc'])
+            deadline = time.time() + 2.0
+            while threadpool.jobs.counts()['running'] == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            counts = threadpool.jobs.counts()
+            self.assertEqual((counts['queued'], counts['running']), (0, 1))
+
+            ingestor.release.set()
+            self.assertTrue(threadpool.jobs[1]['completed'].wait(2.0))
+            counts = threadpool.jobs.counts()
+            self.assertEqual((counts['running'], counts['done']), (0, 1))
+            self.assertIn('started', threadpool.jobs[1]['timestamps'])
+        finally:
+            worker.stop()
+            threadpool.graceful_shutdown.set()
+
+    def test_dead_collector_is_respawned(self):
+        """
+        Test that the supervisor replaces a collector that died, and results come again.
+        """
+        threadpool = ThreadPool(broker=self.broker)
+        threadpool.start()
+        worker = Worker(self.broker, FakeIngestor(), 'w1')
+        Thread(target=worker.run, daemon=True).start()
+
+        try:
+            dead = threadpool.collector
+            def crash():
+                raise SystemExit
+            dead.poll = crash
+            dead.wake.set()
+            dead.join(2.0)
+            self.assertFalse(dead.is_alive())
+
+            self.assertEqual(threadpool.supervisor.check_workers(), 1)
+            self.assertIsNot(threadpool.collector, dead)
+            threadpool.add_job(1, None, 'state_mean', ['abc', 'Iowa'])
+            self.assertTrue(threadpool.jobs[1]['completed'].wait(2.0))
+            self.assertEqual(threadpool.jobs[1]['status'], 'done')
+        finally:
+            worker.stop()
+            threadpool.graceful_shutdown.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app.correlation import pairwise_correlation
+from app.data_ingestor import DataIngestor
+
+
+class TestCorrelation(unittest.TestCase):
+    """
+    Test cases for the correlation matrices of the per-state means.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.data_ingestor = DataIngestor('./test.csv')
+
+    def test_matches_pandas(self):
+        """
+        Test that the pairwise correlations match pandas, with missing values.
+        """
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(40, 6))
+        matrix[rng.random(matrix.shape) < 0.3] = np.nan
+        matrix[:, 2] = 5.0
+
+        correlation, count = pairwise_correlation(matrix)
+        expected = pd.DataFrame(matrix).corr()
+
+        np.testing.assert_allclose(correlation, expected.to_numpy(), atol=1e-12)
+        self.assertTrue(np.isnan(correlation[2]).all())
+        self.assertEqual(count[0, 1], int((~np.isnan(matrix[:, [0, 1]])).all(axis=1).sum()))
+
+    def test_questions_correlation(self):
+        """
+        Test the question x question matrix of a dataset.
+        """
+        result = self.data_ingestor.correlation()
+        labels = result['labels']
+
+        self.assertEqual(result['by'], 'question')
+        self.assertEqual(labels, sorted(self.data_ingestor.df['Question'].unique()))
+        self.assertEqual(len(result['matrix']), len(labels))
+        for index, row in enumerate(result['matrix']):
+            self.assertEqual(len(row), len(labels))
+            self.assertIn(row[index], (1.0, None))
+
+    def test_states_similarity_is_cached(self):
+        """
+        Test that the state x state matrix is computed once.
+        """
+        result = self.data_ingestor.correlation('state')
+        self.assertEqual(result['labels'], sorted(self.data_ingestor.df['LocationDesc'].unique()))
+        self.assertIs(self.data_ingestor.correlation('state'), result)
+
+    def test_invalid_axis(self):
+        """
+        Test that an unknown axis is rejected.
+        """
+        with self.assertRaises(ValueError):
+            self.data_ingestor.correlation('year')
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from app.data_ingestor import DataIngestor
+from app.datasets import DEFAULT_DATASET, DatasetRegistry, entry_bytes, measure
+
+
+class TestDatasets(unittest.TestCase):
+    """
+    Test cases for the registry of datasets.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.default = DataIngestor('./test.csv')
+        self.size = entry_bytes(measure(self.default))
+        self.registry = DatasetRegistry(budget=int(3.5 * self.size))
+        self.registry.register(DEFAULT_DATASET, './test.csv', self.default)
+        for name in ('a', 'b', 'c'):
+            path = os.path.join(self.directory, f'{name}.csv')
+            shutil.copy('./test.csv', path)
+            self.registry.register(name, path)
+
+    def tearDown(self):
+        """
+        Tear down the test case.
+        """
+        shutil.rmtree(self.directory)
+
+    def dataset_stats(self, name):
+        """
+        Get the stats of one dataset of the registry.
+        """
+        return next(info for info in self.registry.stats()['datasets'] if info['name'] == name)
+
+    def test_lazy_loading(self):
+        """
+        Test that a dataset is loaded by its first use only.
+        """
+        self.assertFalse(self.dataset_stats('a')['loaded'])
+        first = self.registry.get('a')
+        self.assertIs(self.registry.get('a'), first)
+
+        stats = self.dataset_stats('a')
+        self.assertEqual((stats['loaded'], stats['loads'], stats['hits']), (True, 1, 1))
+        with self.assertRaises(ValueError):
+            self.registry.get('missing')
+
+    def test_least_recently_used_is_evicted(self):
+        """
+        Test that the least recently used dataset is evicted over the budget.
+        """
+        self.registry.get('a')
+        self.registry.get('b')
+        self.registry.get('a')
+        self.registry.get('c')
+
+        stats = self.registry.stats()
+        loaded = [info['name'] for info in stats['datasets'] if info['loaded']]
+        # The default dataset is pinned, 'b' was used before 'a'
+        self.assertEqual(loaded, [DEFAULT_DATASET, 'a', 'c'])
+        self.assertEqual(self.dataset_stats('b')['evictions'], 1)
+        self.assertLessEqual(stats['loaded_bytes'], stats['budget_bytes'])
+
+        self.registry.get('b')
+        self.assertEqual(self.dataset_stats('b')['loads'], 2)
+
+    def test_caches_are_charged_to_the_budget(self):
+        """
+        Test that the caches a job builds count against the budget once refreshed.
+        """
+        self.registry.get('b')
+        data_ingestor = self.registry.get('a')
+        self.registry.refresh('a')
+        self.assertEqual(self.dataset_stats('b')['evictions'], 0)
+
+        frame = self.dataset_stats('a')['frame_bytes']
+        data_ingestor.correlation('question')
+        self.registry.refresh('a')
+        stats = self.dataset_stats('a')
+        self.assertGreater(stats['cache_bytes'], 0)
+        self.assertEqual(stats['frame_bytes'], frame)
+        self.assertEqual(stats['bytes'], stats['frame_bytes'] + stats['cache_bytes'])
+
+        # Both copies do not fit anymore with the caches of 'a', 'b' is evicted
+        data_ingestor.states_mean(data_ingestor.df['Question'].iloc[0], True)
+        self.registry.refresh('a')
+        self.assertEqual(self.dataset_stats('b')['evictions'], 1)
+        self.assertTrue(self.dataset_stats('a')['loaded'])
+
+    def test_concurrent_first_use_loads_once(self):
+        """
+        Test that jobs asking for a dataset being loaded share the same load.
+        """
+        loaded = []
+        threads = [Thread(target=lambda: loaded.append(self.registry.get('a')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(data_ingestor) for data_ingestor in loaded}), 1)
+        self.assertEqual(self.dataset_stats('a')['loads'], 1)
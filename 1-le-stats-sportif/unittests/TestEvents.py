@@ -0,0 +1,92 @@
+import json
+import unittest
+from app.events import EventBus, job_event, format_event
+
+class TestEvents(unittest.TestCase):
+    """
+    Test cases for the events module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.bus = EventBus(max_pending = 2)
+
+    def test_filtered_subscription(self):
+        """
+        Test that a filtered subscriber only gets the events of its jobs.
+        """
+        subscription = self.bus.subscribe({1, 3})
+        for job_id in range(1, 5):
+            self.bus.publish({'job_id': job_id, 'status': 'done'})
+
+        self.assertEqual(subscription.next_event(0.1)['job_id'], 1)
+        self.assertEqual(subscription.next_event(0.1)['job_id'], 3)
+        self.assertIsNone(subscription.next_event(0.01))
+
+    def test_unsubscribe(self):
+        """
+        Test that removed subscribers leave no trace in the index.
+        """
+        filtered = self.bus.subscribe({1})
+        unfiltered = self.bus.subscribe()
+        self.assertEqual(self.bus.num_subscribers(), 2)
+
+        self.bus.unsubscribe(filtered)
+        self.bus.unsubscribe(unfiltered)
+        self.assertEqual(self.bus.num_subscribers(), 0)
+        self.assertEqual(self.bus.by_job, {})
+
+    def test_slow_subscriber_is_dropped(self):
+        """
+        Test that a subscriber whose queue overflows is closed instead of blocking.
+        """
+        subscription = self.bus.subscribe()
+        for job_id in range(3):
+            self.bus.publish({'job_id': job_id, 'status': 'done'})
+
+        self.assertTrue(subscription.closed)
+        self.assertEqual(self.bus.num_subscribers(), 0)
+
+    def test_subscribers_are_capped(self):
+        """
+        Test that no subscription is made past max_subscribers, until one leaves.
+        """
+        bus = EventBus(max_subscribers = 2)
+        first = bus.subscribe()
+        self.assertIsNotNone(bus.subscribe({1}))
+        self.assertIsNone(bus.subscribe())
+
+        bus.unsubscribe(first)
+        self.assertIsNotNone(bus.subscribe())
+
+    def test_drain_returns_queued_events(self):
+        """
+        Test that the events queued before an overflow can still be taken.
+        """
+        subscription = self.bus.subscribe()
+        for job_id in range(3):
+            self.bus.publish({'job_id': job_id, 'status': 'done'})
+
+        self.assertEqual([event['job_id'] for event in subscription.drain()], [0, 1])
+        self.assertEqual(subscription.drain(), [])
+
+    def test_format_event_inlines_small_results(self):
+        """
+        Test that only results under the size threshold are embedded.
+        """
+        job_info = {'job_id': 7, 'status': 'done', 'endpoint': 'global_mean'}
+        event = job_event(job_info, '{"global_mean": 32.92}')
+
+        message = format_event(event, inline_bytes = 100)
+        self.assertTrue(message.startswith('id: 7\nevent: done\ndata: '))
+        data = json.loads(message.split('data: ')[1])
+        self.assertEqual(data['data'], {'global_mean': 32.92})
+
+        data = json.loads(format_event(event, inline_bytes = 10).split('data: ')[1])
+        self.assertNotIn('data', data)
+
+
+if __name__ == '__main__':
+    unittest.main()
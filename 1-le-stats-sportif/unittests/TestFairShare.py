@@ -0,0 +1,126 @@
+import time
+import unittest
+from queue import Empty
+from app.fair_share import OTHER, SWEEP_SECONDS, FairQueue, RateLimiter
+
+
+class TestFairShare(unittest.TestCase):
+    """
+    Test cases for the rate limiter and the fair queue.
+    """
+
+    def test_client_rate_limit(self):
+        """
+        Test that a client is throttled after its burst, without affecting the others.
+        """
+        limiter = RateLimiter(client_rate=5, burst_seconds=1.0)
+        allowed = [limiter.acquire('a', 'best5') == 0.0 for _ in range(8)]
+        self.assertEqual(allowed.count(True), 5)
+        self.assertGreater(limiter.acquire('a', 'best5'), 0.0)
+        self.assertEqual(limiter.acquire('b', 'best5'), 0.0)
+
+        stats = limiter.stats()
+        self.assertEqual(stats['a']['requests'], 9)
+        self.assertEqual(stats['a']['throttled'], 4)
+        self.assertEqual(stats['a']['endpoints'], {'best5': 9})
+
+    def test_endpoint_rate_limit(self):
+        """
+        Test that an endpoint limit only throttles that endpoint.
+        """
+        limiter = RateLimiter(endpoint_rates={'mean_by_category': 100})
+        limiter.burst_seconds = 0.02
+        self.assertEqual(limiter.acquire('a', 'mean_by_category'), 0.0)
+        self.assertEqual(limiter.acquire('a', 'mean_by_category'), 0.0)
+        self.assertGreater(limiter.acquire('a', 'mean_by_category'), 0.0)
+        self.assertEqual(limiter.acquire('a', 'best5'), 0.0)
+
+        time.sleep(0.02)
+        self.assertEqual(limiter.acquire('a', 'mean_by_category'), 0.0)
+
+    def test_rate_limiter_forgets_idle_clients(self):
+        """
+        Test that the sweep drops the clients whose buckets are full again.
+        """
+        limiter = RateLimiter(client_rate=1000, burst_seconds=0.001)
+        limiter.idle_seconds = 0.0
+        limiter.acquire('a', 'best5')
+        self.assertEqual(limiter.acquire('b', 'best5'), 0.0)
+
+        time.sleep(0.01)
+        limiter.swept -= SWEEP_SECONDS
+        limiter.acquire('c', 'best5')
+        self.assertEqual(list(limiter.stats()), ['c'])
+        self.assertEqual(list(limiter.buckets), ['c'])
+
+    def test_rate_limiter_caps_clients(self):
+        """
+        Test that the clients over max_clients share the limits of OTHER.
+        """
+        limiter = RateLimiter(client_rate=5, max_clients=2)
+        for client in ('a', 'b', 'c', 'd'):
+            limiter.acquire(client, 'best5')
+        self.assertEqual(limiter.stats()[OTHER]['requests'], 2)
+        self.assertEqual(set(limiter.buckets), {'a', 'b', OTHER})
+
+    def test_fair_queue_forgets_idle_clients(self):
+        """
+        Test that the sweep drops the clients without queued jobs, and caps the others.
+        """
+        queue = FairQueue(max_clients=2)
+        queue.idle_seconds = 0.0
+        queue.put({'job_id': 0, 'client': 'a'})
+        queue.put({'job_id': 1, 'client': 'b'})
+        queue.put({'job_id': 2, 'client': 'c'})
+        self.assertEqual(queue.stats()[OTHER]['queued'], 1)
+
+        self.assertEqual(queue.get(timeout=0)['job_id'], 0)
+        queue.swept -= SWEEP_SECONDS
+        queue.put({'job_id': 3, 'client': 'd'})
+        self.assertEqual(set(queue.stats()), {'b', OTHER})
+        self.assertEqual([queue.get(timeout=0)['job_id'] for _ in range(3)], [1, 2, 3])
+
+    def test_fair_queue_interleaves_clients(self):
+        """
+        Test that a single job is not stuck behind the backlog of another client.
+        """
+        queue = FairQueue()
+        for job_id in range(10):
+            queue.put({'job_id': job_id, 'client': 'spammer'})
+        queue.put({'job_id': 10, 'client': 'polite'})
+
+        served = [queue.get(timeout=0)['job_id'] for _ in range(3)]
+        self.assertIn(10, served[:2])
+        self.assertEqual(queue.stats()['polite'], {'queued': 0, 'served': 1, 'weight': 1.0})
+
+    def test_fair_queue_weights(self):
+        """
+        Test that busy clients are served in proportion to their weights.
+        """
+        queue = FairQueue({'gold': 3.0})
+        for job_id in range(40):
+            queue.put({'job_id': job_id, 'client': 'gold'})
+            queue.put({'job_id': job_id, 'client': 'basic'})
+
+        served = [queue.get(timeout=0)['client'] for _ in range(40)]
+        self.assertEqual(served.count('gold'), 30)
+        self.assertEqual(queue.qsize(), 40)
+
+    def test_fair_queue_rejects_non_positive_weights(self):
+        """
+        Test that a weight of 0 or less is refused when the queue is configured.
+        """
+        for weight in (0.0, -1.0, float('nan')):
+            with self.assertRaises(ValueError):
+                FairQueue({'gold': weight})
+
+    def test_fair_queue_empty(self):
+        """
+        Test that get on an empty queue raises Empty after its timeout.
+        """
+        with self.assertRaises(Empty):
+            FairQueue().get(timeout=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
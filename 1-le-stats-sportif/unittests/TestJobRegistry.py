@@ -0,0 +1,119 @@
+import unittest
+from threading import Thread
+from app.job_registry import JobRegistry
+
+class TestJobRegistry(unittest.TestCase):
+    """
+    Test cases for the job registry module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.registry = JobRegistry(num_stripes = 4)
+
+    def add_job(self):
+        """
+        Register a new job with a freshly allocated ID.
+        """
+        job_info = {'job_id': self.registry.allocate_id(), 'status': 'running'}
+        self.registry.add(job_info)
+        return job_info
+
+    def test_concurrent_id_allocation(self):
+        """
+        Test that IDs allocated from many threads are unique.
+        """
+        allocated = []
+        def allocate():
+            allocated.extend(self.registry.allocate_id() for _ in range(1000))
+
+        threads = [Thread(target = allocate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(allocated), list(range(1, 8001)))
+
+    def test_interleaved_ids_use_every_stripe(self):
+        """
+        Test that the IDs of an interleaved process are spread evenly over the stripes.
+        """
+        registry = JobRegistry(num_stripes = 16)
+        registry.interleave(3, 8)
+        for _ in range(160):
+            registry.add({'job_id': registry.allocate_id(), 'status': 'running'})
+
+        self.assertEqual([len(stripe.jobs) for stripe in registry.stripes], [10] * 16)
+        self.assertIsNone(registry.get(None))
+
+    def test_counters_follow_state_changes(self):
+        """
+        Test that the per-state counters are kept up to date.
+        """
+        done, failed, cancelled, running = [self.add_job() for _ in range(4)]
+        self.add_job()
+        for job_info in (done, failed, running):
+            self.assertTrue(self.registry.start(job_info))
+        self.registry.finish(done, 'done')
+        self.registry.finish(failed, 'error')
+        self.assertTrue(self.registry.cancel(cancelled))
+
+        self.assertEqual(self.registry.counts(), {'queued': 1, 'running': 1, 'done': 1,
+                                                  'error': 1, 'cancelled': 1})
+        self.assertEqual(done['status'], 'done')
+        self.assertEqual(len(self.registry), 5)
+
+    def test_cancelled_job_is_not_started(self):
+        """
+        Test that a worker cannot start a cancelled job, nor cancel a started one.
+        """
+        cancelled, started = self.add_job(), self.add_job()
+        self.assertTrue(self.registry.cancel(cancelled))
+        self.assertFalse(self.registry.start(cancelled))
+
+        self.assertTrue(self.registry.start(started))
+        self.assertFalse(self.registry.cancel(started))
+
+    def test_lookup(self):
+        """
+        Test the dictionary-like lookup of jobs.
+        """
+        jobs = [self.add_job() for _ in range(10)]
+
+        self.assertIn(3, self.registry)
+        self.assertNotIn(11, self.registry)
+        self.assertIs(self.registry[5], jobs[4])
+        self.assertIsNone(self.registry.get(42))
+        self.assertEqual([job_id for job_id, _ in self.registry.items()], list(range(1, 11)))
+
+    def test_scan_pages(self):
+        """
+        Test cursor pagination and filtering of the jobs.
+        """
+        jobs = [self.add_job() for _ in range(10)]
+        for job_info in jobs[::2]:
+            self.registry.start(job_info)
+            self.registry.finish(job_info, 'done')
+
+        page, cursor = self.registry.scan(0, 4)
+        self.assertEqual([job_info['job_id'] for job_info in page], [1, 2, 3, 4])
+        self.assertEqual(cursor, 4)
+
+        page, cursor = self.registry.scan(cursor, 10)
+        self.assertEqual([job_info['job_id'] for job_info in page], [5, 6, 7, 8, 9, 10])
+        self.assertIsNone(cursor)
+
+        page, cursor = self.registry.scan(0, 2, lambda job_info: job_info['status'] == 'done')
+        self.assertEqual([job_info['job_id'] for job_info in page], [1, 3])
+        self.assertEqual(cursor, 3)
+
+        page, cursor = self.registry.scan(0, 10, lambda job_info: False, max_scan = 5)
+        self.assertEqual(page, [])
+        self.assertEqual(cursor, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import logging
+import sys
+import time
+import unittest
+from queue import Queue
+from app.log_pipeline import RateLimitFilter, JsonFormatter, StructuredQueueHandler, \
+    parse_sample_rates
+
+class TestLogPipeline(unittest.TestCase):
+    """
+    Test cases for the log pipeline module.
+    """
+
+    def make_record(self, msg, level = logging.INFO, args = ()):
+        """
+        Create a log record of the webserver logger.
+        """
+        return logging.LogRecord('app', level, __file__, 1, msg, args, None)
+
+    def test_parse_sample_rates(self):
+        """
+        Test the parsing of the per-route sampling rates.
+        """
+        rates = parse_sample_rates('/api/get_results=0.1, /api/num_jobs=0')
+        self.assertEqual(rates, {'/api/get_results': 0.1, '/api/num_jobs': 0.0})
+        self.assertEqual(parse_sample_rates(''), {})
+
+    def test_rate_limit(self):
+        """
+        Test that identical lines are dropped after the burst.
+        """
+        rate_limit = RateLimitFilter(burst = 3, interval = 60.0)
+        passed = [rate_limit.filter(self.make_record("Job %s is %s", args = (i, 'done')))
+                  for i in range(10)]
+        self.assertEqual(passed, [True] * 3 + [False] * 7)
+        self.assertTrue(rate_limit.filter(self.make_record("Another line")))
+
+    def test_rate_limit_reports_suppressed_lines(self):
+        """
+        Test that the first line of a new interval counts the dropped ones.
+        """
+        rate_limit = RateLimitFilter(burst = 1, interval = 0.05)
+        passed = [rate_limit.filter(self.make_record("Job is done")) for _ in range(4)]
+        self.assertEqual(passed, [True, False, False, False])
+
+        time.sleep(0.06)
+        record = self.make_record("Job is done")
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.suppressed, 3)
+
+    def test_json_formatter(self):
+        """
+        Test that records are formatted as single line JSON objects.
+        """
+        formatter = JsonFormatter(max_length = 10)
+        line = formatter.format(self.make_record("Received %s", args = ('x' * 100,)))
+        self.assertNotIn('\n', line)
+
+        fields = json.loads(line)
+        self.assertEqual(fields['level'], 'INFO')
+        self.assertEqual(fields['msg'], 'Received x...')
+        self.assertTrue(fields['ts'].endswith('Z'))
+
+    def test_queued_records_keep_their_traceback(self):
+        """
+        Test that the traceback of a queued record ends up in its 'exc' field.
+        """
+        log_queue = Queue()
+        handler = StructuredQueueHandler(log_queue)
+        try:
+            raise ValueError('bad question')
+        except ValueError:
+            handler.handle(logging.LogRecord('app', logging.ERROR, __file__, 1, "Job %s failed",
+                                             (7,), sys.exc_info()))
+
+        fields = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+        self.assertEqual(fields['msg'], 'Job 7 failed')
+        self.assertIn('ValueError: bad question', fields['exc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import tracemalloc
+import unittest
+from app.data_ingestor import DataIngestor
+from app.job_registry import JobRegistry
+from app.memory import AllocationTracker, dataframe_memory, deep_size, jobs_memory, \
+    memory_report
+from app.task_runner import ThreadPool
+
+QUESTION = 'Percent of adults who engage in no leisure-time physical activity'
+
+
+class TestMemory(unittest.TestCase):
+    """
+    Test cases for the memory accounting.
+    """
+
+    def test_deep_size_follows_closures(self):
+        """
+        Test that the size of a task includes the data retained by its closure.
+        """
+        data = {'question': 'x' * 10000}
+        def task():
+            return data['question']
+
+        self.assertGreater(deep_size(task, set()), 10000)
+        self.assertLess(deep_size(task, set(), exclude=(data,)), 10000)
+
+    def test_deep_size_counts_shared_objects_once(self):
+        """
+        Test that an object referenced twice is only measured once.
+        """
+        payload = 'y' * 10000
+        self.assertLess(deep_size([payload, payload], set()), 20000)
+
+    def test_dataframe_memory(self):
+        """
+        Test that every column of the dataset is measured, biggest first.
+        """
+        df = DataIngestor('./test.csv').df
+        memory = dataframe_memory(df)
+
+        self.assertEqual(memory['rows'], len(df))
+        self.assertEqual({column['column'] for column in memory['columns']},
+                         set(df.columns) | {'Index'})
+        self.assertEqual(memory['bytes'], sum(column['bytes'] for column in memory['columns']))
+        sizes = [column['bytes'] for column in memory['columns']]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+    def test_jobs_memory_is_estimated_from_a_sample(self):
+        """
+        Test that the size of a big job table is extrapolated from a sample.
+        """
+        jobs = JobRegistry()
+        for _ in range(3000):
+            job_id = jobs.allocate_id()
+            data = {'question': str(job_id) * 100}
+            jobs.add({'job_id': job_id, 'task': lambda data=data: data})
+
+        memory = jobs_memory(jobs)
+        self.assertEqual(memory['jobs'], 3000)
+        self.assertLessEqual(memory['sampled'], 1000)
+        self.assertGreater(memory['closure_bytes'], 3000 * 300)
+        self.assertGreater(memory['bytes'], memory['closure_bytes'])
+
+    def test_report_sizes_the_caches(self):
+        """
+        Test that the report sizes the caches of the dataset as they are built.
+        """
+        data_ingestor = DataIngestor('./test.csv')
+        before = memory_report(ThreadPool(), data_ingestor, deep=False)['caches']
+        self.assertEqual(set(before), {'query_engine', 'sample', 'pivot', 'trends', 'total'})
+
+        data_ingestor.query({'filters': {'question': QUESTION}})
+        data_ingestor.states_mean(QUESTION, True)
+        data_ingestor.correlation()
+        data_ingestor.trend(QUESTION)
+        after = memory_report(ThreadPool(), data_ingestor, deep=False)['caches']
+
+        for name in ('query_engine', 'sample', 'pivot', 'trends'):
+            self.assertGreater(after[name], before[name], name)
+        # The dataset itself is not counted in its caches
+        self.assertLess(after['total'], 10 * data_ingestor.df.memory_usage(deep=True).sum())
+        self.assertEqual(after['total'], sum(after[name] for name in after if name != 'total'))
+
+    def test_allocation_tracker(self):
+        """
+        Test that a traced allocation shows up in the growth between two reports.
+        """
+        tracker = AllocationTracker()
+        self.assertFalse(tracker.report()['tracing'])
+        tracker.start()
+        try:
+            tracker.report()
+            retained = [bytearray(100000) for _ in range(10)]
+            report = tracker.report(top=5)
+        finally:
+            tracker.stop()
+
+        self.assertTrue(report['tracing'])
+        self.assertGreaterEqual(report['traced_bytes'], 1000000)
+        self.assertIn('TestMemory.py', report['growth'][0]['location'])
+        self.assertGreaterEqual(report['growth'][0]['bytes'], 1000000)
+        self.assertEqual(len(retained), 10)
+        self.assertFalse(tracemalloc.is_tracing())
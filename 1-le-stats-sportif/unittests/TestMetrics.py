@@ -0,0 +1,63 @@
+import unittest
+from app.metrics import Histogram, Metrics
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test cases for the metrics module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.metrics = Metrics()
+
+    def test_histogram_quantiles(self):
+        """
+        Test that quantiles are estimated inside the right bucket.
+        """
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.004)
+        for _ in range(10):
+            histogram.observe(0.2)
+
+        self.assertTrue(0.0025 <= histogram.quantile(0.5) <= 0.005)
+        self.assertTrue(0.1 <= histogram.quantile(0.99) <= 0.25)
+        self.assertEqual(histogram.count, 100)
+
+    def test_empty_histogram_quantile(self):
+        """
+        Test the quantile of a histogram without observations.
+        """
+        self.assertEqual(Histogram().quantile(0.95), 0.0)
+
+    def test_record_job(self):
+        """
+        Test that a job's timestamps are split into phases.
+        """
+        timestamps = {'submitted': 0.0, 'started': 0.01, 'computed': 0.03,
+                      'serialized': 0.031, 'finished': 0.032}
+        self.metrics.record_job('states_mean', 'done', timestamps)
+
+        self.assertEqual(self.metrics.jobs_total, {('states_mean', 'done'): 1})
+        self.assertEqual(self.metrics.phases[('states_mean', 'compute')].count, 1)
+        self.assertAlmostEqual(self.metrics.phases[('states_mean', 'queue_wait')].sum, 0.01)
+        self.assertAlmostEqual(self.metrics.busy_seconds, 0.022)
+
+    def test_render_prometheus_format(self):
+        """
+        Test the Prometheus text exposition of the metrics.
+        """
+        timestamps = {'submitted': 0.0, 'started': 0.0, 'finished': 0.5}
+        self.metrics.record_job('best5', 'error', timestamps)
+        text = self.metrics.render(queue_depth = 3, num_threads = 2)
+
+        self.assertIn('lestats_jobs_total{endpoint="best5",status="error"} 1', text)
+        self.assertIn('lestats_job_latency_seconds_count{endpoint="best5"} 1', text)
+        self.assertIn('lestats_queue_depth 3', text)
+        self.assertTrue(text.endswith('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from threading import Event, Thread
+from app.profiler import ProfileSession, SamplingProfiler
+
+
+def spin(stopped):
+    """
+    Keep a thread busy until stopped.
+    """
+    total = 0
+    while not stopped.is_set():
+        total += sum(range(100))
+    return total
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    Test cases for the sampling profiler.
+    """
+
+    def setUp(self):
+        self.stopped = Event()
+        self.busy = Thread(target=spin, args=(self.stopped,), name='Busy')
+        self.busy.start()
+
+    def tearDown(self):
+        self.stopped.set()
+        self.busy.join()
+
+    def test_busy_thread_is_sampled(self):
+        """
+        Test that the stats show the busy thread and its hot function.
+        """
+        stats = SamplingProfiler(interval=0.001).run(0.2).stats()
+        self.assertGreater(stats['samples'], 0)
+        self.assertIn('Busy', stats['threads'])
+        self.assertIn('spin', ' '.join(item['function'] for item in stats['top_total']))
+
+    def test_collapsed_stacks(self):
+        """
+        Test that collapsed stacks start with the thread name and end with a count.
+        """
+        collapsed = SamplingProfiler(interval=0.001).run(0.1).collapsed()
+        lines = [line for line in collapsed.splitlines() if line.startswith('Busy;')]
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('spin (' in line for line in lines))
+
+    def test_one_profile_at_a_time(self):
+        """
+        Test that a profile requested while another one runs is refused.
+        """
+        session = ProfileSession()
+        results = []
+        first = Thread(target=lambda: results.append(session.profile(0.3)))
+        first.start()
+        while not session.lock.locked():
+            pass
+        self.assertIsNone(session.profile(0.1))
+        first.join()
+        self.assertIsInstance(results[0], SamplingProfiler)
+        self.assertIsNotNone(session.profile(0.01))
@@ -0,0 +1,90 @@
+import unittest
+from app.data_ingestor import DataIngestor
+from app.query import parse_query
+
+MUSCLE = ('Percent of adults who engage in muscle-strengthening activities on 2 or more '
+          'days a week')
+
+
+class TestQuery(unittest.TestCase):
+    """
+    Test cases for the declarative queries and their planner.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.data_ingestor = DataIngestor('./test.csv')
+
+    def test_invalid_specs(self):
+        """
+        Test that malformed queries are rejected with a reason.
+        """
+        for spec in ([], {'filters': {'county': 'x'}}, {'group_by': ['state', 'state']},
+                     {'aggregates': ['mode']}, {'filters': {'year': 'last'}},
+                     {'filters': {'state': []}}, {'limit': 3}):
+            with self.assertRaises(ValueError):
+                parse_query(spec)
+
+    def test_group_by_matches_states_mean(self):
+        """
+        Test that a query grouped by state gives the same means as states_mean.
+        """
+        rows = self.data_ingestor.query({'filters': {'question': MUSCLE},
+                                         'group_by': ['state']})['rows']
+        expected = self.data_ingestor.states_mean(MUSCLE)
+        self.assertEqual({row['state']: row['mean'] for row in rows},
+                         {state: float(value) for state, value in expected.items()})
+
+    def test_cube_and_scan_agree(self):
+        """
+        Test that the cube and the scans compute the same aggregates.
+        """
+        spec = {'filters': {'year': [2013, 2017, 2019]}, 'group_by': ['year'],
+                'aggregates': ['mean', 'count', 'sum', 'min', 'max']}
+        from_cube = self.data_ingestor.query(spec)['rows']
+        scanned = self.data_ingestor.query(dict(spec, aggregates=spec['aggregates'] +
+                                                ['median']))['rows']
+
+        self.assertEqual([row['year'] for row in from_cube], [2013, 2017, 2019])
+        for cube_row, scan_row in zip(from_cube, scanned):
+            for name in spec['aggregates']:
+                self.assertAlmostEqual(cube_row[name], scan_row[name])
+        self.assertEqual(sum(row['count'] for row in from_cube), 9)
+
+    def test_planner_strategies(self):
+        """
+        Test that the planner prefers the cube, then the question partitions.
+        """
+        def strategy(spec):
+            return self.data_ingestor.query(dict(spec, explain=True))['plan']['strategy']
+
+        self.assertEqual(strategy({'filters': {'question': MUSCLE}}), 'cube')
+        self.assertEqual(strategy({'filters': {'question': MUSCLE},
+                                   'aggregates': ['median']}), 'partition_scan')
+        self.assertEqual(strategy({'aggregates': ['median']}), 'full_scan')
+
+    def test_explain(self):
+        """
+        Test that an explained query returns its plan and cost instead of rows.
+        """
+        result = self.data_ingestor.query({'filters': {'question': MUSCLE, 'state': 'Ohio'},
+                                           'aggregates': ['std'], 'explain': True})
+
+        self.assertNotIn('rows', result)
+        plan = result['plan']
+        self.assertEqual(plan['estimated_rows'], 5)
+        self.assertEqual(plan['candidates'], {'partition_scan': 5, 'full_scan': 12})
+        self.assertIn("filter state in ['Ohio']", plan['steps'])
+
+    def test_empty_result(self):
+        """
+        Test the aggregates of a query matching no rows.
+        """
+        result = self.data_ingestor.query({'filters': {'state': 'Atlantis'},
+                                           'aggregates': ['mean', 'count']})
+        self.assertEqual(result['rows'], [{'mean': None, 'count': 0}])
+        result = self.data_ingestor.query({'filters': {'state': 'Atlantis'},
+                                           'group_by': ['year']})
+        self.assertEqual(result['rows'], [])
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import unittest
+from app.result_store import FileResultStore, MemoryResultStore
+
+class TestResultStore(unittest.TestCase):
+    """
+    Test cases for the result store module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file_store = FileResultStore(self.tmpdir.name)
+        self.store = MemoryResultStore(max_entries = 2, spill_bytes = 32,
+                                       spill_store = self.file_store)
+
+    def tearDown(self):
+        """
+        Tear down the test case.
+        """
+        self.tmpdir.cleanup()
+
+    def test_file_store_roundtrip(self):
+        """
+        Test that the file store keeps one file per job.
+        """
+        self.file_store.put(7, '{"global_mean": 32.92}')
+
+        self.assertEqual(self.file_store.get(7), '{"global_mean": 32.92}')
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, '7')))
+        self.assertIsNone(self.file_store.get(8))
+
+    def test_small_results_stay_in_memory(self):
+        """
+        Test that small results are served from memory.
+        """
+        self.store.put(1, '{"Ohio": 29.4}')
+
+        self.assertEqual(self.store.get(1), '{"Ohio": 29.4}')
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, '1')))
+        self.assertEqual(self.store.stats()['entries'], 1)
+
+    def test_large_results_are_spilled(self):
+        """
+        Test that results over the size threshold go straight to disk.
+        """
+        payload = '{"Vermont": {"(\'Education\', \'Less than high school\')": 37.9}}'
+        self.store.put(1, payload)
+
+        self.assertEqual(self.store.stats()['entries'], 0)
+        self.assertEqual(self.store.get(1), payload)
+
+    def test_least_recently_used_results_are_spilled(self):
+        """
+        Test that the coldest result is moved to disk when the store is full.
+        """
+        self.store.put(1, '{"a": 1}')
+        self.store.put(2, '{"b": 2}')
+        self.store.get(1)
+        self.store.put(3, '{"c": 3}')
+
+        self.assertEqual(list(self.store.entries), [1, 3])
+        self.assertEqual(self.store.get(2), '{"b": 2}')
+        self.assertEqual(self.store.stats()['spilled'], 1)
+
+    def test_store_is_bounded_in_bytes(self):
+        """
+        Test that results are moved to disk when the memory holds too many bytes.
+        """
+        store = MemoryResultStore(max_entries = 100, spill_bytes = 32,
+                                  spill_store = self.file_store, max_bytes = 20)
+        store.put(1, '{"a": 1}')
+        store.put(2, '{"b": 2}')
+        store.put(3, '{"c": 3}')
+
+        self.assertEqual(list(store.entries), [2, 3])
+        self.assertEqual(store.stats()['bytes'], 16)
+        self.assertEqual(store.get(1), '{"a": 1}')
+
+    def test_spilled_results_stay_readable(self):
+        """
+        Test that a result being written to disk is served, without holding the store.
+        """
+        writing = threading.Event()
+        release = threading.Event()
+        file_store = self.file_store
+
+        class SlowStore:
+            """Spill store whose writes block until released."""
+            def put(self, job_id, payload):
+                """Block, then write the result."""
+                writing.set()
+                release.wait(5)
+                file_store.put(job_id, payload)
+
+            def get(self, job_id):
+                """Read a written result."""
+                return file_store.get(job_id)
+
+        store = MemoryResultStore(max_entries = 1, spill_bytes = 32, spill_store = SlowStore())
+        store.put(1, '{"a": 1}')
+        spiller = threading.Thread(target = store.put, args = (2, '{"b": 2}'))
+        spiller.start()
+        try:
+            self.assertTrue(writing.wait(5))
+            self.assertEqual(store.get(1), '{"a": 1}')
+            self.assertEqual(store.get(2), '{"b": 2}')
+        finally:
+            release.set()
+            spiller.join()
+
+        self.assertEqual(store.spilling, {})
+        self.assertEqual(file_store.get(1), '{"a": 1}')
+        self.assertEqual(store.stats()['spilled'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
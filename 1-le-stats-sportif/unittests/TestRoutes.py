@@ -0,0 +1,217 @@
+import json
+import os
+import tempfile
+import unittest
+from app import routes, webserver
+from app.events import MAX_SUBSCRIBERS
+from app.routes import MAX_BULK_SIZE
+from app.shared_store import SqliteJobStore
+from app.task_runner import new_job
+
+OBESITY = 'Percent of adults aged 18 years and older who have obesity'
+
+
+class TestRoutes(unittest.TestCase):
+    """
+    Test cases for the routes of the webserver.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.client = webserver.test_client()
+
+    def test_batch_creates_jobs(self):
+        """
+        Test that a batch creates a job per valid query and rejects the others.
+        """
+        response = self.client.post('/api/batch', json=[
+            {'endpoint': 'state_mean', 'question': OBESITY, 'state': 'Ohio'},
+            {'endpoint': 'state_mean', 'question': OBESITY},
+            {'endpoint': 'missing'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        jobs = response.json['jobs']
+        self.assertIn('job_id', jobs[0])
+        self.assertEqual(jobs[1], {'status': 'error', 'reason': 'Missing parameter: state'})
+        self.assertEqual(jobs[2], {'status': 'error', 'reason': 'Unknown endpoint'})
+
+    def test_batch_rejects_malformed_bodies(self):
+        """
+        Test that a batch which is not a list of queries, or too long, is a bad request.
+        """
+        for body in ({'queries': 'state_mean'}, {'queries': 3}, 'state_mean',
+                     [{}] * (MAX_BULK_SIZE + 1)):
+            response = self.client.post('/api/batch', json=body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(response.json['status'], 'error')
+
+    def test_bulk_results(self):
+        """
+        Test that the results of many jobs are returned in the requested order.
+        """
+        job_ids = [job['job_id'] for job in self.client.post('/api/batch', json=[
+            {'endpoint': 'states_mean', 'question': OBESITY},
+            {'endpoint': 'state_mean', 'question': OBESITY, 'state': 'Ohio'},
+        ]).json['jobs']]
+
+        response = self.client.post('/api/get_results_bulk?wait=10',
+                                    json={'job_ids': job_ids + ['x']})
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+        self.assertEqual([result['job_id'] for result in results], job_ids + [None])
+        self.assertEqual([result['result']['status'] for result in results],
+                         ['done', 'done', 'error'])
+        self.assertIn('Ohio', results[1]['result']['data'])
+
+        query = ','.join(str(job_id) for job_id in job_ids)
+        response = self.client.get(f'/api/get_results_bulk?job_ids={query}')
+        self.assertEqual(response.json['results'], results[:2])
+
+    def test_bulk_rejects_malformed_bodies(self):
+        """
+        Test that a body without a list of job IDs, or too many of them, is a bad request.
+        """
+        for body in ([1, 2], {'job_ids': '12'}, {'job_ids': [[1]]}, {'job_ids': [True]},
+                     {'job_ids': list(range(MAX_BULK_SIZE + 1))}):
+            response = self.client.post('/api/get_results_bulk', json=body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(response.json['status'], 'error')
+
+        query = ','.join(['1'] * (MAX_BULK_SIZE + 1))
+        response = self.client.get(f'/api/get_results_bulk?job_ids={query}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_events_report_overflow(self):
+        """
+        Test that a stream whose subscription overflows sends its queued events, then says so.
+        """
+        events = webserver.tasks_runner.events
+        events.max_pending = 2
+        # The test client reads the first message of the stream, a keep-alive
+        heartbeat, routes.SSE_HEARTBEAT = routes.SSE_HEARTBEAT, 0.01
+        try:
+            response = self.client.get('/api/events')
+            for job_id in (900001, 900002, 900003):
+                events.publish({'job_id': job_id, 'status': 'done'})
+            messages = [message for message in b''.join(response.response).decode().split('\n\n')
+                        if message and not message.startswith(':')]
+        finally:
+            events.max_pending = 1000
+            routes.SSE_HEARTBEAT = heartbeat
+
+        # The queue held 2 events when the third one overflowed it
+        self.assertEqual(len(messages), 3)
+        self.assertEqual([message[:4] for message in messages[:2]], ['id: '] * 2)
+        self.assertTrue(messages[2].startswith('event: overflow\n'))
+        self.assertIsNone(json.loads(messages[2].split('data: ')[1])['pending'])
+        self.assertEqual(events.num_subscribers(), 0)
+
+    def test_events_are_capped(self):
+        """
+        Test that streams past the subscriber cap are refused with a 503.
+        """
+        events = webserver.tasks_runner.events
+        events.max_subscribers = 0
+        try:
+            response = self.client.get('/api/events')
+        finally:
+            events.max_subscribers = MAX_SUBSCRIBERS
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_jobs_of_other_processes(self):
+        """
+        Test that events, cancel and num_jobs see the jobs owned by another server process.
+        """
+        pool = webserver.tasks_runner
+        heartbeat, routes.SSE_HEARTBEAT = routes.SSE_HEARTBEAT, 0.01
+        poll, routes.SSE_REMOTE_POLL_INTERVAL = routes.SSE_REMOTE_POLL_INTERVAL, 0.01
+        with tempfile.TemporaryDirectory() as directory:
+            # Job 900101 was submitted to another process
+            other = SqliteJobStore(os.path.join(directory, 'jobs.db'))
+            job_info = new_job(900101, lambda: {}, 'states_mean')
+            other.add(job_info)
+            pool.shared_jobs = SqliteJobStore(other.path)
+            try:
+                self.assertEqual(self.client.get('/api/num_jobs').json['num_jobs'], 1)
+                self.assertEqual(self.client.post('/api/cancel/900101').json['reason'],
+                                 'Job owned by another server process')
+                self.assertEqual(self.client.post('/api/cancel/900102').json['reason'],
+                                 'Invalid job_id')
+
+                response = self.client.get('/api/events?job_ids=900101')
+                job_info['status'] = 'error'
+                job_info['reason'] = 'Failed'
+                other.finish(job_info)
+                messages = [message for message in
+                            b''.join(response.response).decode().split('\n\n')
+                            if message and not message.startswith(':')]
+                self.assertEqual(self.client.get('/api/num_jobs').json['num_jobs'], 0)
+            finally:
+                pool.shared_jobs = None
+                routes.SSE_HEARTBEAT = heartbeat
+                routes.SSE_REMOTE_POLL_INTERVAL = poll
+
+        self.assertEqual(len(messages), 1)
+        event = json.loads(messages[0].split('data: ')[1])
+        self.assertEqual((event['job_id'], event['status']), (900101, 'error'))
+
+    def test_unread_event_stream_is_released(self):
+        """
+        Test that a stream closed before its body is read frees its subscription.
+        """
+        events = webserver.tasks_runner.events
+        with webserver.test_request_context('/api/events'):
+            response = routes.events()
+        self.assertEqual(events.num_subscribers(), 1)
+        response.close()
+        self.assertEqual(events.num_subscribers(), 0)
+
+    def sync_request(self, body, max_cost=float('inf')):
+        """
+        Send a synchronous state_mean request with a given cost threshold.
+        """
+        sync_max_cost, routes.SYNC_MAX_COST = routes.SYNC_MAX_COST, max_cost
+        try:
+            return self.client.post('/api/state_mean?sync=1', json=body)
+        finally:
+            routes.SYNC_MAX_COST = sync_max_cost
+
+    def test_sync_request_returns_the_result(self):
+        """
+        Test that a cheap synchronous request is answered with its result and job ID.
+        """
+        response = self.sync_request({'question': OBESITY, 'state': 'Ohio'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'done')
+        self.assertIn('Ohio', response.json['data'])
+        self.assertEqual(self.client.get(f"/api/get_results/{response.json['job_id']}").json,
+                         {'status': 'done', 'data': response.json['data']})
+
+    def test_sync_request_reports_errors(self):
+        """
+        Test that a failed synchronous request is answered with its reason and job ID.
+        """
+        response = self.sync_request({'question': OBESITY, 'state': 'Atlantis'})
+        self.assertEqual(response.json['status'], 'error')
+        self.assertIn('Atlantis', response.json['reason'])
+        self.assertIsInstance(response.json['job_id'], int)
+
+    def test_sync_request_falls_back_to_the_queue(self):
+        """
+        Test that an expensive request, or one on a dataset not loaded, is only queued.
+        """
+        webserver.datasets.register('sync_copy', './test.csv')
+        for body, max_cost in (({'question': OBESITY, 'state': 'Ohio'}, 0.0),
+                               ({'question': OBESITY, 'state': 'Ohio',
+                                 'dataset': 'sync_copy'}, float('inf'))):
+            response = self.sync_request(body, max_cost)
+            self.assertEqual(list(response.json), ['job_id'])
+            result = self.client.get(f"/api/get_results/{response.json['job_id']}?wait=10").json
+            self.assertEqual(result['status'], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
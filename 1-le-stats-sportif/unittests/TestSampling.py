@@ -0,0 +1,117 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app.data_ingestor import DataIngestor
+from app.sampling import StratifiedSample, interval, parse_approx
+
+QUESTION = 'Percent of adults who engage in no leisure-time physical activity'
+
+
+def synthetic(rows_per_state=400, seed=0):
+    """
+    Build a dataset with two states and two stratifications of known means.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for state, mean in (('Ohio', 30.0), ('Texas', 20.0)):
+        for stratification in ('Male', 'Female'):
+            parts.append(pd.DataFrame({
+                'Question': QUESTION,
+                'LocationDesc': state,
+                'StratificationCategory1': 'Gender',
+                'Stratification1': stratification,
+                'Data_Value': rng.normal(mean, 5.0, rows_per_state // 2),
+            }))
+    return pd.concat(parts, ignore_index=True)
+
+
+class TestSampling(unittest.TestCase):
+    """
+    Test cases for the approximate answers.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.df = synthetic()
+        self.sample = StratifiedSample(self.df, [], size=128)
+
+    def test_parse_approx(self):
+        """
+        Test the accepted forms of the approx parameter.
+        """
+        self.assertEqual(parse_approx(True), {'error': None, 'time_ms': None})
+        self.assertEqual(parse_approx({'error': 0.5}), {'error': 0.5, 'time_ms': None})
+        for approx in ('yes', {'error': -1}, {'rows': 10}, {'time_ms': 'fast'}):
+            with self.assertRaises(ValueError):
+                parse_approx(approx)
+
+    def test_interval(self):
+        """
+        Test the confidence interval of a sample mean.
+        """
+        self.assertEqual(interval(10.0, 4.0, 100, 100), 0.0)
+        self.assertAlmostEqual(interval(10.0, 4.0, 100, 10 ** 9), 1.96 * 0.2, places=6)
+        self.assertEqual(interval(10.0, float('nan'), 1, 100), float('inf'))
+
+    def test_sample_levels_are_prefixes(self):
+        """
+        Test that every stratum keeps at most the sample size, ranked at random.
+        """
+        self.sample.prepare()
+        self.assertEqual(self.sample.levels, [32, 128])
+        counts = self.sample.sample.groupby('LocationDesc').size()
+        self.assertEqual(counts.to_dict(), {'Ohio': 128, 'Texas': 128})
+        self.assertEqual(len(self.sample.level_rows(QUESTION, 32)), 64)
+
+    def test_estimates_cover_the_exact_means(self):
+        """
+        Test that the intervals of the estimates contain the exact means.
+        """
+        exact = self.df.groupby('LocationDesc')['Data_Value'].mean()
+        answer = self.sample.estimate('states_mean', [QUESTION], True, None)
+
+        self.assertTrue(answer['approximate'])
+        self.assertEqual(answer['sample_size'], 128)
+        self.assertEqual(list(answer['result']), ['Texas', 'Ohio'])
+        for state, (low, high) in answer['ci'].items():
+            self.assertLess(low, exact[state])
+            self.assertGreater(high, exact[state])
+            self.assertLess(high - low, 4.0)
+
+        global_mean = self.sample.estimate('global_mean', [QUESTION], True, None)
+        low, high = global_mean['ci']['global_mean']
+        self.assertTrue(low < self.df['Data_Value'].mean() < high)
+
+    def test_target_error_picks_the_smallest_level(self):
+        """
+        Test that a loose target error is met by the first level of the sample.
+        """
+        answer = self.sample.estimate('state_mean', [QUESTION, 'Ohio'], {'error': 5.0}, None)
+        self.assertEqual(answer['sample_size'], 32)
+        self.assertEqual(list(answer['result']), ['Ohio'])
+
+    def test_missed_target_error_falls_back_to_exact(self):
+        """
+        Test that the exact answer is computed when the sample is not precise enough.
+        """
+        answer = self.sample.estimate('state_mean', [QUESTION, 'Ohio'], {'error': 1e-6},
+                                      lambda: {'Ohio': 30.0})
+        self.assertFalse(answer['approximate'])
+        self.assertEqual(answer['result'], {'Ohio': 30.0})
+
+    def test_data_ingestor_approx_flag(self):
+        """
+        Test that the statistics accept the approx flag and keep the exact default.
+        """
+        data_ingestor = DataIngestor('./test.csv')
+        exact = data_ingestor.state_mean_by_category(QUESTION, 'Ohio')
+        answer = data_ingestor.state_mean_by_category(QUESTION, 'Ohio', True)
+
+        # The strata of test.csv are smaller than the sample, the answer is exact
+        self.assertEqual(answer['result'], exact)
+        self.assertEqual(answer['ci']['Ohio'], {key: [value, value]
+                                                for key, value in exact['Ohio'].items()})
+        with self.assertRaises(ValueError):
+            data_ingestor.best5('Not a question', True)
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.job_registry import JobRegistry
+from app.shared_store import SqliteJobStore
+from app.task_runner import new_job
+
+
+class TestSharedStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'jobs.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup_from_other_store(self):
+        """A job published by one store is visible, with its result, from another one."""
+        owner = SqliteJobStore(self.path)
+        job_info = new_job(3, lambda: {}, 'states_mean')
+        owner.add(job_info)
+
+        reader = SqliteJobStore(self.path)
+        self.assertEqual(reader.lookup(3)['status'], 'running')
+        self.assertIsNone(reader.lookup(4))
+
+        job_info['status'] = 'done'
+        owner.put(3, '{"a": 1}')
+        owner.finish(job_info)
+        self.assertEqual(reader.lookup(3)['status'], 'done')
+        self.assertEqual(reader.get(3), '{"a": 1}')
+
+    def test_respawned_process(self):
+        """A respawned process fails the jobs it lost and does not reuse their IDs."""
+        store = SqliteJobStore(self.path)
+        for job_id in (2, 5, 3):
+            store.add(new_job(job_id, lambda: {}, 'states_mean'))
+
+        self.assertEqual(store.fail_running(1, 3, 'Server process died'), 2)
+        self.assertEqual(store.lookup(5)['reason'], 'Server process died')
+        self.assertEqual(store.lookup(3)['status'], 'running')
+
+        registry = JobRegistry()
+        registry.interleave(1, 3, store.last_job_id(1, 3))
+        self.assertEqual(registry.allocate_id(), 8)
+        self.assertEqual(store.last_job_id(0, 3), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
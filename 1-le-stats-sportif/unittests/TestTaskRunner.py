@@ -0,0 +1,122 @@
+import time
+import unittest
+from app.task_runner import ThreadPool
+
+class TestTaskRunner(unittest.TestCase):
+    """
+    Test cases for the task runner module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.threadpool = ThreadPool()
+        self.threadpool.supervisor.interval = 0.05
+        self.threadpool.start()
+
+    def tearDown(self):
+        """
+        Tear down the test case.
+        """
+        self.threadpool.graceful_shutdown.set()
+
+    def wait_for(self, job_id, timeout = 2.0):
+        """
+        Wait until a job leaves the 'running' state.
+        """
+        deadline = time.time() + timeout
+        while self.threadpool.jobs[job_id]['status'] == 'running' and time.time() < deadline:
+            time.sleep(0.01)
+        return self.threadpool.jobs[job_id]
+
+    def test_failed_job_is_marked_as_error(self):
+        """
+        Test that a job raising an exception is reported as an error.
+        """
+        def task():
+            raise ValueError("State 'NotAState' not found in the dataset.")
+
+        self.threadpool.add_job(-1, task, 'state_mean')
+        job_info = self.wait_for(-1)
+
+        self.assertEqual(job_info['status'], 'error')
+        self.assertEqual(job_info['reason'], "State 'NotAState' not found in the dataset.")
+        self.assertEqual(self.threadpool.remaining_jobs, 0)
+        self.assertEqual(self.threadpool.supervisor.status()['failures'], {'state_mean': 1})
+
+    def test_workers_survive_failed_jobs(self):
+        """
+        Test that the pool keeps processing jobs after failures.
+        """
+        def failing_task():
+            raise KeyError('question')
+
+        for job_id in range(-1, -2 * self.threadpool.num_threads - 1, -1):
+            self.threadpool.add_job(job_id, failing_task, 'best5')
+
+        self.threadpool.add_job(-100, lambda: {"ok": 1}, 'global_mean')
+
+        self.assertEqual(self.wait_for(-100)['status'], 'done')
+        self.assertEqual(self.threadpool.supervisor.status()['alive_threads'],
+                         self.threadpool.num_threads)
+
+    def test_completion_event_is_set(self):
+        """
+        Test that waiters are woken up when a job completes, even if it fails.
+        """
+        def task():
+            raise ValueError("boom")
+
+        self.threadpool.add_job(-1, lambda: {"global_mean": 32.92}, 'global_mean')
+        self.threadpool.add_job(-2, task, 'global_mean')
+
+        self.assertTrue(self.threadpool.jobs[-1]['completed'].wait(2.0))
+        self.assertTrue(self.threadpool.jobs[-2]['completed'].wait(2.0))
+        self.assertEqual(self.threadpool.result_store.get(-1), '{"global_mean": 32.92}')
+
+    def test_cancel_queued_job(self):
+        """
+        Test that a job cancelled before it starts is skipped by the workers.
+        """
+        threadpool = ThreadPool()
+        threadpool.add_job(1, lambda: {"global_mean": 32.92}, 'global_mean')
+
+        self.assertTrue(threadpool.cancel_job(1))
+        self.assertFalse(threadpool.cancel_job(1))
+        self.assertEqual(threadpool.remaining_jobs, 0)
+
+        threadpool.start()
+        threadpool.queue.join()
+        threadpool.graceful_shutdown.set()
+        self.assertEqual(threadpool.jobs[1]['status'], 'cancelled')
+        self.assertNotIn('started', threadpool.jobs[1]['timestamps'])
+
+    def test_supervisor_respawns_dead_workers(self):
+        """
+        Test that the supervisor replaces a worker that is no longer alive.
+        """
+        def exit_worker():
+            raise SystemExit
+        workers = list(self.threadpool.threads)
+        # SystemExit is not an Exception, the worker running the job dies
+        self.threadpool.add_job(1, exit_worker)
+        self.assertEqual(self.wait_for(1)['status'], 'error')
+        deadline = time.time() + 2.0
+        while all(worker.is_alive() for worker in workers) and time.time() < deadline:
+            time.sleep(0.01)
+        dead = [worker for worker in workers if not worker.is_alive()]
+        self.assertEqual(len(dead), 1)
+        index = workers.index(dead[0])
+
+        deadline = time.time() + 2.0
+        while self.threadpool.supervisor.status()['respawns'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.threadpool.supervisor.status()['respawns'], 1)
+        self.assertIsNot(self.threadpool.threads[index], dead[0])
+        self.assertTrue(self.threadpool.threads[index].is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from app.data_ingestor import DataIngestor
+from app.task_runner import ThreadPool
+from app.tracing import ThreadIds, Trace, TraceBuffer, TraceExporter, activate, span
+
+QUESTION = 'Percent of adults who engage in no leisure-time physical activity'
+
+
+class TestTracing(unittest.TestCase):
+    """
+    Test cases for the per-job traces.
+    """
+
+    def test_span_outside_of_a_job(self):
+        """
+        Test that spans are not recorded when no trace is active.
+        """
+        trace = Trace(1)
+        with span('filter'):
+            pass
+        with activate(trace):
+            with span('filter', rows=3):
+                pass
+        with span('groupby'):
+            pass
+
+        self.assertEqual([s['name'] for s in trace.to_dict()['spans']], ['filter'])
+        self.assertEqual(trace.to_dict()['spans'][0]['args'], {'rows': 3})
+
+    def test_span_records_errors(self):
+        """
+        Test that a span left by an exception is recorded with the exception type.
+        """
+        trace = Trace(1)
+        with self.assertRaises(ValueError), activate(trace), span('validate'):
+            raise ValueError("Question 'x' not found in the dataset.")
+
+        self.assertEqual(trace.to_dict()['spans'][0]['args'], {'error': 'ValueError'})
+
+    def test_ring_buffer_drops_oldest(self):
+        """
+        Test that the buffer only keeps the latest traces.
+        """
+        buffer = TraceBuffer(capacity=3)
+        for job_id in range(5):
+            buffer.add(Trace(job_id))
+
+        self.assertEqual(len(buffer), 3)
+        self.assertIsNone(buffer.get(1))
+        self.assertEqual(buffer.get(4).job_id, 4)
+
+    def test_export_to_trace_event_file(self):
+        """
+        Test that the exported file is a Trace Event Format array.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces', 'jobs.json')
+            exporter = TraceExporter(path)
+            for job_id in (1, 2):
+                trace = Trace(job_id, 'best5')
+                trace.add('compute', 1.0, 1.5)
+                exporter.export(trace)
+            exporter.flush()
+
+            with open(path, encoding='utf-8') as file:
+                # The closing bracket is optional in the format, add it to parse the file
+                events = json.loads(file.read().rstrip(',\n') + ']')
+
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual([event['args']['job_id'] for event in spans], [1, 2])
+        self.assertEqual(spans[0]['ts'], 1e6)
+        self.assertEqual(spans[0]['dur'], 5e5)
+        self.assertTrue(any(event['ph'] == 'M' for event in events))
+
+    def test_thread_ids_are_bounded(self):
+        """
+        Test that a new thread reuses the number of the least recently seen one.
+        """
+        threads = ThreadIds(capacity = 2)
+        self.assertEqual(threads.lookup('TaskRunner-0'), (1, True))
+        self.assertEqual(threads.lookup('Thread-7 (process_request_thread)'), (2, True))
+        self.assertEqual(threads.lookup('TaskRunner-0'), (1, False))
+        self.assertEqual(threads.lookup('Thread-8 (process_request_thread)'), (2, True))
+        self.assertEqual(len(threads.ids), 2)
+
+    def test_failed_write_does_not_stop_the_exporter(self):
+        """
+        Test that the writer goes on after a failed write, and flush gives up in time.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = TraceExporter(directory)
+            exporter.export(Trace(1, 'best5'))
+            self.assertTrue(exporter.flush())
+
+            exporter.path = os.path.join(directory, 'jobs.json')
+            trace = Trace(2, 'best5')
+            trace.add('compute', 1.0, 1.5)
+            exporter.export(trace)
+            self.assertTrue(exporter.flush())
+            self.assertTrue(os.path.exists(exporter.path))
+
+            with exporter.done:
+                exporter.pending += 1
+            self.assertFalse(exporter.flush(timeout = 0.01))
+
+    def test_threads_are_stable_across_exported_traces(self):
+        """
+        Test that a thread keeps its number in every trace of a file, labelled once.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'jobs.json')
+            exporter = TraceExporter(path)
+            for job_id, threads in ((1, ['TaskRunner-3']), (2, ['TaskRunner-1', 'TaskRunner-3']),
+                                    (3, ['TaskRunner-1'])):
+                trace = Trace(job_id, 'best5')
+                for thread in threads:
+                    trace.add('compute', 1.0, 1.5, thread)
+                exporter.export(trace)
+            exporter.flush()
+
+            with open(path, encoding='utf-8') as file:
+                events = json.loads(file.read().rstrip(',\n') + ']')
+
+        labels = [event for event in events if event['ph'] == 'M']
+        self.assertEqual(sorted(event['args']['name'] for event in labels),
+                         ['TaskRunner-1', 'TaskRunner-3'])
+        names = {event['tid']: event['args']['name'] for event in labels}
+        spans = [(event['args']['job_id'], names[event['tid']])
+                 for event in events if event['ph'] == 'X']
+        self.assertEqual(spans, [(1, 'TaskRunner-3'), (2, 'TaskRunner-1'), (2, 'TaskRunner-3'),
+                                 (3, 'TaskRunner-1')])
+
+    def test_job_trace(self):
+        """
+        Test that a job executed by the pool has a trace of all its phases.
+        """
+        ingestor = DataIngestor('./test.csv')
+        threadpool = ThreadPool()
+        threadpool.start()
+        try:
+            threadpool.add_job(-1, lambda: ingestor.states_mean(QUESTION), 'states_mean',
+                               received=time.monotonic())
+            self.assertTrue(threadpool.jobs[-1]['completed'].wait(2.0))
+        finally:
+            threadpool.graceful_shutdown.set()
+
+        trace = threadpool.traces.get(-1).to_dict()
+        names = [s['name'] for s in trace['spans']]
+        for name in ('http.receive', 'enqueue', 'queue_wait', 'compute', 'validate',
+                     'filter', 'groupby', 'to_dict', 'serialize', 'write'):
+            self.assertIn(name, names)
+        runner = trace['spans'][names.index('queue_wait')]['args']['runner']
+        self.assertTrue(runner.startswith('TaskRunner-'))
+        self.assertEqual(trace['spans'][names.index('filter')]['thread'], runner)
+        self.assertNotIn('trace', threadpool.jobs[-1])
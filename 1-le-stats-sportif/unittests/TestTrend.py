@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app.data_ingestor import DataIngestor
+from app.trend import TrendEngine, fit_slopes
+
+OBESITY = 'Percent of adults aged 18 years and older who have obesity'
+
+
+def yearly(state, values, stratification='Male'):
+    """
+    Build the rows of a state, one per year from 2011.
+    """
+    return pd.DataFrame({
+        'Question': OBESITY,
+        'LocationDesc': state,
+        'YearStart': range(2011, 2011 + len(values)),
+        'Stratification1': stratification,
+        'Data_Value': values,
+    })
+
+
+class TestTrend(unittest.TestCase):
+    """
+    Test cases for the yearly trends of the states.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.df = pd.concat([
+            yearly('Ohio', [30.0, 31.0, 32.0, 33.0]),
+            yearly('Ohio', [40.0, 41.0, 42.0, 43.0], 'Female'),
+            yearly('Texas', [30.0, 28.0, np.nan, 24.0]),
+            yearly('Utah', [25.0]),
+        ], ignore_index=True)
+        self.engine = TrendEngine(self.df, [])
+
+    def test_fit_matches_polyfit(self):
+        """
+        Test that the vectorized fit matches a per-row least-squares fit.
+        """
+        rng = np.random.default_rng(0)
+        years = np.arange(2011, 2022)
+        means = rng.normal(30.0, 3.0, size=(20, len(years)))
+        means[rng.random(means.shape) < 0.3] = np.nan
+        means[0, 1:] = np.nan
+
+        slope, intercept, count = fit_slopes(years, means)
+
+        self.assertTrue(np.isnan(slope[0]))
+        for row in range(1, len(means)):
+            present = ~np.isnan(means[row])
+            expected = np.polyfit(years[present], means[row][present], 1)
+            self.assertAlmostEqual(slope[row], expected[0], places=9)
+            self.assertAlmostEqual(intercept[row], expected[1], places=5)
+            self.assertEqual(count[row], present.sum())
+
+    def test_trend_of_every_state(self):
+        """
+        Test the slopes, directions and order of the states.
+        """
+        result = self.engine.trend(OBESITY)
+        states = result['states']
+
+        self.assertEqual(result['years'], [2011, 2012, 2013, 2014])
+        # Obesity is better when lower, so decreasing states come first
+        self.assertEqual(list(states), ['Texas', 'Ohio', 'Utah'])
+        self.assertAlmostEqual(states['Texas']['slope'], -2.0)
+        self.assertEqual(states['Texas']['direction'], 'improving')
+        self.assertEqual(states['Texas']['means'], [30.0, 28.0, None, 24.0])
+        self.assertAlmostEqual(states['Ohio']['slope'], 1.0)
+        self.assertEqual(states['Ohio']['direction'], 'worsening')
+        self.assertIsNone(states['Utah']['slope'])
+
+    def test_state_and_stratification(self):
+        """
+        Test the trend of a single state and stratification.
+        """
+        result = self.engine.trend(OBESITY, 'Ohio', 'Female')
+        self.assertEqual(list(result['states']), ['Ohio'])
+        self.assertEqual(result['states']['Ohio']['means'], [40.0, 41.0, 42.0, 43.0])
+
+        with self.assertRaises(ValueError):
+            self.engine.trend(OBESITY, 'Atlantis')
+        with self.assertRaises(ValueError):
+            self.engine.trend(OBESITY, stratification='Robots')
+        with self.assertRaises(ValueError):
+            self.engine.trend('Not a question')
+
+    def test_fits_are_cached(self):
+        """
+        Test that the fit of a question is computed once.
+        """
+        data_ingestor = DataIngestor('./test.csv')
+        first = data_ingestor.trend(OBESITY)
+        self.assertEqual(first['years'], [2017])
+        self.assertIs(data_ingestor.trend(OBESITY)['states'], first['states'])
@@ -0,0 +1,65 @@
+import json
+import time
+import unittest
+from app.data_ingestor import DataIngestor
+from app.task_runner import ThreadPool
+from app.warmup import WARMUP_ENDPOINTS, Materializer, Payload
+
+MUSCLE = ('Percent of adults who engage in muscle-strengthening activities on 2 or more '
+          'days a week')
+
+
+class TestWarmup(unittest.TestCase):
+    """
+    Test cases for the startup warm-up.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case.
+        """
+        self.data_ingestor = DataIngestor('./test.csv')
+        self.materializer = Materializer(self.data_ingestor, threads=4)
+
+    def test_results_match_the_endpoints(self):
+        """
+        Test that the warmed-up payloads are the serialized results of the endpoints.
+        """
+        self.materializer.run()
+
+        for endpoint in WARMUP_ENDPOINTS:
+            payload = self.materializer.get(endpoint, [MUSCLE])
+            self.assertIsInstance(payload, Payload)
+            self.assertEqual(payload, json.dumps(getattr(self.data_ingestor, endpoint)(MUSCLE)))
+        self.assertIsNone(self.materializer.get('state_mean', [MUSCLE, 'Ohio']))
+        self.assertIsNone(self.materializer.get('states_mean', [MUSCLE, True]))
+
+    def test_progress(self):
+        """
+        Test the progress reported before, during and after the warm-up.
+        """
+        status = self.materializer.status()
+        self.assertFalse(status['ready'])
+        self.assertEqual(status['computed'], 0)
+
+        self.materializer.start()
+        deadline = time.time() + 5.0
+        while not self.materializer.ready and time.time() < deadline:
+            time.sleep(0.01)
+
+        status = self.materializer.status()
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['total'], 9 * len(WARMUP_ENDPOINTS))
+        # test.csv does not hold every question, their results fail alone
+        self.assertEqual(status['computed'] + len(status['failed']), status['total'])
+        self.assertGreater(status['computed'], 0)
+        self.assertTrue(all('not found' in failure['reason'] for failure in status['failed']))
+
+    def test_payloads_are_stored_as_is(self):
+        """
+        Test that the thread pool stores a warmed-up payload without encoding it again.
+        """
+        threadpool = ThreadPool()
+        payload = Payload('{"Ohio": 30.0}')
+        threadpool.run_inline(-1, lambda: payload, 'states_mean')
+        self.assertEqual(threadpool.result_store.get(-1), '{"Ohio": 30.0}')
@@ -0,0 +1,9 @@
+"""
+Unit tests of the Le Stats Sportif application.
+
+Importing any module of the app package starts the webserver on the dataset named
+by LESTATS_DATASET, which is not part of the sources: the tests serve test.csv.
+"""
+import os
+
+os.environ.setdefault('LESTATS_DATASET', './test.csv')
@@ -0,0 +1,32 @@
+"""
+Runs a standalone worker that executes the jobs of an API server started with
+LESTATS_BROKER set to the same broker database.
+
+The worker loads its own copy of the dataset (LESTATS_DATASET) and must run on the
+same host as the server: the broker is a SQLite database in WAL mode, which relies on
+shared memory and does not work over a network filesystem. Start several of them to
+scale the job execution.
+"""
+import logging
+import os
+import signal
+
+os.environ['LESTATS_ROLE'] = 'worker'
+
+# The app package reads LESTATS_ROLE when it is imported
+# pylint: disable=wrong-import-position
+from app.broker import SqliteBroker
+from app.data_ingestor import DataIngestor
+from app.worker import Worker
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    worker = Worker(SqliteBroker(os.environ.get('LESTATS_BROKER', 'results/broker.db')),
+                    DataIngestor(os.environ.get('LESTATS_DATASET',
+                                                './nutrition_activity_obesity_usa_subset.csv')))
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()